@@ -0,0 +1,37 @@
+from fastapi import APIRouter, Depends, Query
+from app.core.security import get_admin_user
+from app.core.config import settings
+from app.core.rate_limit import rate_limiter
+from app.db.sessions import replica_router
+from app.services.ai_usage import ai_usage
+from app.services.ai_scheduler import ai_scheduler
+from app.services.ai_reply_cache import reply_cache
+from app.services.outbox import dispatcher
+from app.websockets.drain import drainer
+from app.websockets.heartbeat import heartbeats
+
+router = APIRouter(tags=["Admin"], prefix="/admin")
+
+
+@router.get("/ai-usage")
+def get_ai_usage(limit: int = Query(50, ge=1, le=500), admin = Depends(get_admin_user)):
+    """AI latency and token usage in this worker, heaviest users and chats first."""
+    report = ai_usage.report(limit)
+    for row in report["users"]:
+        row["tokens_today"], row["daily_budget"] = ai_usage.budget_state(row["user_id"])
+    return report
+
+
+@router.get("/metrics")
+def get_metrics(admin = Depends(get_admin_user)):
+    return {
+        "ai_usage": ai_usage.report(limit=0)["totals"],
+        "ai_scheduler": ai_scheduler.stats(),
+        "ai_reply_cache": reply_cache.stats(),
+        "ai_daily_token_budget": settings.AI_USER_DAILY_TOKEN_BUDGET,
+        "outbox": {"delivered": dispatcher.delivered, "failed": dispatcher.failed},
+        "rate_limit_rejections": dict(rate_limiter.rejected),
+        "db_read_routing": replica_router.stats(),
+        "ws_drain": drainer.stats(),
+        "ws_heartbeat": heartbeats.stats(),
+    }
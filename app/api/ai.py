@@ -2,19 +2,37 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from app.db.sessions import get_db
 from app.core.security import get_current_user
-from app.schemas.ai import AIChatRequest, AIChatResponse
-from app.services.ai_service import get_ai_reply
+from app.schemas.ai import AIChatRequest, AIChatResponse, AICacheSettings
+from app.services.ai_service import get_ai_reply, reply_key
+from app.services.ai_reply_cache import reply_cache
+from app.services.membership_cache import get_membership
+from app.services.conversation_summary import build_context, request_fold
+from app.services.ai_usage import ai_usage, enforce_ai_budget
+from app.services.ai_scheduler import ai_scheduler, AIReplySuperseded, AISchedulerBusy, AIReplyTimeout
 from app.models.chat import Chat, Message
-from uuid import uuid4
+from app.websockets.event_buffer import event_buffer, message_event
+from app.core.rate_limit import enforce_rate_limit
+from app.core.versioning import bump_chat
+from uuid import UUID, uuid4
 
 router = APIRouter(tags=["AI"], prefix="/ai")
 
+
+def _scheduler_error(error: Exception) -> HTTPException:
+    if isinstance(error, AISchedulerBusy):
+        return HTTPException(status_code=503, detail=str(error), headers={"Retry-After": "5"})
+    return HTTPException(status_code=504, detail=str(error))
+
+
 @router.post("/chat", response_model=AIChatResponse)
 async def ai_chat(
     req: AIChatRequest,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
+    enforce_rate_limit("ai_chat", current_user.id, req.chat_id)
+    enforce_ai_budget(current_user.id)
+
     chat = db.query(Chat).filter(Chat.id == req.chat_id).first()
     if not chat or chat.type != "ai":
         raise HTTPException(status_code=400, detail="Not an AI chat")
@@ -23,14 +41,54 @@ async def ai_chat(
     user_msg = Message(id=uuid4(), chat_id=req.chat_id, sender_id=current_user.id, content=req.message)
     db.add(user_msg)
     db.commit()
+    db.refresh(user_msg)
+    event_buffer.append(str(req.chat_id), message_event(user_msg, current_user))
+    bump_chat(req.chat_id)
 
-    
-    reply = await get_ai_reply(req.message)
+    history, needs_fold = build_context(db, req.chat_id, req.message, exclude_id=user_msg.id)
+    try:
+        with ai_usage.track(current_user.id, req.chat_id):
+            reply = await reply_cache.get_or_create(
+                reply_key(req.message, history) if chat.ai_cache_enabled else None,
+                lambda: ai_scheduler.run(req.chat_id, lambda: get_ai_reply(req.message, history=history))
+            )
+    except AIReplySuperseded as e:
+        # The newer request in this chat saves the reply that answers both
+        try:
+            return AIChatResponse(reply=await e.newer.result())
+        except (AISchedulerBusy, AIReplyTimeout) as error:
+            raise _scheduler_error(error)
+    except (AISchedulerBusy, AIReplyTimeout) as error:
+        raise _scheduler_error(error)
 
-    
     ai_msg = Message(id=uuid4(), chat_id=req.chat_id, sender_id=None, content=reply)
     db.add(ai_msg)
+    if needs_fold:
+        request_fold(db, req.chat_id)
     db.commit()
+    db.refresh(ai_msg)
+    event_buffer.append(str(req.chat_id), message_event(ai_msg))
+    bump_chat(req.chat_id)
 
 
     return AIChatResponse(reply=reply)
+
+
+@router.put("/chats/{chat_id}/cache", response_model=AICacheSettings)
+def set_reply_cache(
+    chat_id: UUID,
+    cache_settings: AICacheSettings,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """Opt an AI chat in or out of answers shared through the reply cache."""
+    if not get_membership(db, chat_id, current_user.id):
+        raise HTTPException(status_code=403, detail="You are not a participant of this chat")
+
+    chat = db.query(Chat).filter(Chat.id == chat_id).first()
+    if not chat or chat.type != "ai":
+        raise HTTPException(status_code=400, detail="Not an AI chat")
+
+    chat.ai_cache_enabled = cache_settings.enabled
+    db.commit()
+    return AICacheSettings(enabled=chat.ai_cache_enabled)
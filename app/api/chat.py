@@ -1,17 +1,28 @@
-from fastapi import APIRouter,Depends,HTTPException,status
+from fastapi import APIRouter,Depends,HTTPException,status,Query,Request,Response
 from sqlalchemy.orm import Session,joinedload
-from sqlalchemy import desc
-from app.db.sessions import get_db
-from app.core.security import get_current_user
-from app.models.chat import Chat,ChatParticipant,Message
+from sqlalchemy import desc,insert,delete
+from sqlalchemy.exc import IntegrityError
+from app.db.sessions import get_db,get_read_db
+from app.core.security import get_current_user,get_current_reader
+from app.models.chat import Chat,ChatParticipant,Message,dm_key_for
 from app.models.user import User
-from app.schemas.chat import CreateChatRequest,ChatDetail,ChatHistoryResponse,ChatType,ChatParticipantMini,ChatSummaryMinimal
-from app.schemas.messages import MessageResponse,SendMessageRequest,FullMessageResponse,EditMessageRequest
+from app.schemas.chat import CreateChatRequest,ChatDetail,ChatHistoryResponse,ChatType,ChatSummaryMinimal
+from app.schemas.messages import MessageResponse,SendMessageRequest,FullMessageResponse,EditMessageRequest,BulkMessageRequest,BulkForwardRequest,BulkItemResult,BulkOperationResponse
 from app.schemas.pinned_message import PinnedMessageResponse
 from app.models.pinned_message import PinnedMessage
-from datetime import datetime
+from app.websockets.event_buffer import event_buffer,message_event,recent_events
+from app.services.membership_cache import membership_cache,get_membership
+from app.services.message_archive import archived_events,newest_archived
+from app.services.pin_cache import pin_cache
+from app.services.media_store import acquire,release
+from app.services.outbox import record_broadcast
+from app.core.rate_limit import enforce_rate_limit
+from app.core.versioning import not_modified,bump_chat,bump_user_chats,chat_key,user_chats_key
+from app.core.responses import fast_json,streamed_json
+from datetime import datetime,timedelta,timezone
 from uuid import uuid4
-from typing import List
+from typing import List,Optional
+from collections import Counter,defaultdict
 import uuid
 from uuid import UUID
 
@@ -19,6 +30,31 @@ from uuid import UUID
 router = APIRouter(tags=["Chat"],prefix="/chat")
 AI_USER_ID = uuid.UUID("00000000-0000-0000-0000-000000000001")
 
+def _chat_detail(chat:Chat,participant_ids:List[UUID])->ChatDetail:
+    return ChatDetail(
+        id=chat.id,
+        name=chat.name,
+        type=chat.type,
+        created_at=chat.created_at,
+        participants=participant_ids
+
+    )
+
+
+def _existing_dm(db:Session,dm_key:str)->Optional[ChatDetail]:
+    chat=db.query(Chat).filter(Chat.dm_key==dm_key).first()
+    if not chat:
+        return None
+    participant_ids=[user_id for (user_id,) in db.query(ChatParticipant.user_id).filter(ChatParticipant.chat_id==chat.id)]
+    return _chat_detail(chat,participant_ids)
+
+
+def _violates_dm_key(e:IntegrityError)->bool:
+    # Postgres names the constraint (ix_chats_dm_key from migration 0002); other drivers only say it in the message
+    constraint=getattr(getattr(e.orig,"diag",None),"constraint_name",None)
+    return "dm_key" in (constraint or str(e.orig))
+
+
 @router.post("/create-new-chat",response_model=ChatDetail)
 def create_chat(
         chat_data:CreateChatRequest,
@@ -31,31 +67,48 @@ def create_chat(
     if chat_data.type == ChatType.ai:
         chat_data.participant_ids = [current_user.id, AI_USER_ID]
 
+    participant_ids=list(dict.fromkeys(chat_data.participant_ids))
 
+    # A private chat between the same two users is returned instead of created again
+    dm_key=dm_key_for(participant_ids) if chat_data.type == ChatType.private else None
+    if dm_key:
+        existing=_existing_dm(db,dm_key)
+        if existing:
+            return existing
     
     new_chat=Chat(
         id=uuid4(),
         name=chat_data.name,
-        type=chat_data.type
+        type=chat_data.type,
+        dm_key=dm_key
     )
     db.add(new_chat)
-    db.flush()
+    try:
+        db.flush()
+    except IntegrityError as e:
+        db.rollback()
+        if not dm_key or not _violates_dm_key(e):
+            raise
+        # Lost a race with a concurrent request for the same DM
+        existing=_existing_dm(db,dm_key)
+        if not existing:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="This chat is being created by another request, try again"
+            )
+        return existing
 
-    for user_id in chat_data.participant_ids:
-        participant=ChatParticipant(user_id=user_id,chat_id=new_chat.id)
-        db.add(participant)
+    db.execute(insert(ChatParticipant),[
+        {"user_id":user_id,"chat_id":new_chat.id} for user_id in participant_ids
+    ])
 
     db.commit()
     db.refresh(new_chat)
+    membership_cache.invalidate_chat(new_chat.id,participant_ids)
+    for user_id in participant_ids:
+        bump_user_chats(user_id)
 
-    return ChatDetail(
-        id=new_chat.id,
-        name=new_chat.name,
-        type=new_chat.type,
-        created_at=new_chat.created_at,
-        participants=chat_data.participant_ids
-
-    )
+    return _chat_detail(new_chat,participant_ids)
 
 
 @router.post("/send-message",response_model=MessageResponse)
@@ -64,19 +117,17 @@ def send_message(
     db:Session=Depends(get_db),
     current_user:User=Depends(get_current_user)
 ):
-    chat = db.query(Chat).filter(Chat.id == message_data.chat_id).first()
-    if not chat:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Chat does not exist"
-        )
-    
-    participant=db.query(ChatParticipant).filter_by(
-        chat_id=message_data.chat_id,
-        user_id=current_user.id
-    ).first()
+    enforce_rate_limit("message",current_user.id,message_data.chat_id)
+
+    participant=get_membership(db,message_data.chat_id,current_user.id)
 
     if not participant:
+        chat = db.query(Chat).filter(Chat.id == message_data.chat_id).first()
+        if not chat:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Chat does not exist"
+            )
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail='You are not a participant of this chat'
@@ -91,19 +142,17 @@ def send_message(
     db.add(new_message)
     db.commit()
     db.refresh(new_message)
+    event_buffer.append(str(new_message.chat_id),message_event(new_message,current_user))
+    bump_chat(new_message.chat_id)
 
     return new_message
 
-@router.get("/current-chats", response_model=List[ChatSummaryMinimal])
-def get_user_chats(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
-):
-
-    chats = (
+def load_user_chats(db: Session, user_id) -> List[Chat]:
+    """Chats of a user, newest first, with participants and their users loaded."""
+    return (
         db.query(Chat)
         .join(ChatParticipant, ChatParticipant.chat_id == Chat.id)
-        .filter(ChatParticipant.user_id == current_user.id)
+        .filter(ChatParticipant.user_id == user_id)
         .options(
             joinedload(Chat.participants).joinedload(ChatParticipant.user)  # eager-load users
         )
@@ -111,7 +160,22 @@ def get_user_chats(
         .all()
     )
 
-    response: List[ChatSummaryMinimal] = []
+
+@router.get("/current-chats", response_model=List[ChatSummaryMinimal])
+def get_user_chats(
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_reader),
+):
+    cached = not_modified(request, response, [user_chats_key(current_user.id)], str(current_user.id))
+    if cached:
+        return cached
+
+    chats = load_user_chats(db, current_user.id)
+
+    # Built as plain dicts and encoded once, see app/core/responses.py
+    rows = []
 
     for chat in chats:
         # "Others" in this chat (exclude current user)
@@ -119,77 +183,143 @@ def get_user_chats(
 
         # Minimal participant payload
         participants = [
-            ChatParticipantMini(
-                id=u.id,
-                display_name=(u.full_name or u.username),
-                avatar_url=u.profile_image,
-            )
+            {
+                "id": u.id,
+                "display_name": (u.full_name or u.username),
+                "avatar_url": u.profile_image,
+            }
             for u in others
         ]
 
         # Display name for list/header
         if chat.type == ChatType.private:
             # DM: show the other user’s name
-            display_name = participants[0].display_name if participants else (chat.name or "Private")
+            display_name = participants[0]["display_name"] if participants else (chat.name or "Private")
             name_for_groups = None
         else:
             # Group: show chat.name (fallback if empty)
             display_name = chat.name or "Group"
             name_for_groups = chat.name
 
-        response.append(
-            ChatSummaryMinimal(
-                id=chat.id,
-                type=chat.type.value if hasattr(chat.type, "value") else chat.type,  # tolerate enum or str
-                display_name=display_name,
-                name=name_for_groups,
-                participants=participants,
-                created_at=chat.created_at,
-            )
+        rows.append({
+            "id": chat.id,
+            "type": chat.type.value if hasattr(chat.type, "value") else chat.type,  # tolerate enum or str
+            "display_name": display_name,
+            "name": name_for_groups,
+            "participants": participants,
+            "created_at": chat.created_at,
+        })
+
+    return fast_json(rows, headers=dict(response.headers))
+
+
+def _event_row(e:dict)->dict:
+    return {
+        "id":e["message_id"],
+        "chat_id":e["chat_id"],
+        "sender_id":e["sender_id"],
+        "content":e["content"],
+        "created_at":e["created_at"],
+        "is_edited":e["is_edited"],
+        "sender_name":e["sender_name"],
+        "sender_image":e["sender_image"],
+        "media_type":e["media_type"],
+        "media_url":e["media_url"],
+    }
+
+
+def load_history(db:Session,chat_id,after:Optional[datetime]=None,before:Optional[datetime]=None,newest:Optional[int]=None)->List[dict]:
+    """Hot messages of a chat between ``after`` and ``before``, oldest first; with ``newest`` only the newest N."""
+    messages_query=(
+        db.query(
+            Message.id,Message.chat_id,Message.sender_id,Message.content,Message.created_at,Message.is_edited,
+            User.full_name,User.username,User.profile_image,Message.media_type,Message.media_url,
         )
+        .outerjoin(User,User.id==Message.sender_id)
+        .filter(Message.chat_id==chat_id)
+    )
+
+    if after:
+        messages_query=messages_query.filter(Message.created_at>after)
+    if before:
+        messages_query=messages_query.filter(Message.created_at<before)
+
+    if newest:
+        messages=messages_query.order_by(Message.created_at.desc()).limit(newest).all()
+        messages.reverse()
+    else:
+        messages=messages_query.order_by(Message.created_at.asc()).all()
+
+    return [
+        {
+            "id":message_id,
+            "chat_id":message_chat_id,
+            "sender_id":sender_id,
+            "content":content,
+            "created_at":created_at,
+            "is_edited":bool(is_edited),
+            "sender_name":full_name or username,
+            "sender_image":profile_image,
+            "media_type":media_type,
+            "media_url":media_url,
+        }
+        for (message_id,message_chat_id,sender_id,content,created_at,is_edited,
+             full_name,username,profile_image,media_type,media_url) in messages
+    ]
+
+
+HISTORY_PAGE=100
+
 
-    return response
 @router.get("/history/{chat_id}",response_model=List[FullMessageResponse])
 def get_chat_history(
+    request:Request,
+    response:Response,
     chat_id:UUID,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    limit:Optional[int]=Query(None,ge=1,le=500,description="Only return the newest N messages"),
+    before:Optional[datetime]=Query(None,description="Page back: only messages older than this, archived months included"),
+    stream:bool=Query(False,description="Stream the JSON array in chunks"),
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_reader)
 
 ):
-    is_participant=db.query(ChatParticipant).filter_by(
-        chat_id=chat_id,
-        user_id=current_user.id
-    ).first()
+    is_participant=get_membership(db,chat_id,current_user.id)
 
     if not is_participant:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail='You are not authorized to view this chat'
         )
-    
-    messages_query=db.query(Message).filter(Message.chat_id==chat_id)
-
-    if is_participant.last_deleted_at:
-        messages_query=messages_query.filter(Message.created_at>is_participant.last_deleted_at)
-
-    messages = messages_query.order_by(Message.created_at.asc()).all()
-    
-    response=[]
 
-    for message in messages:
-        sender=db.query(User).filter_by(id=message.sender_id).first()
-        response.append(FullMessageResponse(
-            id=message.id,
-            chat_id=message.chat_id,
-            sender_id=message.sender_id,
-            sender_name=sender.full_name or sender.username,
-            content=message.content,
-            created_at=message.created_at,
-            media_type=message.media_type,
-            media_url=message.media_url,
-
-        ))
-    return response
+    cached=not_modified(request,response,[chat_key(chat_id)],str(is_participant.last_deleted_at))
+    if cached:
+        return cached
+    headers=dict(response.headers)
+    last_deleted_at=is_participant.last_deleted_at
+
+    if before:
+        if before.tzinfo:
+            before=before.astimezone(timezone.utc).replace(tzinfo=None)
+        # Cold storage is only read here, one capped page at a time
+        page=limit or HISTORY_PAGE
+        rows=load_history(db,chat_id,last_deleted_at,before,newest=page)
+        if len(rows)<page:
+            rows=[_event_row(e) for e in archived_events(db,chat_id,page-len(rows),last_deleted_at,before)]+rows
+        return fast_json(rows,headers=headers)
+
+    if limit:
+        # First page comes from the recent-message buffer when it covers it
+        rows=[_event_row(e) for e in recent_events(db,str(chat_id),limit,last_deleted_at)]
+    else:
+        rows=load_history(db,chat_id,last_deleted_at)
+    if not limit or len(rows)<limit:
+        # Older months are in cold storage; clients fetch them with ?before=
+        archived=newest_archived(db,chat_id,last_deleted_at)
+        if archived:
+            headers["X-Archived-Before"]=archived.isoformat()
+    if stream:
+        return streamed_json(rows,headers=headers)
+    return fast_json(rows,headers=headers)
 
 
 @router.delete("/clear-messages/{chat_id}")
@@ -208,6 +338,7 @@ def clear_chat_history(
     
     participant.last_deleted_at=datetime.utcnow()
     db.commit()
+    membership_cache.set_last_deleted(chat_id,current_user.id,participant.last_deleted_at)
 
     return {"detail":"Chat history deleted"}
 
@@ -232,8 +363,15 @@ def delete_message(
             detail="You are not authorized to delete this message"
         )
     
+    chat_id,deleted_id=str(message.chat_id),str(message.id)
+    release(db,[message.media_hash])
+    # No foreign key since messages is partitioned (migration 0001), so pins go here
+    db.execute(delete(PinnedMessage).where(PinnedMessage.message_id==message.id))
     db.delete(message)
     db.commit()
+    event_buffer.discard(chat_id,deleted_id)
+    pin_cache.invalidate(chat_id)
+    bump_chat(chat_id)
 
     return {"detail": "Message deleted successfully"}
     
@@ -261,6 +399,9 @@ def edit_message(
     message.content=message_data.content
     db.commit()
     db.refresh(message)
+    event_buffer.replace(str(message.chat_id),message_event(message,current_user))
+    pin_cache.invalidate(message.chat_id)
+    bump_chat(message.chat_id)
     return message
 
 @router.post("/pin-message/{message_id}")
@@ -273,9 +414,7 @@ def pin_message(
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
 
-    is_participant = db.query(ChatParticipant).filter_by(
-        chat_id=message.chat_id, user_id=current_user.id
-    ).first()
+    is_participant = get_membership(db, message.chat_id, current_user.id)
     if not is_participant:
         raise HTTPException(status_code=403, detail="Not allowed to pin in this chat")
 
@@ -283,27 +422,197 @@ def pin_message(
     if already_pinned:
         raise HTTPException(status_code=400, detail="Message already pinned")
 
-    pin = PinnedMessage(message_id=message_id, chat_id=message.chat_id)
+    chat_id = message.chat_id
+    pin = PinnedMessage(message_id=message_id, chat_id=chat_id)
     db.add(pin)
     db.commit()
+    pin_cache.invalidate(chat_id)
+    bump_chat(chat_id)
     return {"detail": "Message pinned"}
 
 @router.get("/pinned-messages/{chat_id}/", response_model=List[PinnedMessageResponse])
 def get_pinned_messages(
+    request: Request,
+    response: Response,
     chat_id: UUID,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_reader),
 ):
-    is_participant = db.query(ChatParticipant).filter_by(
-        chat_id=chat_id, user_id=current_user.id
-    ).first()
+    is_participant = get_membership(db, chat_id, current_user.id)
     if not is_participant:
         raise HTTPException(status_code=403, detail="Not allowed")
 
-    pins = (
-        db.query(PinnedMessage)
-        .filter_by(chat_id=chat_id)
-        .order_by(PinnedMessage.pinned_at.desc())
-        .all()
-    )
-    return pins
+    cached = not_modified(request, response, [chat_key(chat_id)])
+    if cached:
+        return cached
+
+    return pin_cache.get(db, chat_id)
+
+
+def _unique(ids:List[UUID])->List[UUID]:
+    return list(dict.fromkeys(ids))
+
+
+def _load_messages(db:Session,ids:List[UUID])->dict:
+    rows=db.query(Message).filter(Message.id.in_(ids)).all()
+    return {m.id:m for m in rows}
+
+
+@router.post("/messages/bulk-delete",response_model=BulkOperationResponse)
+def bulk_delete_messages(
+    data:BulkMessageRequest,
+    db:Session=Depends(get_db),
+    current_user:User=Depends(get_current_user)
+):
+    ids=_unique(data.message_ids)
+    messages=_load_messages(db,ids)
+
+    results=[]
+    deleted=defaultdict(list)
+    for message_id in ids:
+        message=messages.get(message_id)
+        if not message:
+            results.append(BulkItemResult(message_id=message_id,status="not_found"))
+        elif message.sender_id!=current_user.id:
+            results.append(BulkItemResult(message_id=message_id,status="forbidden"))
+        else:
+            deleted[str(message.chat_id)].append(message_id)
+            results.append(BulkItemResult(message_id=message_id,status="deleted"))
+
+    allowed=[message_id for ids_in_chat in deleted.values() for message_id in ids_in_chat]
+    if allowed:
+        db.execute(delete(PinnedMessage).where(PinnedMessage.message_id.in_(allowed)))
+        db.execute(delete(Message).where(Message.id.in_(allowed)))
+        release(db,[messages[message_id].media_hash for message_id in allowed])
+        for chat_id,message_ids in deleted.items():
+            record_broadcast(db,chat_id,{
+                "type":"messages_deleted",
+                "data":{"chat_id":chat_id,"message_ids":[str(m) for m in message_ids]}
+            })
+        db.commit()
+
+    for chat_id,message_ids in deleted.items():
+        pin_cache.invalidate(chat_id)
+        bump_chat(chat_id)
+        for message_id in message_ids:
+            event_buffer.discard(chat_id,str(message_id))
+
+    return BulkOperationResponse(results=results)
+
+
+@router.post("/messages/bulk-pin",response_model=BulkOperationResponse)
+def bulk_pin_messages(
+    data:BulkMessageRequest,
+    db:Session=Depends(get_db),
+    current_user:User=Depends(get_current_user)
+):
+    ids=_unique(data.message_ids)
+    messages=_load_messages(db,ids)
+    my_chats=membership_cache.chats_for_user(db,current_user.id)
+    already_pinned={
+        message_id for (message_id,) in
+        db.query(PinnedMessage.message_id).filter(PinnedMessage.message_id.in_(list(messages))).all()
+    }
+
+    results=[]
+    pins=[]
+    pinned=defaultdict(list)
+    now=datetime.utcnow()
+    for message_id in ids:
+        message=messages.get(message_id)
+        if not message:
+            results.append(BulkItemResult(message_id=message_id,status="not_found"))
+        elif str(message.chat_id) not in my_chats:
+            results.append(BulkItemResult(message_id=message_id,status="forbidden"))
+        elif message_id in already_pinned:
+            results.append(BulkItemResult(message_id=message_id,status="already_pinned"))
+        else:
+            pins.append({"id":uuid4(),"chat_id":message.chat_id,"message_id":message_id,"pinned_at":now})
+            pinned[str(message.chat_id)].append(message_id)
+            results.append(BulkItemResult(message_id=message_id,status="pinned"))
+
+    if pins:
+        db.execute(insert(PinnedMessage),pins)
+        for chat_id,message_ids in pinned.items():
+            record_broadcast(db,chat_id,{
+                "type":"messages_pinned",
+                "data":{"chat_id":chat_id,"message_ids":[str(m) for m in message_ids],"pinned_at":now.isoformat()}
+            })
+        db.commit()
+
+    for chat_id in pinned:
+        pin_cache.invalidate(chat_id)
+        bump_chat(chat_id)
+
+    return BulkOperationResponse(results=results)
+
+
+@router.post("/messages/bulk-forward",response_model=BulkOperationResponse)
+def bulk_forward_messages(
+    data:BulkForwardRequest,
+    db:Session=Depends(get_db),
+    current_user:User=Depends(get_current_user)
+):
+    my_chats=membership_cache.chats_for_user(db,current_user.id)
+    target_chat_id=str(data.target_chat_id)
+    if target_chat_id not in my_chats:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not a participant of the target chat"
+        )
+
+    ids=_unique(data.message_ids)
+    messages=_load_messages(db,ids)
+
+    results=[]
+    copies=[]
+    now=datetime.utcnow()
+    for message_id in ids:
+        message=messages.get(message_id)
+        if not message:
+            results.append(BulkItemResult(message_id=message_id,status="not_found"))
+        elif str(message.chat_id) not in my_chats:
+            results.append(BulkItemResult(message_id=message_id,status="forbidden"))
+        else:
+            copy=Message(
+                id=uuid4(),
+                chat_id=data.target_chat_id,
+                sender_id=current_user.id,
+                content=message.content,
+                media_url=message.media_url,
+                media_hash=message.media_hash,
+                media_type=message.media_type,
+                is_edited=False,
+                # keep the forwarded batch in its original order
+                created_at=now+timedelta(microseconds=len(copies)),
+            )
+            copies.append(copy)
+            results.append(BulkItemResult(message_id=message_id,status="forwarded",new_message_id=copy.id))
+
+    if copies:
+        db.execute(insert(Message),[
+            {
+                "id":m.id,
+                "chat_id":m.chat_id,
+                "sender_id":m.sender_id,
+                "content":m.content,
+                "media_url":m.media_url,
+                "media_hash":m.media_hash,
+                "media_type":m.media_type,
+                "is_edited":m.is_edited,
+                "created_at":m.created_at,
+            }
+            for m in copies
+        ])
+        # Copies share the stored file; each one holds a reference
+        for media_hash,count in Counter(m.media_hash for m in copies if m.media_hash).items():
+            acquire(db,media_hash,count)
+        events=[message_event(m,current_user) for m in copies]
+        record_broadcast(db,target_chat_id,{"type":"new_messages","data":events})
+        db.commit()
+
+        for event in events:
+            event_buffer.append(target_chat_id,event)
+        bump_chat(target_chat_id)
+
+    return BulkOperationResponse(results=results)
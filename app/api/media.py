@@ -1,19 +1,55 @@
-from fastapi import APIRouter,File,UploadFile,Form,HTTPException,Depends
+import asyncio
+from fastapi import APIRouter,File,UploadFile,Form,HTTPException,Depends,Request,Query
 from starlette.responses import JSONResponse
-from app.services.upload_to_s3 import upload_file_to_s3
+from app.services.media_store import store
 from sqlalchemy.orm import Session
 from uuid import UUID
-from app.websockets.connection_manager import manager
-import json
+from app.websockets.event_buffer import event_buffer,message_event
 from typing import Optional
 from app.core.security import get_current_user
 from app.models.chat import Message
 from app.models.user import User
 from app.db.sessions import get_db
+from app.core.rate_limit import enforce_rate_limit
+from app.core.versioning import bump_chat
+from app.services.outbox import record_broadcast
 from app.models.chat import Chat
+from app.services.membership_cache import get_membership
+from app.services import resumable_upload
+from app.schemas.upload import CreateUploadRequest,CompleteUploadRequest
 
 router=APIRouter(tags=['Media'])
 
+ALLOWED_TYPES=["image/jpeg","image/jpg","image/png","image/webp","video/mp4","video/quicktime"]
+
+
+def _media_message(db:Session,chat_id,user:User,media,content_type:str,content:Optional[str]):
+    media_type="image" if content_type.startswith("image/") else "video"
+    media_message=Message(
+        chat_id=chat_id,
+        sender_id=user.id,
+        media_url=media.url,
+        media_hash=media.sha256,
+        content=content,
+        media_type=media_type
+    )
+    db.add(media_message)
+    db.flush()
+
+    # The broadcast commits with the message and is sent by the outbox dispatcher
+    event=message_event(media_message,user)
+    record_broadcast(db,chat_id,{
+        "type": "new_message",
+        "data": event
+    })
+    return media_message,event
+
+
+def _announce(chat_id,event:dict):
+    # Once committed
+    event_buffer.append(str(chat_id),event)
+    bump_chat(chat_id)
+
 @router.post("/media/upload")
 
 async def upload_media(
@@ -23,9 +59,10 @@ async def upload_media(
     content:Optional[str]=Form(None),
     current_user:User=Depends(get_current_user)
 ):
+    enforce_rate_limit("media_upload",current_user.id,chat_id)
+
     try:
-        allowed_types=["image/jpeg","image/jpg","image/png","image/webp","video/mp4","video/quicktime"]
-        if file.content_type not in allowed_types:
+        if file.content_type not in ALLOWED_TYPES:
             raise HTTPException(status_code=400,detail="Unsupported file type")
         
         chat_present=db.query(Chat).filter(Chat.id==chat_id).first()
@@ -35,37 +72,131 @@ async def upload_media(
                 status_code=404,
                 detail="Chat does not exist"
             )
-        file_url=upload_file_to_s3(file,file.content_type,chat_id)
-
-        media_type="image" if file.content_type.startswith("image/") else "video"
-
-        media_message=Message(
-            chat_id=chat_id,
-            sender_id=current_user.id,
-            media_url=file_url,
-            content=content,
-            media_type=media_type
-        )
-        db.add(media_message)
+        # Hashed first; a file stored before is referenced again instead of uploaded again.
+        # Hashing and the S3 upload run in a thread, off the event loop
+        media,_uploaded=await asyncio.to_thread(store,db,file.file,file.filename,file.content_type)
+        media_message,event=_media_message(db,chat_id,current_user,media,file.content_type,content)
         db.commit()
-        db.refresh(media_message)
 
-        
-        await manager.broadcast(str(chat_id), json.dumps({
-            "type": "new_message",
-            "data": {
-                "message_id": str(media_message.id),
-                "chat_id": str(media_message.chat_id),
-                "sender_id": str(media_message.sender_id),
-                "content": media_message.content,
-                "media_url": media_message.media_url,
-                "media_type": media_message.media_type,
-                "created_at": media_message.created_at.isoformat()
-            }
-        }))
+        _announce(chat_id,event)
         return JSONResponse({
-            "media_url":file_url,
-            "media_type":media_type
+            "media_url":media.url,
+            "media_type":media_message.media_type
         })
     except Exception as e:
-        raise HTTPException(status_code=500,detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500,detail=str(e))
+
+
+# Resumable uploads for large files: create a session, PUT its chunks by offset in any
+# order (again if they failed), GET it for the offsets still missing, then complete it.
+
+@router.post("/media/uploads")
+async def create_upload(
+    data:CreateUploadRequest,
+    db:Session=Depends(get_db),
+    current_user:User=Depends(get_current_user)
+):
+    enforce_rate_limit("media_upload",current_user.id,data.chat_id)
+    if data.content_type not in ALLOWED_TYPES:
+        raise HTTPException(status_code=400,detail="Unsupported file type")
+    if not get_membership(db,data.chat_id,current_user.id):
+        raise HTTPException(status_code=403,detail="Not a participant of this chat")
+
+    upload=resumable_upload.create_session(
+        db,current_user.id,data.chat_id,data.filename,data.content_type,data.size
+    )
+    db.commit()
+    return resumable_upload.progress(db,upload)
+
+
+async def _read_chunk(request:Request,expected:int)->bytes:
+    # Read with a cap, so an oversized body is refused before it is buffered whole
+    declared=request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared)!=expected:
+        raise HTTPException(status_code=400,detail=f"Chunk must be {expected} bytes")
+    body=bytearray()
+    async for piece in request.stream():
+        body.extend(piece)
+        if len(body)>expected:
+            raise HTTPException(status_code=400,detail=f"Chunk must be {expected} bytes")
+    return bytes(body)
+
+
+@router.put("/media/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id:UUID,
+    request:Request,
+    offset:int=Query(...),
+    db:Session=Depends(get_db),
+    current_user:User=Depends(get_current_user)
+):
+    enforce_rate_limit("upload_chunk",current_user.id)
+    upload=resumable_upload.get_session(db,upload_id,current_user.id)
+    index,expected=resumable_upload.chunk_at(upload,offset)
+    body=await _read_chunk(request,expected)
+    await resumable_upload.put_chunk(db,upload,offset,body)
+    db.commit()
+    return {"upload_id":str(upload.id),"chunk":index,"offset":offset,"size":len(body)}
+
+
+@router.get("/media/uploads/{upload_id}")
+def get_upload(
+    upload_id:UUID,
+    db:Session=Depends(get_db),
+    current_user:User=Depends(get_current_user)
+):
+    upload=resumable_upload.get_session(db,upload_id,current_user.id)
+    return resumable_upload.progress(db,upload)
+
+
+@router.post("/media/uploads/{upload_id}/complete")
+async def complete_upload(
+    upload_id:UUID,
+    data:Optional[CompleteUploadRequest]=None,
+    db:Session=Depends(get_db),
+    current_user:User=Depends(get_current_user)
+):
+    upload=resumable_upload.lock_session(db,upload_id,current_user.id)
+    if upload.status=="completed":
+        # A retry after a lost response gets the same answer
+        message=db.query(Message).filter(Message.id==upload.message_id).first()
+        return {
+            "media_url":message.media_url if message else None,
+            "media_type":message.media_type if message else None,
+            "message_id":str(upload.message_id)
+        }
+    if not get_membership(db,upload.chat_id,current_user.id):
+        raise HTTPException(status_code=403,detail="Not a participant of this chat")
+
+    claimed=resumable_upload.claim(db,upload)
+    try:
+        media=await resumable_upload.finalize(db,upload,claimed)
+        media_message,event=_media_message(
+            db,upload.chat_id,current_user,media,upload.content_type,data.content if data else None
+        )
+        upload.message_id=media_message.id
+        db.commit()
+    except Exception:
+        resumable_upload.release_claim(db,upload_id,claimed)
+        raise
+
+    _announce(upload.chat_id,event)
+    return {
+        "media_url":media.url,
+        "media_type":media_message.media_type,
+        "message_id":str(media_message.id)
+    }
+
+
+@router.delete("/media/uploads/{upload_id}")
+def cancel_upload(
+    upload_id:UUID,
+    db:Session=Depends(get_db),
+    current_user:User=Depends(get_current_user)
+):
+    upload=resumable_upload.lock_session(db,upload_id,current_user.id)
+    if upload.status!="open":
+        raise HTTPException(status_code=409,detail="Upload already finalized")
+    resumable_upload.abort(db,upload)
+    db.commit()
+    return {"detail":"Upload cancelled"}
@@ -1,13 +1,14 @@
-from fastapi import APIRouter,Depends ,HTTPException , Query
+from fastapi import APIRouter,Depends ,HTTPException , Query, Request, Response
 from sqlalchemy.orm import Session
 from app.schemas.auth import UserResponse
-from app.db.sessions import get_db
-from app.core.security import get_current_user
-from app.schemas.user import UserSummary ,UserDetail
+from app.db.sessions import get_db,get_read_db
+from app.core.security import get_current_user,get_current_reader
+from app.schemas.user import UserSummary ,UserDetail, BatchStatusRequest, UserStatus
 from app.models.user import User
-from typing import List,Optional
+from typing import List,Optional,Dict
 from uuid import UUID
 from app.services.auth_service import search_other_users
+from app.core.versioning import not_modified, DIRECTORY_KEY
 
 router = APIRouter(
     tags=["Users"]
@@ -23,16 +24,30 @@ def get_my_profile(
 
 @router.get("/users", response_model=List[UserSummary])
 def list_users(
+    request: Request,
+    response: Response,
     q: Optional[str] = Query(None, alias="query", min_length=1, description="Search by username/full_name/email"),
     limit: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_reader),
 ):
+    cached = not_modified(request, response, [DIRECTORY_KEY], str(current_user.id))
+    if cached:
+        return cached
     return search_other_users(db, current_user.id, q, limit)
 
 
+@router.post("/users/status/batch",response_model=Dict[UUID,UserStatus])
+def get_users_status(data:BatchStatusRequest,db:Session=Depends(get_read_db),current_user: User = Depends(get_current_reader)):
+    rows=db.query(User.id,User.is_online,User.last_seen).filter(User.id.in_(set(data.user_ids))).all()
+    return {
+        user_id:UserStatus(is_online=bool(is_online),last_seen=last_seen)
+        for (user_id,is_online,last_seen) in rows
+    }
+
+
 @router.get("/users/{user_id}",response_model=UserDetail)
-def get_user_by_id(user_id:UUID,db:Session=Depends(get_db),current_user: User = Depends(get_current_user)):
+def get_user_by_id(user_id:UUID,db:Session=Depends(get_read_db),current_user: User = Depends(get_current_reader)):
     user=db.query(User).filter(User.id==user_id).first()
     if not user:
         raise HTTPException(
@@ -42,7 +57,7 @@ def get_user_by_id(user_id:UUID,db:Session=Depends(get_db),current_user: User =
     return user
 
 @router.get("/users/{user_id}/status")
-def get_user_status(user_id:UUID,db:Session=Depends(get_db)):
+def get_user_status(user_id:UUID,db:Session=Depends(get_read_db)):
     user=db.query(User).filter(User.id==user_id).first()
     if not user:
         raise HTTPException(
@@ -1,4 +1,5 @@
 from pydantic_settings import BaseSettings
+from typing import Optional
 from fastapi.security import OAuth2PasswordBearer,HTTPBearer
 
 
@@ -14,6 +15,34 @@ class Settings(BaseSettings):
     SMTP_PASS:str
     FRONTEND_RESET_URL:str
     openai_api_key: str
+    # Comma-separated read replicas for read-only endpoints; all reads go to the primary when empty
+    DATABASE_REPLICA_URLS:str=""
+    # Replicas further behind than this are skipped
+    REPLICA_MAX_LAG_SECONDS:float=5
+    # After committing a write, a user reads from the primary for this long
+    READ_YOUR_WRITES_SECONDS:float=5
+    # Sockets silent this long get a server ping; silent past the timeout they are closed
+    WS_HEARTBEAT_INTERVAL_SECONDS:float=25
+    WS_IDLE_TIMEOUT_SECONDS:float=60
+    # Shared store for rate limiting across workers; in-process when unset
+    REDIS_URL:Optional[str]=None
+    # Set when a single worker process serves the API. Without REDIS_URL, ETag/Last-Modified
+    # are only sent then, as in-process version stamps cannot see other workers' writes;
+    # likewise history and reconnect replay are only served from the recent-message buffer
+    SINGLE_WORKER:bool=False
+    # Prompt size for AI chats: rolling summary + recent turns + the new message
+    AI_CONTEXT_TOKEN_BUDGET:int=2000
+    # "openai" (any OpenAI-compatible server via LLM_BASE_URL) or "stub" for offline load tests
+    LLM_BACKEND:str="openai"
+    LLM_MODEL:str="gpt-4o-mini"
+    LLM_BASE_URL:Optional[str]=None
+    LLM_STUB_LATENCY_MS:float=400
+    LLM_STUB_TOKENS_PER_SECOND:float=60
+    LLM_STUB_REPLY_TOKENS:int=60
+    # Prompt + completion tokens per user per UTC day; 0 disables the budget
+    AI_USER_DAILY_TOKEN_BUDGET:int=200_000
+    # Comma-separated emails allowed on /admin endpoints
+    ADMIN_EMAILS:str=""
 
     class Config:
         env_file=".env"
@@ -0,0 +1,176 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+from uuid import uuid4
+
+from fastapi import HTTPException, status
+
+from app.core.config import settings
+
+try:
+    import redis
+except ImportError:  # only needed when REDIS_URL is set
+    redis = None
+
+# event -> scope -> (tokens refilled per second, bucket size)
+LIMITS: Dict[str, Dict[str, Tuple[float, float]]] = {
+    "message": {"user": (5, 20), "chat": (50, 100)},
+    "typing": {"user": (2, 5), "chat": (20, 40)},
+    "ai_chat": {"user": (0.5, 3)},
+    "media_upload": {"user": (0.2, 5)},
+    # Chunks of resumable uploads (app/services/resumable_upload.py), 8 MiB each
+    "upload_chunk": {"user": (10, 40)},
+    # AI requests of users close to their daily token budget (see app/services/ai_usage.py)
+    "ai_budget": {"user": (1 / 30, 2)},
+    # /ws/user control frames; each one runs database queries
+    "subscribe": {"user": (5, 50)},
+    "watch_presence": {"user": (1, 10)},
+}
+
+# Everything a worker admits, across all users and chats; keyed by worker, so it stays
+# per-worker overload protection in a shared store
+GLOBAL_LIMIT: Tuple[float, float] = (500, 1000)
+GLOBAL_KEY = f"global:{uuid4().hex}"
+
+# Low-priority events are only admitted while the global bucket is above this fraction,
+# so under overload typing indicators are shed long before messages are
+PRIORITY_RESERVE: Dict[str, float] = {
+    "typing": 0.5,
+}
+
+MAX_BUCKETS = 100_000
+
+
+# (key, tokens refilled per second, bucket size, reserve fraction)
+Bucket = Tuple[str, float, float, float]
+
+
+class InMemoryBucketStore:
+    def __init__(self, max_buckets: int = MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        # key -> (tokens, last refill timestamp)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take_all(self, buckets: List[Bucket], take: bool = True) -> Tuple[bool, float]:
+        """
+        One token from every bucket, or from none when any of them would drop below its
+        ``reserve * burst``; returns (ok, retry_after). ``take=False`` only checks.
+        """
+        now = time.monotonic()
+        ok, retry_after = True, 0.0
+        with self._lock:
+            refilled = []
+            for key, rate, burst, reserve in buckets:
+                tokens, updated = self._buckets.get(key, (burst, now))
+                tokens = min(burst, tokens + (now - updated) * rate)
+                floor = reserve * burst
+                if tokens - 1 < floor:
+                    ok = False
+                    retry_after = max(retry_after, (floor + 1 - tokens) / rate)
+                refilled.append((key, tokens))
+            for key, tokens in refilled:
+                self._buckets[key] = (tokens - 1 if ok and take else tokens, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return ok, retry_after
+
+    def take(self, key: str, rate: float, burst: float, reserve: float = 0.0) -> Tuple[bool, float]:
+        return self.take_all([(key, rate, burst, reserve)])
+
+
+class RedisBucketStore:
+    # Same refill arithmetic as InMemoryBucketStore.take_all, run atomically inside Redis.
+    # ARGV: now, take, then rate, burst, reserve for each key
+    SCRIPT = """
+    local now, take = tonumber(ARGV[1]), tonumber(ARGV[2])
+    local ok, wait, refilled = 1, 0, {}
+    for i = 1, #KEYS do
+        local rate, burst, reserve = tonumber(ARGV[3 * i]), tonumber(ARGV[3 * i + 1]), tonumber(ARGV[3 * i + 2])
+        local state = redis.call('HMGET', KEYS[i], 'tokens', 'updated')
+        local tokens = tonumber(state[1]) or burst
+        local updated = tonumber(state[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+        local floor = reserve * burst
+        if tokens - 1 < floor then
+            ok = 0
+            wait = math.max(wait, (floor + 1 - tokens) / rate)
+        end
+        refilled[i] = tokens
+    end
+    for i = 1, #KEYS do
+        local rate, burst = tonumber(ARGV[3 * i]), tonumber(ARGV[3 * i + 1])
+        local tokens = refilled[i]
+        if ok == 1 and take == 1 then tokens = tokens - 1 end
+        redis.call('HSET', KEYS[i], 'tokens', tokens, 'updated', now)
+        redis.call('EXPIRE', KEYS[i], math.ceil(burst / rate) + 1)
+    end
+    return {ok, tostring(wait)}
+    """
+
+    def __init__(self, url: str):
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    def take_all(self, buckets: List[Bucket], take: bool = True) -> Tuple[bool, float]:
+        args = [time.time(), int(take)]
+        for _key, rate, burst, reserve in buckets:
+            args += [rate, burst, reserve]
+        ok, retry_after = self.script(keys=[f"ratelimit:{key}" for key, *_ in buckets], args=args)
+        return bool(ok), float(retry_after)
+
+    def take(self, key: str, rate: float, burst: float, reserve: float = 0.0) -> Tuple[bool, float]:
+        return self.take_all([(key, rate, burst, reserve)])
+
+
+class RateLimiter:
+    def __init__(self, store=None):
+        self.store = store or InMemoryBucketStore()
+        self.rejected: Dict[str, int] = {}
+
+    def hit(self, event: str, user_id, chat_id=None) -> Tuple[bool, float]:
+        """
+        Admit one ``event``; returns (allowed, seconds until it would be). Its user, chat
+        and global buckets are taken in one atomic call, from all or none of them, so a
+        client over its own limit never drains the chat's or the worker's.
+        """
+        scopes = LIMITS.get(event, {})
+        buckets = [
+            (f"{event}:{scope}:{ident}", *scopes[scope], 0.0)
+            for scope, ident in (("user", user_id), ("chat", chat_id))
+            if scope in scopes and ident is not None
+        ]
+        buckets.append((GLOBAL_KEY, *GLOBAL_LIMIT, PRIORITY_RESERVE.get(event, 0.0)))
+        ok, retry_after = self.store.take_all(buckets)
+        if not ok:
+            self.rejected[event] = self.rejected.get(event, 0) + 1
+        return ok, retry_after
+
+
+def _build_limiter() -> RateLimiter:
+    if settings.REDIS_URL and redis is not None:
+        return RateLimiter(RedisBucketStore(settings.REDIS_URL))
+    return RateLimiter()
+
+
+rate_limiter = _build_limiter()
+
+
+def enforce_rate_limit(event: str, user_id, chat_id=None):
+    allowed, retry_after = rate_limiter.hit(event, user_id, chat_id)
+    if not allowed:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Too many {event} requests, slow down",
+            headers={"Retry-After": str(max(1, round(retry_after)))}
+        )
+
+
+def throttled_frame(event: str, retry_after: float) -> dict:
+    return {
+        "type": "throttled",
+        "event": event,
+        "retry_after": round(retry_after, 3)
+    }
@@ -3,7 +3,7 @@ from jose import JWTError,jwt
 from fastapi import HTTPException,status,Depends
 from sqlalchemy.orm import Session
 from app.core.config import settings,oauth2_scheme
-from app.db.sessions import get_db
+from app.db.sessions import get_db,get_read_db
 from app.models.user import User
 
 
@@ -19,7 +19,7 @@ def decode_access_token(token:str)->dict:
         )
     
 
-def get_current_user(token:str=Depends(oauth2_scheme),db:Session=Depends(get_db))->User:
+def _user_for_token(token,db:Session)->User:
     token_str = token.credentials
 
     payload = decode_access_token(token_str)
@@ -40,3 +40,22 @@ def get_current_user(token:str=Depends(oauth2_scheme),db:Session=Depends(get_db)
         )
     
     return user
+
+def get_current_user(token:str=Depends(oauth2_scheme),db:Session=Depends(get_db))->User:
+    user=_user_for_token(token,db)
+    # Writes committed in this session keep the user's reads on the primary for a while
+    db.info["user_id"]=str(user.id)
+    return user
+
+# For read-only endpoints: resolves the user through the same (possibly replica) session
+def get_current_reader(token:str=Depends(oauth2_scheme),db:Session=Depends(get_read_db))->User:
+    return _user_for_token(token,db)
+
+def get_admin_user(current_user:User=Depends(get_current_user))->User:
+    admins={email.strip().lower() for email in settings.ADMIN_EMAILS.split(",") if email.strip()}
+    if (current_user.email or "").lower() not in admins:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return current_user
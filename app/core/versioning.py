@@ -0,0 +1,113 @@
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request, Response
+
+from app.core.config import settings
+
+try:
+    import redis
+except ImportError:  # only needed when REDIS_URL is set
+    redis = None
+
+# Keys that were never bumped report the worker's start time, so a restart can never
+# answer 304 for content it has not seen
+_BOOT_NS = time.time_ns()
+
+
+class InMemoryVersionStore:
+    def __init__(self):
+        self._stamps = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> int:
+        return self._stamps.get(key, _BOOT_NS)
+
+    def bump(self, key: str):
+        with self._lock:
+            self._stamps[key] = max(time.time_ns(), self.get(key) + 1)
+
+
+class RedisVersionStore:
+    def __init__(self, url: str):
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> int:
+        value = self.client.get(f"version:{key}")
+        return int(value) if value else _BOOT_NS
+
+    def bump(self, key: str):
+        self.client.set(f"version:{key}", time.time_ns())
+
+
+versions = RedisVersionStore(settings.REDIS_URL) if settings.REDIS_URL and redis is not None else InMemoryVersionStore()
+# A worker's in-memory stamps miss writes handled by other workers, and a 304 built on
+# them would keep clients on stale data indefinitely; so no validators unless shared
+VALIDATORS_ENABLED = isinstance(versions, RedisVersionStore) or settings.SINGLE_WORKER
+
+
+# Messages and pins of one chat
+def bump_chat(chat_id):
+    versions.bump(f"chat:{chat_id}")
+
+
+# The chat list of one user
+def bump_user_chats(user_id):
+    versions.bump(f"user_chats:{user_id}")
+
+
+# Anything shown in the user directory (profiles, presence)
+def bump_directory():
+    versions.bump("directory")
+
+
+def chat_key(chat_id) -> str:
+    return f"chat:{chat_id}"
+
+
+def user_chats_key(user_id) -> str:
+    return f"user_chats:{user_id}"
+
+
+DIRECTORY_KEY = "directory"
+
+
+def not_modified(request: Request, response: Response, keys: list, *extra) -> Optional[Response]:
+    """
+    Set ETag/Last-Modified from the version stamps of ``keys``; returns a 304 response
+    when the client already has this version. ``extra`` covers anything else the body
+    depends on (query params, the caller's clear point, ...).
+    """
+    if not VALIDATORS_ENABLED:
+        return None
+    stamps = [versions.get(key) for key in keys]
+    digest = hashlib.sha1(repr((keys, stamps, extra, str(request.url.query))).encode()).hexdigest()[:20]
+    etag = f'W/"{digest}"'
+    headers = {"ETag": etag}
+    newest = max(stamps)
+    last_modified = datetime.fromtimestamp(newest // 1_000_000_000, tz=timezone.utc)
+    # Last-Modified has one-second resolution; only advertise it once no later write can share that second
+    if time.time_ns() - newest >= 1_000_000_000:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+            return Response(status_code=304, headers=headers)
+    elif "Last-Modified" in headers and request.headers.get("if-modified-since"):
+        try:
+            if last_modified <= parsedate_to_datetime(request.headers["if-modified-since"]):
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+
+    # Read from a replica that may not have the newest version yet: send the body without
+    # validators, so the client cannot keep older data under the current ETag
+    read_lag = getattr(request.state, "read_lag", None)
+    if read_lag is None or time.time_ns() - newest >= read_lag * 1_000_000_000:
+        response.headers.update(headers)
+    return None
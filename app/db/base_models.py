@@ -2,5 +2,10 @@ from app.models.user import User
 from app.models.chat import Chat, ChatParticipant, Message
 from app.models.pinned_message import PinnedMessage
 from app.models.password_reset import PasswordResetToken
+from app.models.message_archive import MessageArchive, ArchivedMedia
+from app.models.outbox import OutboxEvent
+from app.models.chat_summary import ChatSummary
+from app.models.media_object import MediaObject
+from app.models.upload_session import UploadSession, UploadPart
 
 
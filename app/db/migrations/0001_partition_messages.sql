@@ -0,0 +1,75 @@
+-- Move `messages` to monthly range partitions on created_at.
+--
+-- Postgres requires the partition key in every unique constraint, so the primary key
+-- becomes (id, created_at) and pinned_messages.message_id can no longer be a real
+-- foreign key; the application keeps that link (see app/models/pinned_message.py).
+--
+-- Run once with: psql "$DATABASE_URL" -f app/db/migrations/0001_partition_messages.sql
+
+BEGIN;
+
+ALTER TABLE pinned_messages DROP CONSTRAINT IF EXISTS pinned_messages_message_id_fkey;
+CREATE INDEX IF NOT EXISTS ix_pinned_messages_message_id ON pinned_messages (message_id);
+
+ALTER TABLE messages RENAME TO messages_legacy;
+ALTER TABLE messages_legacy RENAME CONSTRAINT messages_pkey TO messages_legacy_pkey;
+ALTER INDEX IF EXISTS ix_messages_chat_id RENAME TO ix_messages_legacy_chat_id;
+ALTER INDEX IF EXISTS ix_messages_sender_id RENAME TO ix_messages_legacy_sender_id;
+
+CREATE TABLE messages (
+    id UUID NOT NULL,
+    chat_id UUID REFERENCES chats (id),
+    sender_id UUID REFERENCES users (id),
+    content TEXT,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    media_url VARCHAR,
+    media_type VARCHAR,
+    is_edited BOOLEAN,
+    CONSTRAINT messages_pkey PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+
+-- messages_pYYYYMM covers [month, month + 1 month)
+CREATE OR REPLACE FUNCTION create_messages_partition(month DATE) RETURNS TEXT AS $$
+DECLARE
+    start_at DATE := date_trunc('month', month)::DATE;
+    partition_name TEXT := 'messages_p' || to_char(start_at, 'YYYYMM');
+BEGIN
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+        partition_name, start_at, (start_at + INTERVAL '1 month')::DATE
+    );
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT create_messages_partition(m::DATE)
+FROM generate_series(
+    date_trunc('month', (SELECT coalesce(min(created_at), now()) FROM messages_legacy)),
+    date_trunc('month', now()) + INTERVAL '3 months',
+    INTERVAL '1 month'
+) AS m;
+
+INSERT INTO messages (id, chat_id, sender_id, content, created_at, media_url, media_type, is_edited)
+SELECT id, chat_id, sender_id, content, coalesce(created_at, now() AT TIME ZONE 'utc'), media_url, media_type, is_edited
+FROM messages_legacy;
+
+DROP TABLE messages_legacy;
+
+-- History and AI context filter by chat and sort by created_at
+CREATE INDEX ix_messages_chat_id_created_at ON messages (chat_id, created_at);
+CREATE INDEX ix_messages_sender_id ON messages (sender_id);
+
+CREATE TABLE message_archives (
+    id UUID PRIMARY KEY,
+    chat_id UUID NOT NULL,
+    period_start TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    period_end TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    object_key VARCHAR NOT NULL,
+    message_count INTEGER NOT NULL,
+    archived_at TIMESTAMP WITHOUT TIME ZONE
+);
+CREATE INDEX ix_message_archives_chat_id_period_start ON message_archives (chat_id, period_start);
+
+COMMIT;
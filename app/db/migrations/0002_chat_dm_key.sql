@@ -0,0 +1,33 @@
+-- One private chat per pair of users.
+--
+-- Existing duplicates are left in place; only the oldest DM of each pair gets the key,
+-- so create_chat returns that one from now on.
+--
+-- Run once with: psql "$DATABASE_URL" -f app/db/migrations/0002_chat_dm_key.sql
+
+BEGIN;
+
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS dm_key VARCHAR;
+
+WITH pairs AS (
+    SELECT c.id,
+           string_agg(p.user_id::TEXT, ':' ORDER BY p.user_id::TEXT COLLATE "C") AS dm_key,
+           c.created_at
+    FROM chats c
+    JOIN chat_participants p ON p.chat_id = c.id
+    WHERE c.type = 'PRIVATE'
+    GROUP BY c.id, c.created_at
+    HAVING count(*) = 2
+),
+oldest AS (
+    SELECT DISTINCT ON (dm_key) id, dm_key
+    FROM pairs
+    ORDER BY dm_key, created_at, id
+)
+UPDATE chats SET dm_key = oldest.dm_key
+FROM oldest
+WHERE chats.id = oldest.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS ix_chats_dm_key ON chats (dm_key);
+
+COMMIT;
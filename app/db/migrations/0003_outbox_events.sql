@@ -0,0 +1,22 @@
+-- Transactional outbox for side effects that must survive a crash after commit
+-- (see app/services/outbox.py).
+--
+-- Run once with: psql "$DATABASE_URL" -f app/db/migrations/0003_outbox_events.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS outbox_events (
+    id BIGSERIAL PRIMARY KEY,
+    kind VARCHAR NOT NULL,
+    payload JSON NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT (now() AT TIME ZONE 'utc'),
+    available_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    dispatched_at TIMESTAMP WITHOUT TIME ZONE,
+    failed_at TIMESTAMP WITHOUT TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS ix_outbox_events_pending ON outbox_events (dispatched_at, failed_at, available_at);
+
+COMMIT;
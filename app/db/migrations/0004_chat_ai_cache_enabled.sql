@@ -0,0 +1,9 @@
+-- Per-chat opt-out of the AI reply cache (see app/services/ai_reply_cache.py).
+--
+-- Run once with: psql "$DATABASE_URL" -f app/db/migrations/0004_chat_ai_cache_enabled.sql
+
+BEGIN;
+
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS ai_cache_enabled BOOLEAN NOT NULL DEFAULT true;
+
+COMMIT;
@@ -0,0 +1,17 @@
+-- Rolling summaries that keep AI chat prompts within a token budget
+-- (see app/services/conversation_summary.py).
+--
+-- Run once with: psql "$DATABASE_URL" -f app/db/migrations/0005_chat_summaries.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS chat_summaries (
+    chat_id UUID PRIMARY KEY REFERENCES chats (id),
+    summary TEXT NOT NULL DEFAULT '',
+    covered_until TIMESTAMP WITHOUT TIME ZONE,
+    covered_message_id UUID,
+    folded_messages INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+COMMIT;
@@ -0,0 +1,22 @@
+-- Indexes for the hot statements checked by app/db/query_plans.py.
+--
+-- chat_participants is keyed (user_id, chat_id), so member lookups by chat had no
+-- leading index; pinned_messages had none on chat_id; user search matches
+-- '%q%' substrings, which only trigram indexes can serve.
+--
+-- pg_trgm ships with Postgres but creating the extension needs a role allowed to.
+--
+-- Run once with: psql "$DATABASE_URL" -f app/db/migrations/0006_hot_query_indexes.sql
+
+BEGIN;
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS ix_chat_participants_chat_id ON chat_participants (chat_id);
+CREATE INDEX IF NOT EXISTS ix_pinned_messages_chat_id_pinned_at ON pinned_messages (chat_id, pinned_at);
+
+CREATE INDEX IF NOT EXISTS ix_users_username_trgm ON users USING gin (username gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_users_full_name_trgm ON users USING gin (full_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_users_email_trgm ON users USING gin (email gin_trgm_ops);
+
+COMMIT;
@@ -0,0 +1,26 @@
+-- Content-addressed media: one S3 object per distinct file, reference counted
+-- (see app/services/media_store.py).
+--
+-- Media uploaded before this keeps its per-message object and messages.media_hash
+-- stays NULL for it; compaction still deletes those by URL.
+--
+-- Run once with: psql "$DATABASE_URL" -f app/db/migrations/0007_media_objects.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS media_objects (
+    sha256 VARCHAR(64) PRIMARY KEY,
+    object_key VARCHAR NOT NULL UNIQUE,
+    url VARCHAR NOT NULL UNIQUE,
+    content_type VARCHAR NOT NULL,
+    size BIGINT NOT NULL,
+    ref_count INTEGER NOT NULL DEFAULT 0,
+    released_at TIMESTAMP WITHOUT TIME ZONE,
+    created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+CREATE INDEX IF NOT EXISTS ix_media_objects_unreferenced ON media_objects (ref_count, released_at);
+
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS media_hash VARCHAR(64);
+
+COMMIT;
@@ -0,0 +1,36 @@
+-- Resumable chunked uploads (see app/services/resumable_upload.py). Each session is
+-- one S3 multipart upload; upload_parts records which chunks have arrived.
+--
+-- Run once with: psql "$DATABASE_URL" -f app/db/migrations/0008_upload_sessions.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    id UUID PRIMARY KEY,
+    user_id UUID NOT NULL REFERENCES users (id),
+    chat_id UUID NOT NULL REFERENCES chats (id),
+    filename VARCHAR,
+    content_type VARCHAR NOT NULL,
+    size BIGINT NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    object_key VARCHAR NOT NULL UNIQUE,
+    s3_upload_id VARCHAR NOT NULL,
+    status VARCHAR NOT NULL DEFAULT 'open',
+    message_id UUID,
+    created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT (now() AT TIME ZONE 'utc'),
+    expires_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_upload_sessions_user_id ON upload_sessions (user_id);
+CREATE INDEX IF NOT EXISTS ix_upload_sessions_expires_at ON upload_sessions (expires_at);
+
+CREATE TABLE IF NOT EXISTS upload_parts (
+    session_id UUID NOT NULL REFERENCES upload_sessions (id) ON DELETE CASCADE,
+    part_number INTEGER NOT NULL,
+    etag VARCHAR NOT NULL,
+    size BIGINT NOT NULL,
+    uploaded_at TIMESTAMP WITHOUT TIME ZONE DEFAULT (now() AT TIME ZONE 'utc'),
+    PRIMARY KEY (session_id, part_number)
+);
+
+COMMIT;
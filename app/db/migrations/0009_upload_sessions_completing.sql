@@ -0,0 +1,10 @@
+-- Finalizing an upload claims its session first (status 'completing'), so overlapping
+-- or retried finalize requests cannot assemble it twice (see app/services/resumable_upload.py).
+--
+-- Run once with: psql "$DATABASE_URL" -f app/db/migrations/0009_upload_sessions_completing.sql
+
+BEGIN;
+
+ALTER TABLE upload_sessions ADD COLUMN IF NOT EXISTS completing_at TIMESTAMP WITHOUT TIME ZONE;
+
+COMMIT;
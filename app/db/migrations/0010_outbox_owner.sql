@@ -0,0 +1,10 @@
+-- Broadcast events are delivered by the worker that wrote them, to its own sockets;
+-- other kinds stay claimable by any worker (see app/services/outbox.py).
+--
+-- Run once with: psql "$DATABASE_URL" -f app/db/migrations/0010_outbox_owner.sql
+
+BEGIN;
+
+ALTER TABLE outbox_events ADD COLUMN IF NOT EXISTS owner VARCHAR;
+
+COMMIT;
@@ -0,0 +1,19 @@
+-- Media URLs referenced from each archive segment, so compaction can tell which legacy
+-- objects are still in use without downloading segments (see app/services/message_archive.py).
+--
+-- Run once with: psql "$DATABASE_URL" -f app/db/migrations/0011_archived_media.sql
+-- then index the segments archived before it, before the next compaction run:
+--     python -m app.services.message_archive --index-media
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS archived_media (
+    archive_id UUID NOT NULL REFERENCES message_archives (id) ON DELETE CASCADE,
+    media_url VARCHAR NOT NULL,
+    refs INTEGER NOT NULL,
+    PRIMARY KEY (archive_id, media_url)
+);
+
+CREATE INDEX IF NOT EXISTS ix_archived_media_media_url ON archived_media (media_url);
+
+COMMIT;
@@ -0,0 +1,12 @@
+-- Resumable uploads register their object under a pending hash ("upload:<session>")
+-- and are hashed in the background; this finds the messages to update then
+-- (see app/services/resumable_upload.py). Only pending rows are indexed.
+--
+-- Run once with: psql "$DATABASE_URL" -f app/db/migrations/0012_pending_media.sql
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS ix_messages_pending_media_hash ON messages (media_hash)
+    WHERE media_hash LIKE 'upload:%';
+
+COMMIT;
@@ -0,0 +1,317 @@
+"""
+Query-plan regression checks for the hot statements.
+
+Runs each statement through the same code the API uses, captures the SQL it sends,
+and re-runs it under EXPLAIN (ANALYZE, BUFFERS). A check fails when a guarded table
+is read by a sequential scan, or when the plan examines more rows or touches more
+buffers than the statement's budget.
+
+Point it at a scratch Postgres with all migrations applied:
+
+    python -m app.db.query_plans --database-url postgresql://localhost/chat_plans --seed
+    python -m app.db.query_plans --database-url postgresql://localhost/chat_plans
+
+Budgets are sized for the default seed; pass --budget-scale when seeding more.
+Exits with status 1 when any check fails.
+"""
+import argparse
+import re
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, List, NamedTuple, Optional
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session, sessionmaker
+
+import app.db.base_models  # noqa: F401  registers every mapper
+from app.api.chat import load_history, load_user_chats
+from app.core.config import settings
+from app.services.auth_service import search_other_users
+from app.services.membership_cache import MembershipCache
+from app.services.pin_cache import load_pins
+
+# Never read by a sequential scan on the hot path; partitions count as their parent
+GUARDED = {"users", "chats", "chat_participants", "messages", "pinned_messages"}
+_PARTITION = re.compile(r"^(messages)_(p\d{6}|default)$")
+
+FIRST_NAMES = (
+    "Olivia Liam Emma Noah Ava Elijah Sophia James Isabella Lucas Mia Mason Amelia Ethan Harper "
+    "Aiden Evelyn Logan Abigail Jacob Emily Jackson Ella Sebastian Chloe Mateo Grace Owen Zoe Levi"
+).split()
+LAST_NAMES = (
+    "Smith Johnson Williams Brown Jones Garcia Miller Davis Rodriguez Martinez Hernandez Lopez "
+    "Gonzalez Wilson Anderson Thomas Taylor Moore Jackson Martin Lee Perez Thompson White Harris "
+    "Sanchez Clark Ramirez Lewis Robinson Walker Young Allen King Wright Scott Torres Nguyen Hill "
+    "Flores Green Adams Nelson Baker Hall Rivera Campbell Mitchell Carter Roberts"
+).split()
+
+
+class Sample(NamedTuple):
+    busy_chat_id: str
+    last_deleted_at: datetime
+    busy_user_id: str
+    pinned_chat_id: Optional[str]
+    search_term: str
+
+
+class HotQuery(NamedTuple):
+    name: str
+    run: Callable[[Session, Sample], object]
+    max_rows: int
+    max_buffers: int
+
+
+def _history(db: Session, s: Sample):
+    # GET /chat/history/{chat_id} without a limit or cursor
+    return load_history(db, s.busy_chat_id, s.last_deleted_at)
+
+
+def _current_chats(db: Session, s: Sample):
+    # GET /chat/current-chats
+    return load_user_chats(db, s.busy_user_id)
+
+
+HOT_QUERIES = [
+    HotQuery("history", _history, max_rows=3000, max_buffers=4000),
+    HotQuery("current_chats", _current_chats, max_rows=1000, max_buffers=600),
+    # A fresh cache each time so the lookup always reaches the database
+    HotQuery("chat_members", lambda db, s: MembershipCache().members(db, s.busy_chat_id), max_rows=200, max_buffers=60),
+    HotQuery("user_chats", lambda db, s: MembershipCache().chats_for_user(db, s.busy_user_id), max_rows=200, max_buffers=60),
+    HotQuery("user_search", lambda db, s: search_other_users(db, s.busy_user_id, s.search_term, 20), max_rows=2000, max_buffers=1000),
+    HotQuery("pinned", lambda db, s: load_pins(db, s.pinned_chat_id), max_rows=500, max_buffers=600),
+]
+
+
+@contextmanager
+def captured(engine):
+    """Collect (statement, parameters) for everything sent to the driver inside the block."""
+    statements = []
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before)
+
+
+def _relation(name: Optional[str]) -> Optional[str]:
+    if name is None:
+        return None
+    match = _PARTITION.match(name)
+    return match.group(1) if match else name
+
+
+def _nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _nodes(child)
+
+
+def inspect_plan(plan: dict) -> dict:
+    """Sequential scans of guarded tables, rows examined by table reads, and buffers touched."""
+    seq_scans, rows = [], 0
+    for node in _nodes(plan):
+        relation = _relation(node.get("Relation Name"))
+        if relation is None:
+            continue
+        if node["Node Type"] == "Seq Scan" and relation in GUARDED:
+            seq_scans.append(node["Relation Name"])
+        examined = node.get("Actual Rows", 0) + node.get("Rows Removed by Filter", 0)
+        examined += node.get("Rows Removed by Index Recheck", 0)
+        rows += examined * node.get("Actual Loops", 1)
+    return {
+        "seq_scans": seq_scans,
+        "rows": int(rows),
+        "buffers": plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0),
+    }
+
+
+def format_plan(plan: dict, depth: int = 0) -> List[str]:
+    label = plan["Node Type"]
+    if plan.get("Relation Name"):
+        label += f" on {plan['Relation Name']}"
+    if plan.get("Index Name"):
+        label += f" using {plan['Index Name']}"
+    lines = [f"{'  ' * depth}{label} (rows={plan.get('Actual Rows')} loops={plan.get('Actual Loops')})"]
+    for child in plan.get("Plans", []):
+        lines.extend(format_plan(child, depth + 1))
+    return lines
+
+
+def explain(db: Session, statement: str, parameters) -> dict:
+    result = db.connection().exec_driver_sql(
+        "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, parameters
+    ).scalar()
+    return result[0]
+
+
+def check(db: Session, query: HotQuery, sample: Sample, scale: float = 1.0) -> dict:
+    with captured(db.get_bind()) as statements:
+        query.run(db, sample)
+    report = {"name": query.name, "statements": [], "failures": []}
+    for statement, parameters in statements:
+        root = explain(db, statement, parameters)
+        found = inspect_plan(root["Plan"])
+        found["plan"] = format_plan(root["Plan"])
+        found["ms"] = root.get("Execution Time")
+        report["statements"].append(found)
+        for relation in found["seq_scans"]:
+            report["failures"].append(f"sequential scan on {relation}")
+        if found["rows"] > query.max_rows * scale:
+            report["failures"].append(f"examined {found['rows']} rows, budget {int(query.max_rows * scale)}")
+        if found["buffers"] > query.max_buffers * scale:
+            report["failures"].append(f"touched {found['buffers']} buffers, budget {int(query.max_buffers * scale)}")
+    return report
+
+
+def pick_sample(db: Session) -> Sample:
+    """The heaviest realistic parameters: busiest chat, most-joined user, most-pinned chat."""
+    busy_chat = db.execute(text(
+        "SELECT chat_id FROM messages GROUP BY chat_id ORDER BY count(*) DESC LIMIT 1"
+    )).scalar()
+    if busy_chat is None:
+        raise SystemExit("No messages found; run with --seed against a scratch database first")
+    last_deleted_at = db.execute(text(
+        "SELECT last_deleted_at FROM chat_participants WHERE chat_id = :chat_id ORDER BY last_deleted_at NULLS LAST LIMIT 1"
+    ), {"chat_id": busy_chat}).scalar()
+    busy_user = db.execute(text(
+        "SELECT user_id FROM chat_participants GROUP BY user_id ORDER BY count(*) DESC LIMIT 1"
+    )).scalar()
+    pinned_chat = db.execute(text(
+        "SELECT chat_id FROM pinned_messages GROUP BY chat_id ORDER BY count(*) DESC LIMIT 1"
+    )).scalar()
+    term = db.execute(text(
+        "SELECT split_part(full_name, ' ', 2) FROM users WHERE full_name LIKE '% %' LIMIT 1"
+    )).scalar()
+    return Sample(
+        busy_chat_id=str(busy_chat),
+        # Members who cleared their history read only what came after
+        last_deleted_at=last_deleted_at or datetime.utcnow() - timedelta(days=30),
+        busy_user_id=str(busy_user),
+        pinned_chat_id=str(pinned_chat) if pinned_chat else None,
+        search_term=term or "user",
+    )
+
+
+def _sql_array(words) -> str:
+    return "ARRAY[" + ",".join(f"'{w}'" for w in words) + "]"
+
+
+def seed(db: Session, users: int, chats: int, messages: int, pin_ratio: float):
+    """Fill an empty database with generate_series data: group and private chats, months of history."""
+    if db.execute(text("SELECT EXISTS (SELECT 1 FROM users)")).scalar():
+        raise SystemExit("Refusing to seed: users is not empty (use a scratch database)")
+
+    db.execute(text(f"""
+        INSERT INTO users (id, email, username, full_name, hashed_password, is_active, is_verified,
+                           is_superuser, is_online, created_at)
+        SELECT gen_random_uuid(), 'user' || n || '@example.com', 'user' || n,
+               ({_sql_array(FIRST_NAMES)})[1 + n % {len(FIRST_NAMES)}] || ' ' ||
+               ({_sql_array(LAST_NAMES)})[1 + (n / {len(FIRST_NAMES)}) % {len(LAST_NAMES)}],
+               'x', true, true, false, false, now()
+        FROM generate_series(1, :users) AS n
+    """), {"users": users})
+    db.execute(text("""
+        INSERT INTO chats (id, name, type, created_at, ai_cache_enabled)
+        SELECT gen_random_uuid(), 'chat ' || n,
+               (CASE WHEN n % 3 = 0 THEN 'GROUP' ELSE 'PRIVATE' END)::chattype,
+               (now() AT TIME ZONE 'utc') - n * INTERVAL '1 minute', true
+        FROM generate_series(1, :chats) AS n
+    """), {"chats": chats})
+
+    db.execute(text("CREATE TEMP TABLE seed_users AS SELECT id, row_number() OVER (ORDER BY id) AS n FROM users"))
+    db.execute(text("CREATE TEMP TABLE seed_chats AS SELECT id, type, row_number() OVER (ORDER BY id) AS n FROM chats"))
+    # Private chats get two members, groups three to twelve
+    db.execute(text("""
+        INSERT INTO chat_participants (user_id, chat_id)
+        SELECT u.id, c.id
+        FROM seed_chats c
+        CROSS JOIN LATERAL generate_series(1, CASE WHEN c.type = 'PRIVATE' THEN 2 ELSE 3 + c.n % 10 END) AS k
+        JOIN seed_users u ON u.n = 1 + (c.n * 7919 + k * 104729) % :users
+        ON CONFLICT DO NOTHING
+    """), {"users": users})
+    db.execute(text("""
+        CREATE TEMP TABLE seed_participants AS
+        SELECT user_id, chat_id, row_number() OVER (ORDER BY chat_id, user_id) AS n FROM chat_participants
+    """))
+
+    # Six months of history, so partitions exist for all of it where messages is partitioned
+    if db.execute(text("SELECT EXISTS (SELECT 1 FROM pg_proc WHERE proname = 'create_messages_partition')")).scalar():
+        db.execute(text("""
+            SELECT create_messages_partition(m::DATE)
+            FROM generate_series(date_trunc('month', now() - INTERVAL '180 days'), now(), INTERVAL '1 month') AS m
+        """))
+    db.execute(text("""
+        INSERT INTO messages (id, chat_id, sender_id, content, created_at, is_edited)
+        SELECT gen_random_uuid(), p.chat_id, p.user_id, 'message ' || m,
+               (now() AT TIME ZONE 'utc') - random() * INTERVAL '180 days', false
+        FROM generate_series(1, :messages) AS m
+        JOIN seed_participants p
+          ON p.n = 1 + (m::BIGINT * 2654435761) % (SELECT count(*) FROM seed_participants)
+    """), {"messages": messages})
+    db.execute(text("""
+        INSERT INTO pinned_messages (id, chat_id, message_id, pinned_at)
+        SELECT gen_random_uuid(), chat_id, id, created_at + INTERVAL '1 hour'
+        FROM messages WHERE random() < :ratio
+    """), {"ratio": pin_ratio})
+    db.execute(text("""
+        UPDATE chat_participants SET last_deleted_at = (now() AT TIME ZONE 'utc') - INTERVAL '30 days'
+        WHERE random() < 0.2
+    """))
+    db.commit()
+    # Fresh statistics, or the planner works from empty-table estimates
+    with db.get_bind().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("ANALYZE")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", default=None, help="defaults to DATABASE_URL")
+    parser.add_argument("--seed", action="store_true", help="fill an empty database before checking")
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--chats", type=int, default=5_000)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--pin-ratio", type=float, default=0.002)
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="multiply every row and buffer budget")
+    parser.add_argument("--only", default=None, help="comma-separated check names")
+    parser.add_argument("--plans", action="store_true", help="print every plan, not just failing ones")
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url or settings.DATABASE_URL)
+    db = sessionmaker(bind=engine)()
+    try:
+        if args.seed:
+            seed(db, args.users, args.chats, args.messages, args.pin_ratio)
+        sample = pick_sample(db)
+        wanted = set(args.only.split(",")) if args.only else None
+
+        failed = False
+        for query in HOT_QUERIES:
+            if wanted and query.name not in wanted:
+                continue
+            if query.name == "pinned" and sample.pinned_chat_id is None:
+                print(f"SKIP {query.name}: no pinned messages")
+                continue
+            report = check(db, query, sample, args.budget_scale)
+            ok = not report["failures"]
+            failed |= not ok
+            for found in report["statements"]:
+                print(f"{'OK  ' if ok else 'FAIL'} {query.name}: rows={found['rows']} "
+                      f"buffers={found['buffers']} ms={found['ms']}")
+                if args.plans or not ok:
+                    print("\n".join("      " + line for line in found["plan"]))
+            for failure in report["failures"]:
+                print(f"      {failure}")
+            # EXPLAIN ANALYZE runs the statement; nothing here should persist
+            db.rollback()
+    finally:
+        db.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,205 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from fastapi import Request
+from jose import JWTError, jwt
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session, sessionmaker
 from app.core.config import settings
 
+try:
+    import redis
+except ImportError:  # only needed when REDIS_URL is set
+    redis = None
+
 engine=create_engine(settings.DATABASE_URL)
 
 SessionLocal=sessionmaker(autocommit=False,autoflush=False,bind=engine)
 
+# Replica lag is measured at most this often per replica
+LAG_CHECK_SECONDS = 2
+# A replica that failed its lag check is left alone for this long
+REPLICA_COOLDOWN_SECONDS = 10
+# Recent writers remembered per worker, oldest dropped first
+MAX_STICKY_USERS = 100_000
+
+# Seconds behind the primary; 0 when fully replayed (an idle primary sends nothing to replay)
+REPLICA_LAG_SQL = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE coalesce(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
 def get_db():
     db=SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.engine = create_engine(url, pool_pre_ping=True)
+        self.sessions = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.lag: Optional[float] = None
+        self.checked_at = 0.0
+        self.down_until = 0.0
+
+
+class InMemoryStickyStore:
+    def __init__(self, max_users: int = MAX_STICKY_USERS):
+        self.max_users = max_users
+        self._until: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def note(self, user_id: str, seconds: float):
+        with self._lock:
+            self._until[user_id] = time.monotonic() + seconds
+            self._until.move_to_end(user_id)
+            while len(self._until) > self.max_users:
+                self._until.popitem(last=False)
+
+    def active(self, user_id: str) -> bool:
+        return self._until.get(user_id, 0.0) > time.monotonic()
+
+
+class RedisStickyStore:
+    """Shares stickiness, so a write on one worker routes that user's reads on every worker."""
+
+    def __init__(self, url: str):
+        self.client = redis.Redis.from_url(url)
+
+    def note(self, user_id: str, seconds: float):
+        self.client.set(f"db_sticky:{user_id}", 1, ex=max(1, math.ceil(seconds)))
+
+    def active(self, user_id: str) -> bool:
+        return bool(self.client.exists(f"db_sticky:{user_id}"))
+
+
+class ReplicaRouter:
+    """
+    Picks a replica for read-only sessions. Users who committed a write within
+    ``sticky_seconds`` read from the primary, so they see their own writes; replicas
+    lagging more than ``max_lag`` seconds or failing their check are skipped.
+    """
+
+    def __init__(self, urls: List[str], max_lag: float, sticky_seconds: float, store=None):
+        self.replicas = [Replica(url) for url in urls]
+        self.max_lag = max_lag
+        self.sticky_seconds = sticky_seconds
+        self.store = store or InMemoryStickyStore()
+        self._next = 0
+        self._lock = threading.Lock()
+        self.counts = {"replica": 0, "primary_sticky": 0, "primary_fallback": 0}
+
+    def note_write(self, user_id):
+        if self.replicas and user_id:
+            self.store.note(str(user_id), self.sticky_seconds)
+
+    def _lag(self, replica: Replica) -> Optional[float]:
+        now = time.monotonic()
+        if now < replica.down_until:
+            return None
+        if now - replica.checked_at >= LAG_CHECK_SECONDS:
+            try:
+                with replica.engine.connect() as conn:
+                    replica.lag = float(conn.execute(REPLICA_LAG_SQL).scalar() or 0)
+            except Exception:
+                replica.lag = None
+                replica.down_until = now + REPLICA_COOLDOWN_SECONDS
+            replica.checked_at = now
+        return replica.lag
+
+    def pick(self, user_id=None) -> Optional[Replica]:
+        """A healthy replica, round-robin, or None for the primary."""
+        if not self.replicas:
+            return None
+        if user_id and self.store.active(str(user_id)):
+            self.counts["primary_sticky"] += 1
+            return None
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.replicas)
+        for i in range(len(self.replicas)):
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            lag = self._lag(replica)
+            if lag is not None and lag <= self.max_lag:
+                self.counts["replica"] += 1
+                return replica
+        self.counts["primary_fallback"] += 1
+        return None
+
+    def stats(self) -> dict:
+        return {
+            **self.counts,
+            "replicas": [
+                {"url": r.engine.url.render_as_string(hide_password=True), "lag_s": r.lag,
+                 "down": time.monotonic() < r.down_until}
+                for r in self.replicas
+            ],
+        }
+
+
+def _build_router() -> ReplicaRouter:
+    urls = [url.strip() for url in settings.DATABASE_REPLICA_URLS.split(",") if url.strip()]
+    store = RedisStickyStore(settings.REDIS_URL) if urls and settings.REDIS_URL and redis is not None else None
+    return ReplicaRouter(urls, settings.REPLICA_MAX_LAG_SECONDS, settings.READ_YOUR_WRITES_SECONDS, store)
+
+
+replica_router = _build_router()
+
+
+# Sessions carrying info["user_id"] (set at authentication) make that user sticky once a write commits
+@event.listens_for(Session, "after_flush")
+def _flushed(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _executed(orm_execute_state):
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info["wrote"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _committed(session):
+    if session.info.pop("wrote", False):
+        replica_router.note_write(session.info.get("user_id"))
+
+
+@event.listens_for(Session, "after_rollback")
+def _rolled_back(session):
+    session.info.pop("wrote", None)
+
+
+def is_replica(db: Session) -> bool:
+    """True for sessions that may lag the primary; caches must not keep what they load."""
+    return bool(db.info.get("replica"))
+
+
+def _token_subject(request: Request) -> Optional[str]:
+    # Only picks the route; authentication itself still happens in get_current_reader
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"]).get("sub")
+    except JWTError:
+        return None
+
+
+def get_read_db(request: Request):
+    """Session for read-only endpoints: a healthy replica unless the caller wrote just now."""
+    replica = replica_router.pick(_token_subject(request))
+    # How far behind this session may be; versioning uses it to avoid caching ahead of the data
+    request.state.read_lag = replica.lag + LAG_CHECK_SECONDS if replica else None
+    db = replica.sessions() if replica else SessionLocal()
+    db.info["replica"] = replica is not None
+    try:
+        yield db
+    finally:
+        db.close()
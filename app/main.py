@@ -1,9 +1,28 @@
 from fastapi import FastAPI
-from app.api import auth,user,chat,media,ai
+from app.api import auth,user,chat,media,ai,admin
 from app.websockets.ws_chat import router as ws_router
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from contextlib import asynccontextmanager
+from app.services.outbox import dispatcher
+from app.websockets.drain import drainer
+from app.websockets.heartbeat import heartbeats
 
-app=FastAPI()
+
+@asynccontextmanager
+async def lifespan(app:FastAPI):
+    # Delivers broadcasts, AI replies and emails recorded in the outbox
+    dispatcher.start()
+    # One sweeper pings idle sockets and reaps dead ones
+    heartbeats.start()
+    # SIGTERM drains sockets gradually before the server drops them
+    drainer.install_signal_handlers()
+    yield
+    await heartbeats.stop()
+    await dispatcher.stop()
+
+
+app=FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:3000",
@@ -16,14 +35,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],            
     allow_headers=["*"],            
+    expose_headers=["ETag","Last-Modified","X-Archived-Before"],
 )
 
+# Small bodies are not worth the CPU; level 5 trades a little ratio for much less CPU than 9
+app.add_middleware(GZipMiddleware,minimum_size=1024,compresslevel=5)
+
 app.include_router(auth.router,prefix='/auth',tags=["Auth"])
 app.include_router(user.router)
 app.include_router(chat.router)
 app.include_router(ws_router)
 app.include_router(media.router)
 app.include_router(ai.router)
+app.include_router(admin.router)
 @app.get('/')
 def root():
     
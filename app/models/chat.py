@@ -1,8 +1,9 @@
-from sqlalchemy import Column, String, Boolean , DateTime ,Enum,ForeignKey,Text
+from sqlalchemy import Column, String, Boolean , DateTime ,Enum,ForeignKey,Text,Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
+from typing import Optional
 import uuid
 from app.db.base import Base
 
@@ -13,12 +14,21 @@ class ChatType(str,enum.Enum):
     ai="ai"
 
 
+def dm_key_for(participant_ids)->Optional[str]:
+    ids=sorted({str(user_id) for user_id in participant_ids})
+    return ":".join(ids) if len(ids)==2 else None
+
+
 class Chat(Base):
     __tablename__ = "chats"
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name= Column(String, nullable=True)
     type=Column(Enum(ChatType),default=ChatType.PRIVATE)
     created_at=Column(DateTime,default=datetime.utcnow)
+    # "<user_a>:<user_b>" for private chats, so a pair can only ever have one DM
+    dm_key=Column(String,unique=True,nullable=True)
+    # AI chats can opt out of sharing answers through the reply cache
+    ai_cache_enabled=Column(Boolean,default=True,server_default="true",nullable=False)
 
     participants=relationship("ChatParticipant",back_populates="chat")
     messages= relationship("Message",back_populates="chat")
@@ -26,6 +36,10 @@ class Chat(Base):
 
 class ChatParticipant(Base):
     __tablename__="chat_participants"
+    __table_args__=(
+        # The primary key leads with user_id; member lookups go by chat
+        Index("ix_chat_participants_chat_id","chat_id"),
+    )
     user_id=Column(UUID(as_uuid=True),ForeignKey("users.id"),primary_key=True)
     chat_id=Column(UUID(as_uuid=True),ForeignKey("chats.id"),primary_key=True)
     last_deleted_at = Column(DateTime, nullable=True)
@@ -35,14 +49,20 @@ class ChatParticipant(Base):
 
 
 class Message(Base):
+    # Range-partitioned on created_at in Postgres, see app/db/migrations/0001_partition_messages.sql
     __tablename__="messages"
+    __table_args__=(
+        Index("ix_messages_chat_id_created_at","chat_id","created_at"),
+    )
     id=Column(UUID(as_uuid=True),primary_key=True,default=uuid.uuid4)
-    chat_id=Column(UUID(as_uuid=True),ForeignKey("chats.id"),index=True)
+    chat_id=Column(UUID(as_uuid=True),ForeignKey("chats.id"))
     sender_id = Column(UUID(as_uuid=True), ForeignKey("users.id"),index=True)
     content=Column(Text,nullable=True)
     created_at=Column(DateTime,default=datetime.utcnow)
     media_url = Column(String, nullable=True)  # ➕ NEW
     media_type = Column(String, nullable=True)
+    # SHA-256 of the media, see app/models/media_object.py; NULL for media stored before deduplication
+    media_hash = Column(String(64), nullable=True)
     is_edited=Column(Boolean,default=False)
 
     chat = relationship("Chat", back_populates="messages")
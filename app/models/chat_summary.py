@@ -0,0 +1,16 @@
+from sqlalchemy import Column, DateTime, Integer, Text, ForeignKey
+from sqlalchemy.dialects.postgresql import UUID
+from datetime import datetime
+
+from app.db.base import Base
+
+class ChatSummary(Base):
+    """Rolling summary of an AI chat's older turns, folded in incrementally."""
+    __tablename__="chat_summaries"
+    chat_id = Column(UUID(as_uuid=True), ForeignKey("chats.id"), primary_key=True)
+    summary = Column(Text, nullable=False, default="")
+    # Messages up to and including this one are represented by the summary
+    covered_until = Column(DateTime, nullable=True)
+    covered_message_id = Column(UUID(as_uuid=True), nullable=True)
+    folded_messages = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,20 @@
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, Index
+from datetime import datetime
+
+from app.db.base import Base
+
+class MediaObject(Base):
+    """One stored media file, found by the SHA-256 of its bytes and shared by every message that sends it."""
+    __tablename__="media_objects"
+    __table_args__=(
+        Index("ix_media_objects_unreferenced","ref_count","released_at"),
+    )
+    sha256 = Column(String(64), primary_key=True)
+    object_key = Column(String, nullable=False, unique=True)
+    url = Column(String, nullable=False, unique=True)
+    content_type = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    # Messages pointing here, archived ones included; at 0 the object is garbage once released_at is old enough
+    ref_count = Column(Integer, nullable=False, default=0)
+    released_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,29 @@
+from sqlalchemy import Column, String, Integer, DateTime, Index, ForeignKey
+from sqlalchemy.dialects.postgresql import UUID
+from datetime import datetime
+import uuid
+
+from app.db.base import Base
+
+class MessageArchive(Base):
+    """One chat's messages for one archived partition, stored as gzipped JSON lines in S3."""
+    __tablename__="message_archives"
+    __table_args__=(
+        Index("ix_message_archives_chat_id_period_start","chat_id","period_start"),
+    )
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    chat_id = Column(UUID(as_uuid=True), nullable=False)
+    period_start = Column(DateTime, nullable=False)
+    period_end = Column(DateTime, nullable=False)
+    object_key = Column(String, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ArchivedMedia(Base):
+    """Media URLs referenced from one archive segment, so they can be looked up without reading it."""
+    __tablename__="archived_media"
+    archive_id = Column(UUID(as_uuid=True), ForeignKey("message_archives.id", ondelete="CASCADE"), primary_key=True)
+    media_url = Column(String, primary_key=True, index=True)
+    # Archived messages referencing the URL; each one still holds a media reference
+    refs = Column(Integer, nullable=False)
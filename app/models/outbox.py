@@ -0,0 +1,24 @@
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, Text, JSON, Index
+from datetime import datetime
+
+from app.db.base import Base
+
+class OutboxEvent(Base):
+    """A side effect recorded in the same transaction as the write that caused it."""
+    __tablename__="outbox_events"
+    __table_args__=(
+        Index("ix_outbox_events_pending","dispatched_at","failed_at","available_at"),
+    )
+    # Monotonic so the dispatcher delivers events in the order they were written
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    kind = Column(String, nullable=False)
+    # Set for broadcasts: only the worker that wrote it may deliver it, to its own sockets
+    owner = Column(String, nullable=True)
+    payload = Column(JSON, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    available_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    dispatched_at = Column(DateTime, nullable=True)
+    # Set once retries are exhausted; the row stays as a dead letter
+    failed_at = Column(DateTime, nullable=True)
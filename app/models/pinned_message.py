@@ -1,4 +1,4 @@
-from sqlalchemy import Column, ForeignKey, DateTime
+from sqlalchemy import Column, ForeignKey, DateTime, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -8,9 +8,13 @@ from app.db.base import Base
 
 class PinnedMessage(Base):
     __tablename__="pinned_messages"
+    __table_args__=(
+        Index("ix_pinned_messages_chat_id_pinned_at","chat_id","pinned_at"),
+    )
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     chat_id = Column(UUID(as_uuid=True), ForeignKey("chats.id"), nullable=False)
-    message_id = Column(UUID(as_uuid=True), ForeignKey("messages.id"), nullable=False)
+    # Not a database FK: messages is partitioned and its key is (id, created_at)
+    message_id = Column(UUID(as_uuid=True), nullable=False, index=True)
     pinned_at = Column(DateTime, default=datetime.utcnow)
     chat = relationship("Chat")
-    message = relationship("Message")
\ No newline at end of file
+    message = relationship("Message", primaryjoin="foreign(PinnedMessage.message_id) == Message.id")
\ No newline at end of file
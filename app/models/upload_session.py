@@ -0,0 +1,42 @@
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import UUID
+from datetime import datetime
+import uuid
+
+from app.db.base import Base
+
+class UploadSession(Base):
+    """A resumable upload: one S3 multipart upload, filled chunk by chunk in any order."""
+    __tablename__="upload_sessions"
+    __table_args__=(
+        Index("ix_upload_sessions_user_id","user_id"),
+        Index("ix_upload_sessions_expires_at","expires_at"),
+    )
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    chat_id = Column(UUID(as_uuid=True), ForeignKey("chats.id"), nullable=False)
+    filename = Column(String, nullable=True)
+    content_type = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    chunk_size = Column(Integer, nullable=False)
+    object_key = Column(String, nullable=False, unique=True)
+    s3_upload_id = Column(String, nullable=False)
+    # open -> completing -> completed; completed sessions stay until expiry so a retried
+    # finalize gets the same answer
+    status = Column(String, nullable=False, default="open")
+    # When the running finalize claimed the session; NULL once it gave up
+    completing_at = Column(DateTime, nullable=True)
+    message_id = Column(UUID(as_uuid=True), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # Pushed back by every chunk; abandoned sessions are aborted once it passes
+    expires_at = Column(DateTime, nullable=False)
+
+class UploadPart(Base):
+    """A chunk that reached S3; a chunk sent again replaces its row."""
+    __tablename__="upload_parts"
+    session_id = Column(UUID(as_uuid=True), ForeignKey("upload_sessions.id", ondelete="CASCADE"), primary_key=True)
+    # Chunk index + 1, as S3 numbers parts from 1
+    part_number = Column(Integer, primary_key=True)
+    etag = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    uploaded_at = Column(DateTime, default=datetime.utcnow)
@@ -1,5 +1,5 @@
 import uuid
-from sqlalchemy import Column, String, Integer, Boolean, DateTime
+from sqlalchemy import Column, String, Integer, Boolean, DateTime, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
@@ -8,6 +8,11 @@ from app.models.chat import ChatParticipant
 
 class User(Base):
     __tablename__='users'
+    # Trigram indexes serve the '%q%' matches of user search (needs pg_trgm)
+    __table_args__=tuple(
+        Index(f"ix_users_{col}_trgm",col,postgresql_using="gin",postgresql_ops={col:"gin_trgm_ops"})
+        for col in ("username","full_name","email")
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, index=True)
     email=Column(String, unique=True,index=True,nullable=False)
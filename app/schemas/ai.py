@@ -5,3 +5,5 @@ class AIChatRequest(BaseModel):
     message: str
 class AIChatResponse(BaseModel):
     reply: str
+class AICacheSettings(BaseModel):
+    enabled: bool
@@ -1,6 +1,6 @@
 from pydantic import BaseModel,UUID4
 from datetime import datetime
-from typing import Optional
+from typing import Optional,List
 from pydantic import Field
 from uuid import UUID
 
@@ -30,3 +30,17 @@ class FullMessageResponse(MessageResponse):
 class EditMessageRequest(BaseModel):
     content:str
 
+
+class BulkMessageRequest(BaseModel):
+    message_ids:List[UUID]=Field(...,min_length=1,max_length=500)
+
+class BulkForwardRequest(BulkMessageRequest):
+    target_chat_id:UUID
+
+class BulkItemResult(BaseModel):
+    message_id:UUID
+    status:str
+    new_message_id:Optional[UUID]=None
+
+class BulkOperationResponse(BaseModel):
+    results:List[BulkItemResult]
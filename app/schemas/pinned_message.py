@@ -1,11 +1,20 @@
 from pydantic import BaseModel, UUID4
 from datetime import datetime
+from typing import Optional
+from uuid import UUID
+from app.schemas.messages import FullMessageResponse
+
+class PinnedMessageCard(FullMessageResponse):
+    # Replies saved by /ai/chat have no sender
+    sender_id:Optional[UUID]=None
 
 class PinnedMessageResponse(BaseModel):
     id:UUID4
     chat_id:UUID4
     message_id:UUID4
     pinned_at:datetime
+    # None when the message is gone from the hot table (purged or archived)
+    message:Optional[PinnedMessageCard]=None
 
     class Config:
-        from_attributes=True
\ No newline at end of file
+        from_attributes=True
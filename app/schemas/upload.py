@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+from uuid import UUID
+from typing import Optional
+
+class CreateUploadRequest(BaseModel):
+    chat_id:UUID
+    filename:Optional[str]=None
+    content_type:str
+    size:int
+
+class CompleteUploadRequest(BaseModel):
+    content:Optional[str]=None
@@ -1,5 +1,5 @@
-from pydantic import BaseModel , UUID4,EmailStr
-from typing import Optional
+from pydantic import BaseModel , UUID4,EmailStr,Field
+from typing import Optional,List
 from datetime import datetime
 
 
@@ -32,3 +32,12 @@ class UserDetail(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class BatchStatusRequest(BaseModel):
+    user_ids: List[UUID4] = Field(..., min_length=1, max_length=500)
+
+
+class UserStatus(BaseModel):
+    is_online: bool
+    last_seen: Optional[datetime] = None
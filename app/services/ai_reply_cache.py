@@ -0,0 +1,152 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from app.core.config import settings
+
+try:
+    import redis
+except ImportError:  # only needed when REDIS_URL is set
+    redis = None
+
+TTL_SECONDS = 24 * 3600
+MAX_ENTRIES = 10_000
+# Replies plus keys held in this worker
+MAX_BYTES = 32 * 1024 * 1024
+
+_SPACES = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.,;:]+$")
+
+
+def normalize_prompt(text: str) -> str:
+    """Fold the differences that do not change the question: case, spacing, trailing punctuation."""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return _TRAILING_PUNCTUATION.sub("", _SPACES.sub(" ", text).strip())
+
+
+def context_fingerprint(history: Optional[List[dict]], user_message: str) -> Optional[str]:
+    """Hash of the turns before ``user_message``; None when the question opens the conversation."""
+    turns = list(history or [])
+    if turns and turns[-1].get("role") == "user" and turns[-1].get("content") == user_message:
+        turns = turns[:-1]
+    if not turns:
+        return None
+    canonical = json.dumps([[t.get("role"), normalize_prompt(t.get("content") or "")] for t in turns])
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def reply_cache_key(system_prompt: str, user_message: str, context: Optional[str] = None) -> str:
+    raw = "\x1f".join([system_prompt, normalize_prompt(user_message), context or ""])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class RedisReplyStore:
+    """Shares cached replies between workers and restarts."""
+
+    def __init__(self, url: str, ttl: int = TTL_SECONDS):
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.client.get(f"ai_reply:{key}")
+        return value.decode() if value is not None else None
+
+    def set(self, key: str, reply: str):
+        self.client.set(f"ai_reply:{key}", reply, ex=self.ttl)
+
+
+class AIReplyCache:
+    def __init__(self, ttl: float = TTL_SECONDS, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES, store=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.store = store
+        # key -> (expires_at, reply, size)
+        self._entries: "OrderedDict[str, Tuple[float, str, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+    def _drop(self, key: str):
+        _expires, _reply, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.counts["hits"] += 1
+                    return entry[1]
+                self._drop(key)
+                self.counts["expired"] += 1
+        reply = self.store.get(key) if self.store is not None else None
+        with self._lock:
+            if reply is None:
+                self.counts["misses"] += 1
+                return None
+            self.counts["hits"] += 1
+        self._put_local(key, reply)
+        return reply
+
+    def _put_local(self, key: str, reply: str):
+        size = len(key) + len(reply.encode())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, reply, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.counts["evictions"] += 1
+
+    def put(self, key: str, reply: str):
+        if not reply:
+            return
+        self._put_local(key, reply)
+        self.counts["stores"] += 1
+        if self.store is not None:
+            self.store.set(key, reply)
+
+    async def get_or_create(self, key: Optional[str], produce: Callable[[], Awaitable[str]]) -> str:
+        """Cached reply for ``key``, or ``produce()`` stored under it; ``key=None`` bypasses the cache."""
+        if key is None:
+            return await produce()
+        reply = self.get(key)
+        if reply is None:
+            reply = await produce()
+            self.put(key, reply)
+        return reply
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.counts["hits"] + self.counts["misses"]
+            return {
+                **self.counts,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hit_rate": round(self.counts["hits"] / lookups, 3) if lookups else None,
+            }
+
+
+def _build_cache() -> AIReplyCache:
+    if settings.REDIS_URL and redis is not None:
+        return AIReplyCache(store=RedisReplyStore(settings.REDIS_URL))
+    return AIReplyCache()
+
+
+reply_cache = _build_cache()
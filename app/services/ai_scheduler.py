@@ -0,0 +1,167 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional
+
+from app.services.ai_usage import current_call
+
+# Upstream model calls running at once in this worker
+MAX_CONCURRENT_CALLS = 8
+# Calls waiting for a slot; beyond this new requests are turned away
+MAX_QUEUED_CALLS = 100
+QUEUE_TIMEOUT_SECONDS = 15.0
+CALL_TIMEOUT_SECONDS = 30.0
+# Samples kept for the latency percentiles in stats()
+SAMPLE_SIZE = 1000
+
+
+class AISchedulerBusy(Exception):
+    """The queue is full or the call waited too long for a slot."""
+
+
+class AIReplyTimeout(Exception):
+    pass
+
+
+class AIReplySuperseded(Exception):
+    """A newer request for the same chat replaced this one; its reply answers both."""
+
+    def __init__(self, newer: "AIJob"):
+        super().__init__("Superseded by a newer request in the same chat")
+        self.newer = newer
+
+
+class AIJob:
+    def __init__(self, chat_id: str):
+        self.chat_id = chat_id
+        self.task: Optional[asyncio.Task] = None
+        self.superseded_by: Optional["AIJob"] = None
+
+    async def result(self) -> str:
+        """The reply that ends up answering this job, following any supersessions."""
+        job = self
+        while True:
+            try:
+                return await asyncio.shield(job.task)
+            except asyncio.CancelledError:
+                if job.superseded_by is None:
+                    raise
+                job = job.superseded_by
+
+
+def _percentile(samples, fraction: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000, 1)
+
+
+class AIScheduler:
+    """
+    Runs AI replies with at most one in flight per chat and a global cap on upstream calls.
+
+    A new request for a chat cancels the one still running there: the newer prompt is
+    built from history that already contains the older message, so one reply covers both.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = MAX_CONCURRENT_CALLS,
+        max_queued: int = MAX_QUEUED_CALLS,
+        queue_timeout: float = QUEUE_TIMEOUT_SECONDS,
+        call_timeout: float = CALL_TIMEOUT_SECONDS,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.call_timeout = call_timeout
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._inflight: Dict[str, AIJob] = {}
+        self.running = 0
+        self.queued = 0
+        self.counts = {"completed": 0, "superseded": 0, "timeouts": 0, "rejected": 0, "failed": 0}
+        self.queue_waits = deque(maxlen=SAMPLE_SIZE)
+        self.call_times = deque(maxlen=SAMPLE_SIZE)
+
+    async def _call(self, make_call: Callable[[], Awaitable[str]], timeout: float) -> str:
+        enqueued = time.perf_counter()
+        if not self._slots.locked():
+            await self._slots.acquire()
+        else:
+            if self.queued >= self.max_queued:
+                self.counts["rejected"] += 1
+                raise AISchedulerBusy("Too many AI requests queued")
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.counts["rejected"] += 1
+                raise AISchedulerBusy("Timed out waiting for an AI slot")
+            finally:
+                self.queued -= 1
+        waited = time.perf_counter() - enqueued
+        self.queue_waits.append(waited)
+        call = current_call()
+        if call is not None:
+            call.queue_wait += waited
+
+        started = time.perf_counter()
+        self.running += 1
+        try:
+            reply = await asyncio.wait_for(make_call(), timeout)
+        except asyncio.TimeoutError:
+            self.counts["timeouts"] += 1
+            raise AIReplyTimeout(f"AI reply took longer than {timeout:g}s")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.counts["failed"] += 1
+            raise
+        finally:
+            self.running -= 1
+            self._slots.release()
+        self.call_times.append(time.perf_counter() - started)
+        self.counts["completed"] += 1
+        return reply
+
+    async def run(self, chat_id, make_call: Callable[[], Awaitable[str]], timeout: Optional[float] = None) -> str:
+        """
+        Run ``make_call`` as the chat's only in-flight reply. Raises AIReplySuperseded when a
+        newer request for the chat takes over, AISchedulerBusy or AIReplyTimeout.
+        """
+        key = str(chat_id)
+        job = AIJob(key)
+        previous = self._inflight.get(key)
+        self._inflight[key] = job
+        if previous is not None and previous.task is not None and not previous.task.done():
+            previous.superseded_by = job
+            previous.task.cancel()
+            self.counts["superseded"] += 1
+
+        job.task = asyncio.create_task(self._call(make_call, timeout or self.call_timeout))
+        try:
+            return await asyncio.shield(job.task)
+        except asyncio.CancelledError:
+            if job.superseded_by is not None and job.task.cancelled():
+                raise AIReplySuperseded(job.superseded_by)
+            # The caller itself went away
+            job.task.cancel()
+            raise
+        finally:
+            if self._inflight.get(key) is job:
+                del self._inflight[key]
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": self.queued,
+            "max_concurrent": self.max_concurrent,
+            **self.counts,
+            "queue_wait_ms_p50": _percentile(self.queue_waits, 0.5),
+            "queue_wait_ms_p95": _percentile(self.queue_waits, 0.95),
+            "call_ms_p50": _percentile(self.call_times, 0.5),
+            "call_ms_p95": _percentile(self.call_times, 0.95),
+        }
+
+
+ai_scheduler = AIScheduler()
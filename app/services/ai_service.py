@@ -1,8 +1,28 @@
-from openai import OpenAI
-import os
+import time
+import uuid
+from app.services.ai_reply_cache import reply_cache_key, context_fingerprint
+from app.services.ai_usage import current_call
+from app.services.llm_backend import build_backend, estimate_tokens
+
+# Initialize once at import; LLM_BACKEND picks the adapter
+backend = build_backend()
+
+# Fixed AI user UUID (make sure you handle this in history responses)
+AI_USER_ID = uuid.UUID("00000000-0000-0000-0000-000000000001")
+
+# System instruction (defines AI’s behavior); part of every reply cache key
+SYSTEM_PROMPT = (
+    "You are an AI work assistant. "
+    "Only answer questions related to work, "
+    "such as company tasks, coding, or productivity. "
+    "If asked about non-work topics, politely refuse."
+)
+
+
+def reply_key(user_message: str, history: list[dict] = None) -> str:
+    """Reply cache key for this prompt in this conversation context."""
+    return reply_cache_key(SYSTEM_PROMPT, user_message, context_fingerprint(history, user_message))
 
-# Initialize once at import
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 async def get_ai_reply(user_message: str, history: list[dict] = None) -> str:
     """
@@ -13,16 +33,7 @@ async def get_ai_reply(user_message: str, history: list[dict] = None) -> str:
     :return: AI's reply as string
     """
 
-    # System instruction (defines AI’s behavior)
-    system_prompt = {
-        "role": "system",
-        "content": (
-            "You are an AI work assistant. "
-            "Only answer questions related to work, "
-            "such as company tasks, coding, or productivity. "
-            "If asked about non-work topics, politely refuse."
-        )
-    }
+    system_prompt = {"role": "system", "content": SYSTEM_PROMPT}
 
     
     messages = [system_prompt]
@@ -30,10 +41,25 @@ async def get_ai_reply(user_message: str, history: list[dict] = None) -> str:
         messages.extend(history) 
     messages.append({"role": "user", "content": user_message})
 
-    
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",  
-        messages=messages,
-    )
+    return await complete(messages)
+
+
+async def complete(messages: list[dict]) -> str:
+    """One chat completion for ``messages`` as given, accounted to the current AI call."""
+    call = current_call()
+    if call is None:
+        return await backend.complete(messages)
 
-    return completion.choices[0].message.content
+    usage = {}
+    parts = []
+    call.model_calls += 1
+    started = time.perf_counter()
+    # Streamed so time-to-first-token can be measured
+    async for chunk in backend.stream(messages, usage):
+        if call.first_token is None:
+            call.first_token = time.perf_counter() - started
+        parts.append(chunk)
+    reply = "".join(parts)
+    call.prompt_tokens += usage.get("prompt_tokens") or sum(estimate_tokens(m.get("content") or "") for m in messages)
+    call.completion_tokens += usage.get("completion_tokens") or estimate_tokens(reply)
+    return reply
@@ -0,0 +1,212 @@
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from app.core.config import settings
+from app.core.rate_limit import rate_limiter
+
+try:
+    import redis
+except ImportError:  # only needed when REDIS_URL is set
+    redis = None
+
+# Aggregates kept per worker, least recently active dropped first
+MAX_KEYS = 10_000
+# Past this share of the daily budget a user's AI requests are slowed to the
+# "ai_budget" rate limit, so the quota is approached gradually instead of hit at full speed
+SOFT_BUDGET_RATIO = 0.8
+
+
+class AICall:
+    """What one AI request cost; filled in by the scheduler, the model call and track()."""
+
+    def __init__(self, user_id=None, chat_id=None, kind: str = "reply"):
+        self.user_id = str(user_id) if user_id else None
+        self.chat_id = str(chat_id) if chat_id else None
+        self.kind = kind
+        self.model_calls = 0
+        self.queue_wait = 0.0
+        self.first_token: Optional[float] = None
+        self.latency = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cache_hit = False
+        self.failed = False
+
+
+_current: contextvars.ContextVar[Optional[AICall]] = contextvars.ContextVar("ai_call", default=None)
+
+
+def current_call() -> Optional[AICall]:
+    return _current.get()
+
+
+def _blank() -> dict:
+    return {
+        "calls": 0, "cache_hits": 0, "failures": 0, "prompt_tokens": 0, "completion_tokens": 0,
+        "latency_s": 0.0, "first_token_s": 0.0, "queue_wait_s": 0.0, "max_latency_s": 0.0,
+    }
+
+
+class InMemoryBudgetStore:
+    def __init__(self):
+        self._used: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, user_id: str, day: str, tokens: int):
+        with self._lock:
+            # Only today's counters are ever read
+            for key in [k for k in self._used if k[1] != day]:
+                del self._used[key]
+            self._used[(user_id, day)] = self._used.get((user_id, day), 0) + tokens
+
+    def used(self, user_id: str, day: str) -> int:
+        return self._used.get((user_id, day), 0)
+
+
+class RedisBudgetStore:
+    def __init__(self, url: str):
+        self.client = redis.Redis.from_url(url)
+
+    def add(self, user_id: str, day: str, tokens: int):
+        key = f"ai_tokens:{user_id}:{day}"
+        pipe = self.client.pipeline()
+        pipe.incrby(key, tokens)
+        pipe.expire(key, 2 * 24 * 3600)
+        pipe.execute()
+
+    def used(self, user_id: str, day: str) -> int:
+        value = self.client.get(f"ai_tokens:{user_id}:{day}")
+        return int(value) if value else 0
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y%m%d")
+
+
+class AIUsage:
+    def __init__(self, budget_store=None, max_keys: int = MAX_KEYS):
+        self.budgets = budget_store or InMemoryBudgetStore()
+        self.max_keys = max_keys
+        self.totals = _blank()
+        self.by_user: "OrderedDict[str, dict]" = OrderedDict()
+        self.by_chat: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, table: "OrderedDict[str, dict]", key: str) -> dict:
+        row = table.get(key)
+        if row is None:
+            row = table[key] = _blank()
+            while len(table) > self.max_keys:
+                table.popitem(last=False)
+        table.move_to_end(key)
+        return row
+
+    def record(self, call: AICall):
+        rows = [self.totals]
+        with self._lock:
+            if call.user_id:
+                rows.append(self._bucket(self.by_user, call.user_id))
+            if call.chat_id:
+                rows.append(self._bucket(self.by_chat, call.chat_id))
+            for row in rows:
+                row["calls"] += 1
+                row["cache_hits"] += call.cache_hit
+                row["failures"] += call.failed
+                row["prompt_tokens"] += call.prompt_tokens
+                row["completion_tokens"] += call.completion_tokens
+                row["latency_s"] += call.latency
+                row["first_token_s"] += call.first_token or 0.0
+                row["queue_wait_s"] += call.queue_wait
+                row["max_latency_s"] = max(row["max_latency_s"], call.latency)
+        tokens = call.prompt_tokens + call.completion_tokens
+        if call.user_id and tokens:
+            self.budgets.add(call.user_id, _today(), tokens)
+
+    @contextmanager
+    def track(self, user_id=None, chat_id=None, kind: str = "reply"):
+        """Account every model call made inside the block to ``user_id`` and ``chat_id``."""
+        call = AICall(user_id, chat_id, kind)
+        token = _current.set(call)
+        started = time.perf_counter()
+        try:
+            yield call
+        except Exception:
+            call.failed = True
+            raise
+        finally:
+            _current.reset(token)
+            call.latency = time.perf_counter() - started
+            # Answered without reaching the model
+            call.cache_hit = call.model_calls == 0 and not call.failed
+            self.record(call)
+
+    def budget_state(self, user_id) -> Tuple[int, int]:
+        """(tokens used today, daily budget); a budget of 0 means unlimited."""
+        return self.budgets.used(str(user_id), _today()), settings.AI_USER_DAILY_TOKEN_BUDGET
+
+    def check_budget(self, user_id) -> Tuple[bool, float]:
+        """Admit one AI request for ``user_id``; returns (allowed, retry_after)."""
+        used, budget = self.budget_state(user_id)
+        if not budget:
+            return True, 0.0
+        if used >= budget:
+            now = datetime.now(timezone.utc)
+            midnight = now.replace(hour=0, minute=0, second=0, microsecond=0).timestamp() + 24 * 3600
+            return False, midnight - now.timestamp()
+        if used >= budget * SOFT_BUDGET_RATIO:
+            return rate_limiter.hit("ai_budget", user_id)
+        return True, 0.0
+
+    @staticmethod
+    def _summary(key_name: str, key: str, row: dict) -> dict:
+        calls = row["calls"] or 1
+        return {
+            key_name: key,
+            "calls": row["calls"],
+            "cache_hits": row["cache_hits"],
+            "failures": row["failures"],
+            "prompt_tokens": row["prompt_tokens"],
+            "completion_tokens": row["completion_tokens"],
+            "avg_latency_ms": round(row["latency_s"] / calls * 1000, 1),
+            "avg_first_token_ms": round(row["first_token_s"] / calls * 1000, 1),
+            "avg_queue_wait_ms": round(row["queue_wait_s"] / calls * 1000, 1),
+            "max_latency_ms": round(row["max_latency_s"] * 1000, 1),
+        }
+
+    def report(self, limit: int = 50) -> dict:
+        def top(table, key_name):
+            ranked = sorted(table.items(), key=lambda kv: kv[1]["prompt_tokens"] + kv[1]["completion_tokens"], reverse=True)
+            return [self._summary(key_name, key, row) for key, row in ranked[:limit]]
+
+        with self._lock:
+            return {
+                "totals": self._summary("scope", "all", self.totals),
+                "users": top(self.by_user, "user_id"),
+                "chats": top(self.by_chat, "chat_id"),
+            }
+
+
+def _build_usage() -> AIUsage:
+    if settings.REDIS_URL and redis is not None:
+        return AIUsage(RedisBudgetStore(settings.REDIS_URL))
+    return AIUsage()
+
+
+ai_usage = _build_usage()
+
+
+def enforce_ai_budget(user_id):
+    allowed, retry_after = ai_usage.check_budget(user_id)
+    if not allowed:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="AI usage budget reached, slow down",
+            headers={"Retry-After": str(max(1, round(retry_after)))}
+        )
@@ -7,6 +7,7 @@ from sqlalchemy import or_
 from datetime import datetime,timedelta
 from jose import jwt
 from app.core.config import settings
+from app.core.versioning import bump_directory
 import uuid
 from typing import Optional
 
@@ -37,6 +38,7 @@ def create_user(data:RegisterRequest,db:Session)->User:
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    bump_directory()
 
     return new_user
 
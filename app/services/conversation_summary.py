@@ -0,0 +1,160 @@
+from typing import List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.sessions import SessionLocal
+from app.models.chat import Message
+from app.models.chat_summary import ChatSummary
+from app.services import ai_service
+from app.services.ai_scheduler import ai_scheduler, AIReplySuperseded
+from app.services.ai_usage import ai_usage
+from app.services.outbox import outbox_handler, record
+
+# Upper bound on unsummarized messages read per request; the budget usually stops far earlier
+CONTEXT_FETCH_LIMIT = 200
+# The summary is asked to stay under this, and is cut there if it does not
+SUMMARY_MAX_TOKENS = 400
+# Folding keeps this share of the budget as verbatim recent turns
+RECENT_SHARE = 0.5
+# Messages folded per summarizer call
+FOLD_MAX_MESSAGES = 100
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an AI work assistant. "
+    "Rewrite the summary so it also covers the new messages. Keep facts, decisions, names, open "
+    "questions and the user's preferences; drop small talk. "
+    f"Answer with the summary only, at most {SUMMARY_MAX_TOKENS * 3 // 4} words."
+)
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    # ~4 characters per token for English text, plus per-message framing
+    return len(text or "") // 4 + 4
+
+
+def _role(sender_id) -> str:
+    # /ai/chat stores replies without a sender
+    return "assistant" if sender_id is None or sender_id == ai_service.AI_USER_ID else "user"
+
+
+def _summary_turn(summary: str) -> dict:
+    return {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}
+
+
+def build_context(
+    db: Session,
+    chat_id,
+    user_message: str,
+    exclude_id=None,
+    budget: Optional[int] = None,
+) -> Tuple[List[dict], bool]:
+    """
+    History for a reply to ``user_message``: the stored summary plus as many recent turns
+    as fit in ``budget`` tokens. Returns (history, needs_fold); needs_fold is True when
+    unsummarized turns had to be left out.
+    """
+    budget = budget or settings.AI_CONTEXT_TOKEN_BUDGET
+    row = db.query(ChatSummary).filter(ChatSummary.chat_id == chat_id).first()
+    remaining = budget - estimate_tokens(ai_service.SYSTEM_PROMPT) - estimate_tokens(user_message)
+    head = []
+    if row and row.summary:
+        head = [_summary_turn(row.summary)]
+        remaining -= estimate_tokens(head[0]["content"])
+
+    query = db.query(Message.id, Message.sender_id, Message.content).filter(
+        Message.chat_id == chat_id, Message.content.isnot(None)
+    )
+    if row and row.covered_until:
+        query = query.filter(Message.created_at > row.covered_until)
+    if exclude_id is not None:
+        query = query.filter(Message.id != exclude_id)
+    newest_first = query.order_by(Message.created_at.desc()).limit(CONTEXT_FETCH_LIMIT).all()
+
+    turns = []
+    for _id, sender_id, content in newest_first:
+        cost = estimate_tokens(content)
+        if cost > remaining:
+            break
+        remaining -= cost
+        turns.append({"role": _role(sender_id), "content": content})
+    turns.reverse()
+    return head + turns, len(turns) < len(newest_first)
+
+
+def request_fold(db: Session, chat_id):
+    """Queue a background fold in ``db``'s transaction."""
+    record(db, "summarize_chat", {"chat_id": str(chat_id)})
+
+
+def _trim(summary: str) -> str:
+    limit = SUMMARY_MAX_TOKENS * 4
+    return summary if len(summary) <= limit else summary[:limit].rsplit(" ", 1)[0]
+
+
+async def fold_chat(db: Session, chat_id, budget: Optional[int] = None) -> int:
+    """Fold the unsummarized turns older than the recent window into the summary; returns messages folded."""
+    budget = budget or settings.AI_CONTEXT_TOKEN_BUDGET
+    row = db.query(ChatSummary).filter(ChatSummary.chat_id == chat_id).first()
+    query = db.query(Message.id, Message.sender_id, Message.content, Message.created_at).filter(
+        Message.chat_id == chat_id, Message.content.isnot(None)
+    )
+    if row and row.covered_until:
+        query = query.filter(Message.created_at > row.covered_until)
+
+    # The newest RECENT_SHARE of the budget stays verbatim; everything older gets folded
+    recent = query.order_by(Message.created_at.desc()).limit(CONTEXT_FETCH_LIMIT).all()
+    keep = int(budget * RECENT_SHARE)
+    kept = 0
+    while kept < len(recent) and estimate_tokens(recent[kept].content) <= keep:
+        keep -= estimate_tokens(recent[kept].content)
+        kept += 1
+    if kept == len(recent) < CONTEXT_FETCH_LIMIT:
+        return 0
+    if kept:
+        query = query.filter(Message.created_at < recent[kept - 1].created_at)
+    # Oldest first, so a backlog longer than the recent window is folded from its start
+    fold = query.order_by(Message.created_at).limit(FOLD_MAX_MESSAGES).all()
+    if not fold:
+        return 0
+
+    transcript = "\n".join(f"{_role(m.sender_id)}: {m.content}" for m in fold)
+    previous = row.summary if row else ""
+    covered = row.covered_until if row else None
+    messages = [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": f"Current summary:\n{previous or '(none)'}\n\nNew messages:\n{transcript}"},
+    ]
+    try:
+        # Own scheduler key: shares the global cap without superseding the chat's reply
+        with ai_usage.track(None, chat_id, kind="summary"):
+            summary = await ai_scheduler.run(f"summary:{chat_id}", lambda: ai_service.complete(messages))
+    except AIReplySuperseded:
+        return 0
+
+    db.expire_all()
+    row = db.query(ChatSummary).filter(ChatSummary.chat_id == chat_id).first()
+    if (row.covered_until if row else None) != covered:
+        # Another fold got there first
+        return 0
+    if row is None:
+        row = ChatSummary(chat_id=chat_id, folded_messages=0)
+        db.add(row)
+    row.summary = _trim(summary.strip())
+    row.covered_until = fold[-1].created_at
+    row.covered_message_id = fold[-1].id
+    row.folded_messages += len(fold)
+    if len(fold) == FOLD_MAX_MESSAGES:
+        # Probably more backlog behind this batch
+        request_fold(db, chat_id)
+    db.commit()
+    return len(fold)
+
+
+@outbox_handler("summarize_chat", background=True)
+async def deliver_summarize_chat(payload: dict):
+    db = SessionLocal()
+    try:
+        await fold_chat(db, payload["chat_id"])
+    finally:
+        db.close()
@@ -0,0 +1,130 @@
+import asyncio
+import hashlib
+import random
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, List, Optional
+
+from app.core.config import settings
+
+WORDS = (
+    "the task plan review deploy ticket branch meeting notes deadline team update draft "
+    "owner status build test release sprint backlog summary follow-up checklist"
+).split()
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token; used when a backend reports no usage
+    return max(1, len(text or "") // 4)
+
+
+class LLMBackend(ABC):
+    """
+    A chat-completion model. Adapters implement stream() and complete(); both fill
+    ``usage`` (prompt_tokens, completion_tokens) when one is passed.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def stream(self, messages: List[dict], usage: Optional[dict] = None) -> AsyncIterator[str]:
+        """Reply chunks as they are generated (an async generator)."""
+
+    @abstractmethod
+    async def complete(self, messages: List[dict], usage: Optional[dict] = None) -> str:
+        """The whole reply at once."""
+
+
+class OpenAIBackend(LLMBackend):
+    """OpenAI, or any server speaking its chat-completions API when ``base_url`` is set."""
+
+    name = "openai"
+
+    def __init__(self, api_key: str, model: str, base_url: Optional[str] = None):
+        from openai import AsyncOpenAI
+
+        self.model = model
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+
+    async def complete(self, messages: List[dict], usage: Optional[dict] = None) -> str:
+        completion = await self.client.chat.completions.create(model=self.model, messages=messages)
+        if usage is not None and completion.usage:
+            usage["prompt_tokens"] = completion.usage.prompt_tokens
+            usage["completion_tokens"] = completion.usage.completion_tokens
+        return completion.choices[0].message.content
+
+    async def stream(self, messages: List[dict], usage: Optional[dict] = None) -> AsyncIterator[str]:
+        response = await self.client.chat.completions.create(
+            model=self.model, messages=messages, stream=True, stream_options={"include_usage": True}
+        )
+        async for chunk in response:
+            if usage is not None and chunk.usage:
+                usage["prompt_tokens"] = chunk.usage.prompt_tokens
+                usage["completion_tokens"] = chunk.usage.completion_tokens
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class StubBackend(LLMBackend):
+    """
+    Offline stand-in with realistic timing: ``latency_ms`` before the first token, then
+    ``tokens_per_second``. The reply is derived from the prompt, so runs are repeatable.
+    """
+
+    name = "stub"
+
+    def __init__(
+        self,
+        latency_ms: float = 400,
+        tokens_per_second: float = 60,
+        reply_tokens: int = 60,
+        jitter: float = 0.1,
+        chunk_tokens: int = 4,
+        seed: int = 0,
+    ):
+        self.latency_ms = latency_ms
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.jitter = jitter
+        self.chunk_tokens = chunk_tokens
+        self.seed = seed
+
+    def _rng(self, messages: List[dict]) -> random.Random:
+        digest = hashlib.sha256(repr((self.seed, messages)).encode()).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    def _tokens(self, messages: List[dict], rng: random.Random) -> List[str]:
+        last = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+        words = [f"Re: {' '.join(last.split()[:6])}."]
+        words += [rng.choice(WORDS) for _ in range(max(0, self.reply_tokens - 1))]
+        return [w + " " for w in words]
+
+    def _delay(self, seconds: float, rng: random.Random) -> float:
+        return max(0.0, seconds * (1 + rng.uniform(-self.jitter, self.jitter)))
+
+    async def complete(self, messages: List[dict], usage: Optional[dict] = None) -> str:
+        return "".join([chunk async for chunk in self.stream(messages, usage)])
+
+    async def stream(self, messages: List[dict], usage: Optional[dict] = None) -> AsyncIterator[str]:
+        rng = self._rng(messages)
+        tokens = self._tokens(messages, rng)
+        if usage is not None:
+            usage["prompt_tokens"] = sum(estimate_tokens(m.get("content") or "") for m in messages)
+            usage["completion_tokens"] = len(tokens)
+        await asyncio.sleep(self._delay(self.latency_ms / 1000, rng))
+        for start in range(0, len(tokens), self.chunk_tokens):
+            chunk = tokens[start:start + self.chunk_tokens]
+            if start and self.tokens_per_second > 0:
+                await asyncio.sleep(self._delay(len(chunk) / self.tokens_per_second, rng))
+            yield "".join(chunk)
+
+
+def build_backend() -> LLMBackend:
+    if settings.LLM_BACKEND == "stub":
+        return StubBackend(
+            latency_ms=settings.LLM_STUB_LATENCY_MS,
+            tokens_per_second=settings.LLM_STUB_TOKENS_PER_SECOND,
+            reply_tokens=settings.LLM_STUB_REPLY_TOKENS,
+        )
+    if settings.LLM_BACKEND == "openai":
+        return OpenAIBackend(settings.openai_api_key, settings.LLM_MODEL, settings.LLM_BASE_URL)
+    raise ValueError(f"Unknown LLM_BACKEND {settings.LLM_BACKEND!r}, expected 'openai' or 'stub'")
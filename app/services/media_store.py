@@ -0,0 +1,163 @@
+import argparse
+import hashlib
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import BinaryIO, Iterable, Optional, Tuple
+from uuid import uuid4
+
+from sqlalchemy import case, delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.db.sessions import SessionLocal
+from app.models.media_object import MediaObject
+from app.services.upload_to_s3 import delete_files_from_s3, iter_object, upload_object
+
+MEDIA_PREFIX = "media/objects"
+CHUNK_SIZE = 1024 * 1024
+# Unreferenced objects are kept this long before garbage collection, so a file that is
+# deleted and sent again soon after (or restored) is still found
+GC_GRACE = timedelta(hours=24)
+GC_BATCH = 500
+
+
+def hash_file(fileobj: BinaryIO) -> Tuple[str, int]:
+    """SHA-256 and size of a seekable file, read in chunks; leaves it rewound."""
+    digest = hashlib.sha256()
+    size = 0
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+        size += len(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest(), size
+
+
+def hash_object(key: str) -> Tuple[str, int]:
+    """hash_file() for an object already in S3, streamed back once."""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter_object(key, CHUNK_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def extension(filename: Optional[str]) -> str:
+    return filename.rsplit(".", 1)[-1].lower() if filename and "." in filename else "bin"
+
+
+def object_key(sha256: str, filename: Optional[str]) -> str:
+    # The suffix gives a file stored again after garbage collection a key of its own,
+    # so a delete still in flight for the old copy can never remove it
+    return f"{MEDIA_PREFIX}/{sha256[:2]}/{sha256}-{uuid4().hex[:8]}.{extension(filename)}"
+
+
+def acquire(db: Session, sha256: str, count: int = 1) -> Optional[MediaObject]:
+    """Add ``count`` references to the stored object for ``sha256``; None when there is none."""
+    updated = db.execute(
+        update(MediaObject)
+        .where(MediaObject.sha256 == sha256)
+        .values(ref_count=MediaObject.ref_count + count, released_at=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not updated:
+        return None
+    return db.execute(
+        select(MediaObject).where(MediaObject.sha256 == sha256).execution_options(populate_existing=True)
+    ).scalar_one()
+
+
+def register(db: Session, sha256: str, size: int, key: str, url: str, content_type: str) -> MediaObject:
+    """
+    Record a freshly uploaded object with one reference. When the same bytes were stored
+    concurrently, that object gets the reference and ``key`` is deleted again.
+    """
+    media = MediaObject(sha256=sha256, object_key=key, url=url, content_type=content_type, size=size, ref_count=1)
+    try:
+        with db.begin_nested():
+            db.add(media)
+    except IntegrityError:
+        existing = acquire(db, sha256)
+        if existing is None:
+            raise
+        delete_files_from_s3([key])
+        return existing
+    return media
+
+
+def store(db: Session, fileobj: BinaryIO, filename: Optional[str], content_type: str) -> Tuple[MediaObject, bool]:
+    """
+    The object holding these bytes, with one more reference taken in ``db``'s transaction.
+    Only files not stored yet are uploaded; returns (object, uploaded).
+    """
+    sha256, size = hash_file(fileobj)
+    existing = acquire(db, sha256)
+    if existing is not None:
+        return existing, False
+    key = object_key(sha256, filename)
+    url = upload_object(fileobj, key, content_type)
+    media = register(db, sha256, size, key, url, content_type)
+    return media, media.object_key == key
+
+
+def release(db: Session, hashes: Iterable[Optional[str]]):
+    """Drop one reference per entry of ``hashes`` (None entries are legacy media and skipped)."""
+    now = datetime.utcnow()
+    for sha256, count in Counter(h for h in hashes if h).items():
+        db.execute(
+            update(MediaObject)
+            .where(MediaObject.sha256 == sha256)
+            .values(
+                ref_count=MediaObject.ref_count - count,
+                released_at=case((MediaObject.ref_count - count <= 0, now), else_=MediaObject.released_at),
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+
+def release_urls(db: Session, urls: Iterable[Optional[str]]):
+    """release() by URL, for references that only kept the URL (archived messages)."""
+    counts = Counter(url for url in urls if url)
+    if not counts:
+        return
+    rows = db.query(MediaObject.url, MediaObject.sha256).filter(MediaObject.url.in_(list(counts))).all()
+    release(db, [sha256 for (url, sha256) in rows for _ in range(counts[url])])
+
+
+def collect_garbage(db: Session, grace: timedelta = GC_GRACE, batch: int = GC_BATCH) -> int:
+    """Delete objects nobody has referenced for ``grace``; returns how many went."""
+    cutoff = datetime.utcnow() - grace
+    total = 0
+    while True:
+        candidates = (
+            select(MediaObject.sha256)
+            .where(MediaObject.ref_count <= 0, MediaObject.released_at < cutoff)
+            .limit(batch)
+        )
+        # Re-checked in the DELETE itself, so an object picked up again meanwhile stays
+        keys = db.execute(
+            delete(MediaObject)
+            .where(MediaObject.sha256.in_(candidates), MediaObject.ref_count <= 0)
+            .returning(MediaObject.object_key)
+        ).scalars().all()
+        db.commit()
+        # Objects go only after the rows are gone, so a failure leaves orphans rather than broken links
+        if keys:
+            delete_files_from_s3(keys)
+        total += len(keys)
+        if len(keys) < batch:
+            return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete media objects no message references anymore")
+    parser.add_argument("--grace-hours", type=float, default=GC_GRACE.total_seconds() / 3600)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        removed = collect_garbage(db, timedelta(hours=args.grace_hours))
+        print(f"Deleted {removed} unreferenced media objects")
+    finally:
+        db.close()
@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, NamedTuple, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from app.db.sessions import is_replica
+from app.models.chat import ChatParticipant
+
+# Bounded so that a worker never holds more than this many chats / users
+MAX_CHATS = 5000
+MAX_USERS = 5000
+# Other workers can change membership too, so entries are only trusted for this long
+TTL_SECONDS = 60
+
+
+class Membership(NamedTuple):
+    chat_id: str
+    user_id: str
+    last_deleted_at: Optional[datetime]
+
+
+class MembershipCache:
+    """chat -> {member: last_deleted_at} and user -> {chat}, both LRU with a TTL."""
+
+    def __init__(self, max_chats: int = MAX_CHATS, max_users: int = MAX_USERS, ttl: float = TTL_SECONDS):
+        self.max_chats = max_chats
+        self.max_users = max_users
+        self.ttl = ttl
+        self._chats: "OrderedDict[str, tuple[float, Dict[str, Optional[datetime]]]]" = OrderedDict()
+        self._users: "OrderedDict[str, tuple[float, Set[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self, store: OrderedDict, key: str):
+        entry = store.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.ttl:
+            store.pop(key, None)
+            return None
+        store.move_to_end(key)
+        return entry[1]
+
+    def _put(self, store: OrderedDict, key: str, value, limit: int):
+        store[key] = (time.monotonic(), value)
+        store.move_to_end(key)
+        while len(store) > limit:
+            store.popitem(last=False)
+
+    def members(self, db: Session, chat_id) -> Dict[str, Optional[datetime]]:
+        chat_id = str(chat_id)
+        with self._lock:
+            members = self._fresh(self._chats, chat_id)
+            if members is not None:
+                self.hits += 1
+                return members
+            self.misses += 1
+
+        rows = db.query(ChatParticipant.user_id, ChatParticipant.last_deleted_at).filter(
+            ChatParticipant.chat_id == chat_id
+        ).all()
+        members = {str(user_id): last_deleted_at for (user_id, last_deleted_at) in rows}
+        if is_replica(db):
+            return members
+        with self._lock:
+            self._put(self._chats, chat_id, members, self.max_chats)
+        return members
+
+    def get(self, db: Session, chat_id, user_id) -> Optional[Membership]:
+        members = self.members(db, chat_id)
+        user_id = str(user_id)
+        if user_id not in members:
+            return None
+        return Membership(str(chat_id), user_id, members[user_id])
+
+    def chats_for_user(self, db: Session, user_id) -> Set[str]:
+        user_id = str(user_id)
+        with self._lock:
+            chats = self._fresh(self._users, user_id)
+            if chats is not None:
+                self.hits += 1
+                return chats
+            self.misses += 1
+
+        rows = db.query(ChatParticipant.chat_id).filter(ChatParticipant.user_id == user_id).all()
+        chats = {str(chat_id) for (chat_id,) in rows}
+        if is_replica(db):
+            return chats
+        with self._lock:
+            self._put(self._users, user_id, chats, self.max_users)
+        return chats
+
+    def set_last_deleted(self, chat_id, user_id, last_deleted_at: datetime):
+        with self._lock:
+            entry = self._chats.get(str(chat_id))
+            if entry is not None and str(user_id) in entry[1]:
+                entry[1][str(user_id)] = last_deleted_at
+
+    def invalidate_chat(self, chat_id, user_ids=()):
+        """Drop a chat after its membership changed, plus the chat sets of the users involved."""
+        with self._lock:
+            members = self._chats.pop(str(chat_id), None)
+            affected = set(str(u) for u in user_ids)
+            if members is not None:
+                affected.update(members[1])
+            for user_id in affected:
+                self._users.pop(user_id, None)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._users.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._chats.clear()
+            self._users.clear()
+
+
+membership_cache = MembershipCache()
+
+
+def get_membership(db: Session, chat_id, user_id) -> Optional[Membership]:
+    return membership_cache.get(db, chat_id, user_id)
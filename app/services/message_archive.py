@@ -0,0 +1,236 @@
+import argparse
+import gzip
+import io
+import json
+import threading
+from collections import Counter, OrderedDict
+from datetime import datetime
+from uuid import uuid4
+from typing import Iterator, List, Optional
+
+from sqlalchemy import delete, text
+from sqlalchemy.orm import Session, joinedload
+
+from app.db.sessions import SessionLocal
+from app.models.chat import Message
+from app.models.message_archive import ArchivedMedia, MessageArchive
+from app.services.upload_to_s3 import s3, BUCKET_NAME
+from app.websockets.event_buffer import message_event
+
+ARCHIVE_PREFIX = "archive/messages"
+# Partitions older than this many months go to cold storage
+HOT_MONTHS = 6
+# Segments read by one history page at most, and decoded segments kept per worker
+MAX_SEGMENTS_PER_READ = 3
+MAX_CACHED_SEGMENTS = 64
+# Partitions created ahead of time so inserts never land in messages_default
+MONTHS_AHEAD = 3
+
+
+def _month_start(dt: datetime, offset: int = 0) -> datetime:
+    index = dt.year * 12 + (dt.month - 1) + offset
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"messages_p{month:%Y%m}"
+
+
+def ensure_partitions(db: Session, months_ahead: int = MONTHS_AHEAD):
+    now = datetime.utcnow()
+    for offset in range(months_ahead + 1):
+        db.execute(text("SELECT create_messages_partition(:month)"), {"month": _month_start(now, offset).date()})
+    db.commit()
+
+
+def partitions_before(db: Session, before: datetime) -> List[datetime]:
+    rows = db.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'messages' AND c.relname LIKE 'messages\\_p%'"
+    )).all()
+    months = sorted(datetime.strptime(name[len("messages_p"):], "%Y%m") for (name,) in rows)
+    return [m for m in months if m < before]
+
+
+def _write_segment(db: Session, chat_id, month: datetime, events: List[dict]):
+    key = f"{ARCHIVE_PREFIX}/{month:%Y/%m}/{chat_id}.jsonl.gz"
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as gz:
+        for event in events:
+            gz.write(json.dumps(event).encode() + b"\n")
+    buf.seek(0)
+    s3.upload_fileobj(
+        Fileobj=buf,
+        Bucket=BUCKET_NAME,
+        Key=key,
+        ExtraArgs={"ContentType": "application/x-ndjson", "ContentEncoding": "gzip"}
+    )
+    archive = MessageArchive(
+        id=uuid4(),
+        chat_id=chat_id,
+        period_start=month,
+        period_end=_month_start(month, 1),
+        object_key=key,
+        message_count=len(events),
+    )
+    db.add(archive)
+    db.flush()
+    _index_media(db, archive, events)
+
+
+def _index_media(db: Session, archive: MessageArchive, events: List[dict]):
+    refs = Counter(event["media_url"] for event in events if event.get("media_url"))
+    db.add_all(ArchivedMedia(archive_id=archive.id, media_url=url, refs=count) for url, count in refs.items())
+
+
+def index_archived_media(db: Session) -> int:
+    """
+    Rebuild the media index of every segment from S3; only needed once, for segments
+    archived before the index existed. Returns how many segments were read.
+    """
+    total = 0
+    for archive in db.query(MessageArchive).order_by(MessageArchive.period_start).all():
+        db.execute(delete(ArchivedMedia).where(ArchivedMedia.archive_id == archive.id))
+        _index_media(db, archive, read_segment(archive.object_key))
+        db.commit()
+        total += 1
+    return total
+
+
+def archive_partition(db: Session, month: datetime) -> int:
+    """Copy one monthly partition to S3 (one object per chat), then detach and drop it."""
+    end = _month_start(month, 1)
+    done = db.query(MessageArchive.id).filter(MessageArchive.period_start == month).first()
+
+    archived = 0
+    if not done:
+        rows = (
+            db.query(Message)
+            .options(joinedload(Message.sender))
+            .filter(Message.created_at >= month, Message.created_at < end)
+            .order_by(Message.chat_id, Message.created_at)
+            .yield_per(1000)
+        )
+        chat_id, events = None, []
+        for m in rows:
+            if m.chat_id != chat_id and events:
+                _write_segment(db, chat_id, month, events)
+                events = []
+            chat_id = m.chat_id
+            events.append(message_event(m, m.sender))
+            archived += 1
+        if events:
+            _write_segment(db, chat_id, month, events)
+        db.commit()
+
+    name = partition_name(month)
+    db.execute(text(f'ALTER TABLE messages DETACH PARTITION "{name}"'))
+    db.execute(text(f'DROP TABLE "{name}"'))
+    db.commit()
+    return archived
+
+
+def archive_old_partitions(db: Session, hot_months: int = HOT_MONTHS) -> int:
+    ensure_partitions(db)
+    cutoff = _month_start(datetime.utcnow(), -hot_months)
+    total = 0
+    for month in partitions_before(db, cutoff):
+        count = archive_partition(db, month)
+        print(f"Archived {partition_name(month)}: {count} messages")
+        total += count
+    return total
+
+
+def read_segment(key: str) -> Iterator[dict]:
+    body = s3.get_object(Bucket=BUCKET_NAME, Key=key)["Body"].read()
+    for line in gzip.decompress(body).splitlines():
+        if line:
+            yield json.loads(line)
+
+
+class SegmentCache:
+    """Decoded segments by object key; segments are never rewritten, so entries need no expiry."""
+
+    def __init__(self, max_segments: int = MAX_CACHED_SEGMENTS):
+        self.max_segments = max_segments
+        self._segments: "OrderedDict[str, List[dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> List[dict]:
+        with self._lock:
+            events = self._segments.get(key)
+            if events is not None:
+                self._segments.move_to_end(key)
+                return events
+        events = list(read_segment(key))
+        with self._lock:
+            self._segments[key] = events
+            self._segments.move_to_end(key)
+            while len(self._segments) > self.max_segments:
+                self._segments.popitem(last=False)
+        return events
+
+
+segment_cache = SegmentCache()
+
+
+def newest_archived(db: Session, chat_id, after: Optional[datetime] = None) -> Optional[datetime]:
+    """End of the chat's newest archived period, or None when nothing (visible) is archived."""
+    query = db.query(MessageArchive.period_end).filter(MessageArchive.chat_id == chat_id)
+    if after:
+        query = query.filter(MessageArchive.period_end > after)
+    row = query.order_by(MessageArchive.period_start.desc()).first()
+    return row[0] if row else None
+
+
+def archived_events(
+    db: Session,
+    chat_id,
+    limit: int,
+    after: Optional[datetime] = None,
+    before: Optional[datetime] = None,
+    max_segments: int = MAX_SEGMENTS_PER_READ,
+) -> List[dict]:
+    """
+    The newest ``limit`` cold messages of a chat between ``after`` and ``before``, oldest
+    first. Reads at most ``max_segments`` segments; a page cut short by that is continued
+    with ``before`` set to its oldest message.
+    """
+    query = db.query(MessageArchive).filter(MessageArchive.chat_id == chat_id)
+    if after:
+        query = query.filter(MessageArchive.period_end > after)
+    if before:
+        query = query.filter(MessageArchive.period_start < before)
+    segments = query.order_by(MessageArchive.period_start.desc()).limit(max_segments).all()
+
+    events: List[dict] = []
+    for segment in segments:
+        chunk = [
+            e for e in segment_cache.get(segment.object_key)
+            if (after is None or datetime.fromisoformat(e["created_at"]) > after)
+            and (before is None or datetime.fromisoformat(e["created_at"]) < before)
+        ]
+        events = chunk + events
+        if len(events) >= limit:
+            return events[-limit:]
+    return events
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old message partitions to cold storage")
+    parser.add_argument("--hot-months", type=int, default=HOT_MONTHS)
+    parser.add_argument("--index-media", action="store_true",
+                        help="Only rebuild the media index of existing segments")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.index_media:
+            print(f"Indexed media of {index_archived_media(db)} archive segments")
+        else:
+            total = archive_old_partitions(db, args.hot_months)
+            print(f"Archived {total} messages")
+    finally:
+        db.close()
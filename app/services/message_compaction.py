@@ -0,0 +1,127 @@
+import argparse
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from sqlalchemy import delete, func, text
+from sqlalchemy.orm import Session
+
+from app.db.sessions import SessionLocal
+from app.models.chat import ChatParticipant, Message
+from app.models.message_archive import ArchivedMedia, MessageArchive
+from app.models.pinned_message import PinnedMessage
+from app.services.media_store import collect_garbage, release, release_urls
+from app.services.upload_to_s3 import delete_files_from_s3, key_from_url
+
+# Rows deleted per transaction, and the pause between transactions
+BATCH_SIZE = 500
+BATCH_PAUSE_SECONDS = 0.05
+# A batch gives up instead of queueing behind long-held row locks
+LOCK_TIMEOUT = "2s"
+
+
+def cleared_chats(db: Session) -> List[Tuple[str, datetime]]:
+    """Chats where every participant has cleared history, with the oldest clear point."""
+    return (
+        db.query(ChatParticipant.chat_id, func.min(ChatParticipant.last_deleted_at))
+        .group_by(ChatParticipant.chat_id)
+        .having(func.count() == func.count(ChatParticipant.last_deleted_at))
+        .all()
+    )
+
+
+def _purge_batch(db: Session, chat_id, cutoff: datetime, batch_size: int) -> Dict[str, int]:
+    if db.bind.dialect.name == "postgresql":
+        db.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+
+    rows = (
+        db.query(Message.id, Message.media_url, Message.media_hash)
+        .filter(Message.chat_id == chat_id, Message.created_at < cutoff)
+        .order_by(Message.created_at)
+        .limit(batch_size)
+        .all()
+    )
+    if not rows:
+        return {"messages": 0, "pins": 0, "media": 0}
+
+    ids = [message_id for (message_id, _url, _hash) in rows]
+    # Deduplicated media is reference counted and collected by collect_garbage();
+    # only legacy per-message objects are deleted here
+    urls = {url for (_id, url, media_hash) in rows if url and not media_hash}
+    pins = db.execute(delete(PinnedMessage).where(PinnedMessage.message_id.in_(ids))).rowcount
+    messages = db.execute(delete(Message).where(Message.id.in_(ids))).rowcount
+    release(db, [media_hash for (_id, _url, media_hash) in rows])
+    if urls:
+        # Forwarded copies in other chats share the same object, live or archived
+        still_used = {url for (url,) in db.query(Message.media_url).filter(Message.media_url.in_(urls)).distinct()}
+        still_used |= {
+            url for (url,) in db.query(ArchivedMedia.media_url).filter(ArchivedMedia.media_url.in_(urls)).distinct()
+        }
+        urls -= still_used
+    media_keys = [key_from_url(url) for url in urls]
+    db.commit()
+
+    # Objects go only after the rows are gone, so a failure leaves orphans rather than broken links
+    if media_keys:
+        delete_files_from_s3(media_keys)
+    return {"messages": messages, "pins": pins, "media": len(media_keys)}
+
+
+def _purge_archives(db: Session, chat_id, cutoff: datetime) -> int:
+    segments = db.query(MessageArchive).filter(
+        MessageArchive.chat_id == chat_id, MessageArchive.period_end <= cutoff
+    ).all()
+    if not segments:
+        return 0
+    keys = [segment.object_key for segment in segments]
+    ids = [segment.id for segment in segments]
+    # Archived messages still hold their media references
+    refs = db.query(ArchivedMedia.media_url, ArchivedMedia.refs).filter(ArchivedMedia.archive_id.in_(ids)).all()
+    release_urls(db, [url for (url, count) in refs for _ in range(count)])
+    db.execute(delete(ArchivedMedia).where(ArchivedMedia.archive_id.in_(ids)))
+    for segment in segments:
+        db.delete(segment)
+    db.commit()
+    delete_files_from_s3(keys)
+    return len(keys)
+
+
+def purge_cleared_messages(
+    db: Session,
+    batch_size: int = BATCH_SIZE,
+    pause: float = BATCH_PAUSE_SECONDS,
+) -> Dict[str, int]:
+    totals = {"chats": 0, "messages": 0, "pins": 0, "media": 0, "archives": 0}
+    for chat_id, cutoff in cleared_chats(db):
+        reclaimed = 0
+        while True:
+            counts = _purge_batch(db, chat_id, cutoff, batch_size)
+            for key, value in counts.items():
+                totals[key] += value
+            reclaimed += counts["messages"]
+            if counts["messages"] < batch_size:
+                break
+            time.sleep(pause)
+        totals["archives"] += _purge_archives(db, chat_id, cutoff)
+        if reclaimed:
+            totals["chats"] += 1
+    totals["media"] += collect_garbage(db)
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hard-delete messages every participant has cleared")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=BATCH_PAUSE_SECONDS)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        totals = purge_cleared_messages(db, args.batch_size, args.pause)
+        print(
+            f"Reclaimed {totals['messages']} messages, {totals['pins']} pins, "
+            f"{totals['media']} media objects and {totals['archives']} archive segments "
+            f"from {totals['chats']} chats"
+        )
+    finally:
+        db.close()
@@ -0,0 +1,317 @@
+import asyncio
+import json
+import logging
+import traceback
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from uuid import uuid4
+
+from sqlalchemy import event, or_
+from sqlalchemy.orm import Session
+
+from app.db.sessions import SessionLocal
+from app.models.outbox import OutboxEvent
+from app.websockets.connection_manager import manager
+
+logger = logging.getLogger(__name__)
+
+# Events claimed per round trip
+BATCH_SIZE = 100
+# Fallback poll for events written by other workers or left behind by a crash
+POLL_SECONDS = 1.0
+# A claimed event is handed out again if its worker has not finished it by then;
+# background handlers still running get their lease renewed every LEASE_RENEW_SECONDS
+LEASE_SECONDS = 60
+LEASE_RENEW_SECONDS = LEASE_SECONDS / 3
+# Retry backoff: BASE * 2^attempts, capped; after MAX_ATTEMPTS (or the kind's own limit)
+# the event stays as a dead letter
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 300.0
+MAX_ATTEMPTS = 8
+# Delivered events are kept this long for debugging
+RETENTION = timedelta(days=1)
+PURGE_EVERY_SECONDS = 600
+
+# Tags the events only this process may deliver
+WORKER_ID = uuid4().hex
+
+Handler = Callable[[dict], Awaitable[None]]
+handlers: Dict[str, Handler] = {}
+# Called once when an event becomes a dead letter
+give_up_handlers: Dict[str, Handler] = {}
+# Slow kinds (AI, email) run as their own tasks so broadcasts never queue behind them
+background_kinds: Set[str] = set()
+attempt_limits: Dict[str, int] = {}
+
+
+def outbox_handler(
+    kind: str,
+    on_give_up: Optional[Handler] = None,
+    background: bool = False,
+    max_attempts: int = MAX_ATTEMPTS,
+):
+    """Register the coroutine that delivers events of ``kind``; it must be safe to run twice."""
+    def register(fn: Handler) -> Handler:
+        handlers[kind] = fn
+        attempt_limits[kind] = max_attempts
+        if on_give_up:
+            give_up_handlers[kind] = on_give_up
+        if background:
+            background_kinds.add(kind)
+        return fn
+    return register
+
+
+def record(
+    db: Session,
+    kind: str,
+    payload: dict,
+    delay: Optional[float] = None,
+    local: bool = False,
+    owner: Optional[str] = None,
+):
+    """
+    Queue a side effect in ``db``'s transaction; it is delivered only if that transaction
+    commits, and no sooner than ``delay`` seconds after. ``local`` events are delivered
+    by this worker only, ``owner`` ones by the worker with that WORKER_ID.
+    """
+    row = OutboxEvent(kind=kind, payload=payload, owner=owner or (WORKER_ID if local else None))
+    if delay:
+        row.available_at = datetime.utcnow() + timedelta(seconds=delay)
+    db.add(row)
+    db.info["outbox_pending"] = True
+
+
+def record_broadcast(db: Session, chat_id, frame: dict, owner: Optional[str] = None):
+    # Sent to this worker's sockets (or ``owner``'s), as a direct broadcast would; any
+    # other worker claiming it would reach the wrong sockets
+    record(db, "broadcast", {"chat_id": str(chat_id), "frame": frame}, local=True, owner=owner)
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_after_commit(session: Session):
+    if session.info.pop("outbox_pending", False):
+        dispatcher.wake()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(session: Session):
+    session.info.pop("outbox_pending", None)
+
+
+@outbox_handler("broadcast")
+async def _deliver_broadcast(payload: dict):
+    await manager.broadcast(payload["chat_id"], json.dumps(payload["frame"]))
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempts - 1)))
+
+
+class OutboxDispatcher:
+    """
+    Delivers outbox events at least once, in id order, from a background task. Every
+    database round trip runs in a worker thread; only the handlers run on the event loop.
+    """
+
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._last_purge = datetime.min
+        self._background: Set[asyncio.Task] = set()
+        self.delivered = 0
+        self.failed = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._background):
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+
+    def wake(self):
+        # Commits happen on the event loop and in threadpool endpoints alike
+        if self._loop is None or self._loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def claim(self, db: Session, limit: int = BATCH_SIZE) -> List[Tuple[int, str, dict, int]]:
+        """Lease up to ``limit`` due events; returns (id, kind, payload, attempts) in id order."""
+        now = datetime.utcnow()
+        query = (
+            db.query(OutboxEvent.id, OutboxEvent.kind, OutboxEvent.payload, OutboxEvent.attempts)
+            .filter(
+                OutboxEvent.dispatched_at.is_(None),
+                OutboxEvent.available_at <= now,
+                OutboxEvent.failed_at.is_(None),
+                or_(OutboxEvent.owner.is_(None), OutboxEvent.owner == WORKER_ID),
+            )
+            .order_by(OutboxEvent.id)
+            .limit(limit)
+        )
+        if db.bind.dialect.name == "postgresql":
+            # Concurrent workers take disjoint batches
+            query = query.with_for_update(skip_locked=True)
+        rows = [tuple(row) for row in query.all()]
+        if rows:
+            db.query(OutboxEvent).filter(OutboxEvent.id.in_([row[0] for row in rows])).update(
+                {OutboxEvent.available_at: now + timedelta(seconds=LEASE_SECONDS)}, synchronize_session=False
+            )
+        db.commit()
+        return rows
+
+    async def _deliver(self, kind: str, payload: dict) -> Optional[str]:
+        """Run the handler; returns the error text, or None on success."""
+        handler = handlers.get(kind)
+        try:
+            if handler is None:
+                raise LookupError(f"No outbox handler for {kind!r}")
+            await handler(payload)
+        except Exception as e:
+            self.failed += 1
+            return "".join(traceback.format_exception_only(type(e), e)).strip()
+        self.delivered += 1
+        return None
+
+    def _record_failure(self, db: Session, event_id: int, kind: str, attempts: int, error: str) -> bool:
+        """Schedule the retry; returns whether the event is now a dead letter."""
+        attempts += 1
+        dead = attempts >= attempt_limits.get(kind, MAX_ATTEMPTS)
+        db.query(OutboxEvent).filter(OutboxEvent.id == event_id).update({
+            OutboxEvent.attempts: attempts,
+            OutboxEvent.last_error: error,
+            OutboxEvent.available_at: datetime.utcnow() + _backoff(attempts),
+            OutboxEvent.failed_at: datetime.utcnow() if dead else None,
+        }, synchronize_session=False)
+        db.commit()
+        return dead
+
+    async def _settle(self, db: Session, event_id: int, kind: str, payload: dict, attempts: int, error: str):
+        logger.warning("Outbox event %s (%s) failed: %s", event_id, kind, error)
+        dead = await asyncio.to_thread(self._record_failure, db, event_id, kind, attempts, error)
+        if dead and kind in give_up_handlers:
+            try:
+                await give_up_handlers[kind](payload)
+            except Exception:
+                logger.exception("Outbox give-up handler for %s failed", kind)
+
+    def _mark_delivered(self, db: Session, ids: List[int]):
+        if ids:
+            db.query(OutboxEvent).filter(OutboxEvent.id.in_(ids)).update(
+                {OutboxEvent.dispatched_at: datetime.utcnow()}, synchronize_session=False
+            )
+            db.commit()
+
+    def _extend_lease(self, event_id: int):
+        db = self.session_factory()
+        try:
+            db.query(OutboxEvent).filter(OutboxEvent.id == event_id, OutboxEvent.dispatched_at.is_(None)).update(
+                {OutboxEvent.available_at: datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)},
+                synchronize_session=False,
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    async def _renew_lease(self, event_id: int):
+        # A long handler (an AI reply) must not be claimed and run a second time meanwhile
+        while True:
+            await asyncio.sleep(LEASE_RENEW_SECONDS)
+            try:
+                await asyncio.to_thread(self._extend_lease, event_id)
+            except Exception:
+                logger.exception("Outbox lease renewal failed for event %s", event_id)
+
+    async def _deliver_in_background(self, event_id: int, kind: str, payload: dict, attempts: int):
+        renew = asyncio.create_task(self._renew_lease(event_id))
+        try:
+            error = await self._deliver(kind, payload)
+        finally:
+            renew.cancel()
+        db = self.session_factory()
+        try:
+            if error is None:
+                await asyncio.to_thread(self._mark_delivered, db, [event_id])
+            else:
+                await self._settle(db, event_id, kind, payload, attempts, error)
+        except Exception:
+            # Left leased; claimed again once the lease runs out
+            logger.exception("Outbox event %s could not be settled", event_id)
+        finally:
+            await asyncio.to_thread(db.close)
+
+    async def dispatch_once(self, db: Session) -> int:
+        rows = await asyncio.to_thread(self.claim, db)
+        delivered = []
+        for event_id, kind, payload, attempts in rows:
+            if kind in background_kinds:
+                task = asyncio.create_task(self._deliver_in_background(event_id, kind, payload, attempts))
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+                continue
+            error = await self._deliver(kind, payload)
+            if error is None:
+                delivered.append(event_id)
+            else:
+                await self._settle(db, event_id, kind, payload, attempts, error)
+        # One UPDATE for the whole batch; a crash before it only means redelivery
+        await asyncio.to_thread(self._mark_delivered, db, delivered)
+        return len(rows)
+
+    def purge(self, db: Session) -> int:
+        cutoff = datetime.utcnow() - RETENTION
+        removed = db.query(OutboxEvent).filter(OutboxEvent.dispatched_at < cutoff).delete(synchronize_session=False)
+        # Broadcasts of workers that went away before sending them; stale by now either way
+        removed += db.query(OutboxEvent).filter(
+            OutboxEvent.dispatched_at.is_(None),
+            OutboxEvent.owner.isnot(None),
+            OutboxEvent.owner != WORKER_ID,
+            OutboxEvent.created_at < cutoff,
+        ).delete(synchronize_session=False)
+        db.commit()
+        return removed
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            db = self.session_factory()
+            try:
+                # Keep draining while full batches come back
+                while await self.dispatch_once(db) == BATCH_SIZE:
+                    pass
+                if datetime.utcnow() - self._last_purge > timedelta(seconds=PURGE_EVERY_SECONDS):
+                    await asyncio.to_thread(self.purge, db)
+                    self._last_purge = datetime.utcnow()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Outbox dispatch failed")
+            finally:
+                await asyncio.to_thread(db.close)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+
+dispatcher = OutboxDispatcher()
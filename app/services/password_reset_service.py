@@ -1,3 +1,4 @@
+import asyncio
 import uuid
 import smtplib
 import os
@@ -10,6 +11,7 @@ from sqlalchemy.orm import Session
 from app.models.user import User
 from app.models.password_reset import PasswordResetToken
 from app.services.auth_service import hash_password
+from app.services.outbox import outbox_handler,record
 
 RESET_TOKEN_EXPIRY_MINUTES=10
 load_dotenv()
@@ -52,6 +54,11 @@ def send_reset_email(recepient_email:str,token:str):
 
 
 
+@outbox_handler("password_reset_email",background=True)
+async def deliver_reset_email(payload:dict):
+    await asyncio.to_thread(send_reset_email,payload["email"],payload["token"])
+
+
 def create_password_reset_token(email:str,db:Session)->str:
     user=db.query(User).filter(User.email==email).first()
     
@@ -68,8 +75,9 @@ def create_password_reset_token(email:str,db:Session)->str:
         user_id=user.id,
         expires_at=expires_at
     ))
+    # Sent by the outbox dispatcher once the token is committed
+    record(db,"password_reset_email",{"email":user.email,"token":token})
     db.commit()
-    send_reset_email(user.email,token)
     
     return token
 
@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.db.sessions import is_replica
+from app.models.chat import Message
+from app.models.pinned_message import PinnedMessage
+from app.models.user import User
+
+MAX_CHATS = 2000
+# Pins changed by another worker show up after at most this long
+TTL_SECONDS = 30
+
+
+def load_pins(db: Session, chat_id) -> List[dict]:
+    """Every pin of a chat with its message and sender card, newest first, in one query."""
+    rows = (
+        db.query(PinnedMessage, Message, User)
+        .outerjoin(Message, Message.id == PinnedMessage.message_id)
+        .outerjoin(User, User.id == Message.sender_id)
+        .filter(PinnedMessage.chat_id == chat_id)
+        .order_by(PinnedMessage.pinned_at.desc())
+        .all()
+    )
+    pins = []
+    for pin, message, sender in rows:
+        pins.append({
+            "id": pin.id,
+            "chat_id": pin.chat_id,
+            "message_id": pin.message_id,
+            "pinned_at": pin.pinned_at,
+            "message": {
+                "id": message.id,
+                "chat_id": message.chat_id,
+                "sender_id": message.sender_id,
+                "sender_name": (sender.full_name or sender.username) if sender else None,
+                "sender_image": sender.profile_image if sender else None,
+                "content": message.content,
+                "created_at": message.created_at,
+                "is_edited": bool(message.is_edited),
+                "media_type": message.media_type,
+                "media_url": message.media_url,
+            } if message else None,
+        })
+    return pins
+
+
+class PinCache:
+    def __init__(self, max_chats: int = MAX_CHATS, ttl: float = TTL_SECONDS):
+        self.max_chats = max_chats
+        self.ttl = ttl
+        self._pins: "OrderedDict[str, tuple[float, List[dict]]]" = OrderedDict()
+        # bumped on invalidate so a load that raced with a write is not stored
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _cached(self, chat_id: str) -> Optional[List[dict]]:
+        with self._lock:
+            entry = self._pins.get(chat_id)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                return None
+            self._pins.move_to_end(chat_id)
+            return entry[1]
+
+    def get(self, db: Session, chat_id) -> List[dict]:
+        chat_id = str(chat_id)
+        pins = self._cached(chat_id)
+        if pins is None:
+            generation = self._generation
+            pins = load_pins(db, chat_id)
+            with self._lock:
+                if generation != self._generation or is_replica(db):
+                    return pins
+                self._pins[chat_id] = (time.monotonic(), pins)
+                self._pins.move_to_end(chat_id)
+                while len(self._pins) > self.max_chats:
+                    self._pins.popitem(last=False)
+        return pins
+
+    def invalidate(self, chat_id):
+        with self._lock:
+            self._generation += 1
+            self._pins.pop(str(chat_id), None)
+
+
+pin_cache = PinCache()
@@ -0,0 +1,355 @@
+import argparse
+import asyncio
+import math
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from fastapi import HTTPException, status
+from sqlalchemy import delete, func, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.db.sessions import SessionLocal
+from app.models.chat import Message
+from app.models.media_object import MediaObject
+from app.models.upload_session import UploadPart, UploadSession
+from app.core.versioning import bump_chat
+from app.services.media_store import MEDIA_PREFIX, acquire, extension, hash_object, register
+from app.services.outbox import outbox_handler, record
+from app.websockets.event_buffer import event_buffer
+from app.services.upload_to_s3 import (
+    abort_multipart_upload, complete_multipart_upload, delete_files_from_s3, object_exists, object_url, s3,
+    start_multipart_upload, upload_part,
+)
+
+# Chunk i of a session covers bytes [i * chunk_size, (i + 1) * chunk_size) and is part i + 1
+# of its S3 multipart upload. S3 parts must be at least 5 MiB, except the last one
+CHUNK_SIZE = 8 * 1024 * 1024
+MAX_UPLOAD_BYTES = 4 * 1024 * 1024 * 1024
+# Counted from the last chunk; sessions left longer are aborted by cleanup_expired()
+SESSION_TTL = timedelta(hours=24)
+# Open sessions per user; each one holds S3 parts until it is finalized or aborted
+MAX_OPEN_SESSIONS = 5
+# A finalize that has not finished within this is presumed dead and may be taken over
+COMPLETE_LEASE = timedelta(minutes=15)
+COMPLETE_RETRY_AFTER = 5
+# Assembled objects are registered under this until hashed in the background, as
+# reading up to MAX_UPLOAD_BYTES back from S3 does not fit in the complete request
+PENDING_PREFIX = "upload:"
+CLEANUP_BATCH = 100
+
+
+def _now() -> datetime:
+    return datetime.utcnow()
+
+
+def total_chunks(upload: UploadSession) -> int:
+    return math.ceil(upload.size / upload.chunk_size)
+
+
+def chunk_length(upload: UploadSession, index: int) -> int:
+    return min(upload.chunk_size, upload.size - index * upload.chunk_size)
+
+
+def create_session(db: Session, user_id, chat_id, filename: Optional[str], content_type: str, size: int) -> UploadSession:
+    if size <= 0 or size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=400, detail=f"File size must be between 1 and {MAX_UPLOAD_BYTES} bytes")
+    open_sessions = db.query(func.count(UploadSession.id)).filter(
+        UploadSession.user_id == user_id,
+        UploadSession.status == "open",
+        UploadSession.expires_at > _now(),
+    ).scalar()
+    if open_sessions >= MAX_OPEN_SESSIONS:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many unfinished uploads, finish or cancel one first",
+        )
+    session_id = uuid4()
+    # Registered under this key as it is once complete; the hash is only known by then
+    key = f"{MEDIA_PREFIX}/uploads/{session_id}.{extension(filename)}"
+    upload = UploadSession(
+        id=session_id, user_id=user_id, chat_id=chat_id, filename=filename, content_type=content_type,
+        size=size, chunk_size=CHUNK_SIZE, object_key=key, s3_upload_id=start_multipart_upload(key, content_type),
+        expires_at=_now() + SESSION_TTL,
+    )
+    db.add(upload)
+    return upload
+
+
+def get_session(db: Session, session_id, user_id) -> UploadSession:
+    upload = db.query(UploadSession).filter(UploadSession.id == session_id).first()
+    if upload is None or upload.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if upload.status == "open" and upload.expires_at <= _now():
+        raise HTTPException(status_code=410, detail="Upload expired, start a new one")
+    return upload
+
+
+def received_parts(db: Session, upload: UploadSession) -> Dict[int, str]:
+    """part number -> ETag of every chunk S3 has."""
+    rows = db.query(UploadPart.part_number, UploadPart.etag).filter(UploadPart.session_id == upload.id).all()
+    return dict(rows)
+
+
+def progress(db: Session, upload: UploadSession) -> dict:
+    received = sorted(received_parts(db, upload))
+    done = set(received)
+    missing = [n for n in range(1, total_chunks(upload) + 1) if n not in done]
+    return {
+        "upload_id": str(upload.id),
+        "status": upload.status,
+        "size": upload.size,
+        "chunk_size": upload.chunk_size,
+        "total_chunks": total_chunks(upload),
+        "received_chunks": [n - 1 for n in received],
+        "missing_offsets": [(n - 1) * upload.chunk_size for n in missing],
+        "received_bytes": sum(chunk_length(upload, n - 1) for n in received),
+        "expires_at": upload.expires_at.isoformat(),
+        "message_id": str(upload.message_id) if upload.message_id else None,
+    }
+
+
+def chunk_at(upload: UploadSession, offset: int) -> Tuple[int, int]:
+    """(index, expected length) of the chunk starting at ``offset``."""
+    if offset < 0 or offset >= upload.size or offset % upload.chunk_size:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Offset must be a multiple of {upload.chunk_size} below {upload.size}",
+        )
+    index = offset // upload.chunk_size
+    return index, chunk_length(upload, index)
+
+
+async def put_chunk(db: Session, upload: UploadSession, offset: int, body: bytes) -> UploadPart:
+    if upload.status != "open":
+        raise HTTPException(status_code=409, detail="Upload already finalized")
+    index, expected = chunk_at(upload, offset)
+    if len(body) != expected:
+        raise HTTPException(status_code=400, detail=f"Chunk at offset {offset} must be {expected} bytes")
+    try:
+        etag = await asyncio.to_thread(upload_part, upload.object_key, upload.s3_upload_id, index + 1, body)
+    except s3.exceptions.NoSuchUpload:
+        raise HTTPException(status_code=410, detail="Upload expired, start a new one")
+
+    # Re-checked under the row lock: a chunk that lost the race with finalize is not recorded
+    current = db.query(UploadSession.status).filter(UploadSession.id == upload.id).with_for_update().scalar()
+    if current != "open":
+        raise HTTPException(status_code=409, detail="Upload already finalized")
+    part = UploadPart(session_id=upload.id, part_number=index + 1, etag=etag, size=len(body))
+    try:
+        with db.begin_nested():
+            db.add(part)
+    except IntegrityError:
+        # Sent again (or twice at once): S3 keeps the last part written, so does the row
+        db.execute(
+            update(UploadPart)
+            .where(UploadPart.session_id == upload.id, UploadPart.part_number == index + 1)
+            .values(etag=etag, size=len(body), uploaded_at=_now())
+            .execution_options(synchronize_session=False)
+        )
+    upload.expires_at = _now() + SESSION_TTL
+    return part
+
+
+def lock_session(db: Session, session_id, user_id) -> UploadSession:
+    """get_session(), holding the row until the transaction ends."""
+    upload = (
+        db.query(UploadSession)
+        .filter(UploadSession.id == session_id)
+        .with_for_update()
+        .populate_existing()
+        .first()
+    )
+    if upload is None or upload.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if upload.status == "open" and upload.expires_at <= _now():
+        raise HTTPException(status_code=410, detail="Upload expired, start a new one")
+    return upload
+
+
+def claim(db: Session, upload: UploadSession) -> datetime:
+    """
+    Move a locked session to "completing" and commit, so the S3 work runs outside any
+    transaction and an overlapping finalize backs off. Returns the claim stamp that
+    finalize() and release_claim() need. A claim older than COMPLETE_LEASE is taken over.
+    """
+    now = _now()
+    if upload.status == "completing" and upload.completing_at and upload.completing_at > now - COMPLETE_LEASE:
+        raise HTTPException(
+            status_code=409,
+            detail="Upload is being finalized, retry shortly",
+            headers={"Retry-After": str(COMPLETE_RETRY_AFTER)},
+        )
+    if upload.status == "open":
+        missing = total_chunks(upload) - len(received_parts(db, upload))
+        if missing:
+            raise HTTPException(
+                status_code=409,
+                detail={"message": f"{missing} chunks missing", **progress(db, upload)},
+            )
+    upload.status = "completing"
+    upload.completing_at = now
+    upload.expires_at = now + SESSION_TTL
+    db.commit()
+    return now
+
+
+def release_claim(db: Session, session_id, claimed: datetime):
+    """Give up a claim after a failure, so a retry continues right away."""
+    db.rollback()
+    db.execute(
+        update(UploadSession)
+        .where(UploadSession.id == session_id, UploadSession.status == "completing",
+               UploadSession.completing_at == claimed)
+        .values(completing_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def pending_hash(upload: UploadSession) -> str:
+    return f"{PENDING_PREFIX}{upload.id.hex}"
+
+
+async def finalize(db: Session, upload: UploadSession, claimed: datetime) -> MediaObject:
+    """
+    Assemble the chunks of a claimed session and register the result under its pending
+    hash, with one reference taken in ``db``'s transaction. The session is marked
+    completed and deduplicate_upload() is queued; the caller attaches the message and commits.
+    """
+    session_id, key, s3_upload_id = upload.id, upload.object_key, upload.s3_upload_id
+    etags = received_parts(db, upload)
+    db.rollback()  # nothing held while S3 works
+    try:
+        await asyncio.to_thread(complete_multipart_upload, key, s3_upload_id, etags)
+    except s3.exceptions.NoSuchUpload:
+        # Either an earlier attempt assembled it and failed afterwards, and the object is
+        # there to pick up, or it was aborted meanwhile (cancelled or expired)
+        if not await asyncio.to_thread(object_exists, key):
+            raise HTTPException(status_code=410, detail="Upload expired, start a new one")
+
+    upload = (
+        db.query(UploadSession)
+        .filter(UploadSession.id == session_id)
+        .with_for_update()
+        .populate_existing()
+        .first()
+    )
+    if upload is None or upload.status != "completing" or upload.completing_at != claimed:
+        raise HTTPException(status_code=409, detail="Upload was finalized by another request")
+    media = register(db, pending_hash(upload), upload.size, key, object_url(key), upload.content_type)
+    upload.status = "completed"
+    db.execute(delete(UploadPart).where(UploadPart.session_id == upload.id))
+    record(db, "upload_dedup", {"pending": media.sha256})
+    return media
+
+
+def _pending_key(pending: str) -> Optional[str]:
+    db = SessionLocal()
+    try:
+        return db.query(MediaObject.object_key).filter(MediaObject.sha256 == pending).scalar()
+    finally:
+        db.close()
+
+
+def resolve_pending(db: Session, pending: str, sha256: str) -> List[str]:
+    """
+    Give a pending object its content hash. When those bytes are stored already, its
+    references and messages move to that copy and it is left to collect_garbage(), which
+    keeps it GC_GRACE longer for clients still holding its URL. Returns the chats whose
+    messages changed.
+    """
+    media = db.query(MediaObject).filter(MediaObject.sha256 == pending).with_for_update().first()
+    if media is None or media.ref_count <= 0:
+        # Resolved already, or every message sending it is gone: garbage either way
+        return []
+    chat_ids = [str(chat_id) for (chat_id,) in db.query(Message.chat_id).filter(Message.media_hash == pending).distinct()]
+    stored = acquire(db, sha256, media.ref_count)
+    if stored is None:
+        # First copy of these bytes; a concurrent twin fails on the key and merges on retry
+        db.execute(update(MediaObject).where(MediaObject.sha256 == pending).values(sha256=sha256))
+        db.execute(update(Message).where(Message.media_hash == pending).values(media_hash=sha256))
+    else:
+        db.execute(
+            update(Message).where(Message.media_hash == pending).values(media_hash=sha256, media_url=stored.url)
+        )
+        media.ref_count = 0
+        media.released_at = _now()
+    db.commit()
+    return chat_ids if stored is not None else []
+
+
+def _resolve(pending: str, sha256: str) -> List[str]:
+    db = SessionLocal()
+    try:
+        return resolve_pending(db, pending, sha256)
+    finally:
+        db.close()
+
+
+@outbox_handler("upload_dedup", background=True)
+async def deduplicate_upload(payload: dict):
+    key = await asyncio.to_thread(_pending_key, payload["pending"])
+    if key is None:
+        return
+    # Hashed from what S3 assembled, never from what the client claims, so a
+    # deduplicated reference can only be obtained by actually having the bytes
+    try:
+        sha256, _size = await asyncio.to_thread(hash_object, key)
+    except s3.exceptions.NoSuchKey:
+        return  # unreferenced and collected meanwhile
+    for chat_id in await asyncio.to_thread(_resolve, payload["pending"], sha256):
+        # Their messages now carry the stored copy's URL
+        event_buffer.invalidate(chat_id)
+        bump_chat(chat_id)
+
+
+def _delete_session(db: Session, upload: UploadSession):
+    db.execute(delete(UploadPart).where(UploadPart.session_id == upload.id))
+    db.delete(upload)
+
+
+def abort(db: Session, upload: UploadSession):
+    if upload.status in ("open", "completing"):
+        abort_multipart_upload(upload.object_key, upload.s3_upload_id)
+    if upload.status == "completing":
+        # May have been assembled already; never registered, as that happens with "completed"
+        delete_files_from_s3([upload.object_key])
+    _delete_session(db, upload)
+
+
+def cleanup_expired(db: Session, batch: int = CLEANUP_BATCH) -> int:
+    """
+    Abort sessions past their expiry and drop completed ones; returns how many went.
+    Run periodically with ``python -m app.services.resumable_upload``. A bucket lifecycle
+    rule aborting incomplete multipart uploads after a few days backs this up.
+    """
+    total = 0
+    while True:
+        expired = (
+            db.query(UploadSession)
+            .filter(UploadSession.expires_at < _now())
+            .order_by(UploadSession.expires_at)
+            .limit(batch)
+            .all()
+        )
+        for upload in expired:
+            # S3 first: a failure leaves the row, and the next run aborts it again
+            abort(db, upload)
+        db.commit()
+        total += len(expired)
+        if len(expired) < batch:
+            return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Abort resumable uploads abandoned past their expiry")
+    parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        removed = cleanup_expired(db)
+        print(f"Cleaned up {removed} expired upload sessions")
+    finally:
+        db.close()
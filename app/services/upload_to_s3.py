@@ -1,7 +1,7 @@
 import boto3
+from botocore.exceptions import ClientError
 import os
 from dotenv import load_dotenv
-from uuid import uuid4
 load_dotenv()
 BUCKET_NAME=os.getenv("S3_BUCKET_NAME")
 
@@ -10,14 +10,77 @@ if BUCKET_NAME is None:
 
 s3=boto3.client("s3")
 
-def upload_file_to_s3(file_obj,content_type:str,chat_id:str)->str:
-    file_extension=file_obj.filename.split(".")[-1]
-    unique_filename = f"media/{chat_id}/{uuid4()}.{file_extension}"
+def object_url(key:str)->str:
+    return f"https://{BUCKET_NAME}.s3.amazonaws.com/{key}"
+
+
+def upload_object(fileobj,key:str,content_type:str)->str:
     s3.upload_fileobj(
-        Fileobj=file_obj.file,
+        Fileobj=fileobj,
         Bucket=BUCKET_NAME,
-        Key=unique_filename,
+        Key=key,
         ExtraArgs={"ContentType": content_type}
     )
-    file_url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{unique_filename}"
-    return file_url
+    return object_url(key)
+
+
+def key_from_url(file_url:str)->str:
+    return file_url.split(".s3.amazonaws.com/",1)[-1]
+
+
+def delete_files_from_s3(keys:list):
+    # delete_objects accepts at most 1000 keys per call
+    for i in range(0,len(keys),1000):
+        s3.delete_objects(
+            Bucket=BUCKET_NAME,
+            Delete={"Objects":[{"Key":key} for key in keys[i:i+1000]],"Quiet":True}
+        )
+
+
+def start_multipart_upload(key:str,content_type:str)->str:
+    return s3.create_multipart_upload(Bucket=BUCKET_NAME,Key=key,ContentType=content_type)["UploadId"]
+
+
+def upload_part(key:str,upload_id:str,part_number:int,body:bytes)->str:
+    return s3.upload_part(
+        Bucket=BUCKET_NAME,
+        Key=key,
+        UploadId=upload_id,
+        PartNumber=part_number,
+        Body=body
+    )["ETag"]
+
+
+def complete_multipart_upload(key:str,upload_id:str,etags:dict):
+    # etags: part number -> ETag; S3 wants them in ascending order
+    s3.complete_multipart_upload(
+        Bucket=BUCKET_NAME,
+        Key=key,
+        UploadId=upload_id,
+        MultipartUpload={"Parts":[{"PartNumber":n,"ETag":etags[n]} for n in sorted(etags)]}
+    )
+
+
+def abort_multipart_upload(key:str,upload_id:str):
+    try:
+        s3.abort_multipart_upload(Bucket=BUCKET_NAME,Key=key,UploadId=upload_id)
+    except s3.exceptions.NoSuchUpload:
+        pass
+
+
+def object_exists(key:str)->bool:
+    try:
+        s3.head_object(Bucket=BUCKET_NAME,Key=key)
+    except ClientError as e:
+        if e.response.get("Error",{}).get("Code") in ("404","NoSuchKey"):
+            return False
+        raise
+    return True
+
+
+def iter_object(key:str,chunk_size:int=1024*1024):
+    body=s3.get_object(Bucket=BUCKET_NAME,Key=key)["Body"]
+    try:
+        yield from body.iter_chunks(chunk_size)
+    finally:
+        body.close()
@@ -1,15 +1,59 @@
-from typing import Dict, List, Tuple, Optional
+import asyncio
+import json
+import time
+from typing import Dict, List, Tuple, Optional, Set
 from collections import defaultdict
 from fastapi import WebSocket
 
+# Busy chats coalesce the events of one tick into a single array frame per socket.
+# Batching switches on above BATCH_ON_RATE events/s and off again below BATCH_OFF_RATE.
+BATCH_TICK_SECONDS = 0.025
+BATCH_ON_RATE = 50
+BATCH_OFF_RATE = 20
+RATE_WINDOW_SECONDS = 1.0
+
+
 class ConnectionManager:
     # chat_id -> list[(websocket, user_id)]
+    # user_id -> set[websocket]
     def __init__(self):
         self.active: Dict[str, List[Tuple[WebSocket, str]]] = defaultdict(list)
+        self.by_user: Dict[str, Set[WebSocket]] = defaultdict(set)
+        self.subscriptions: Dict[WebSocket, Set[str]] = defaultdict(set)
+        self.owners: Dict[WebSocket, str] = {}
+        # sockets from /ws/user carry many chats, so their frames are wrapped with the chat id
+        self.multiplexed: Set[WebSocket] = set()
+        # sockets that asked for batched (JSON array) frames
+        self.batching: Set[WebSocket] = set()
+        # chat_id -> "auto" | "on" | "off"
+        self.batch_modes: Dict[str, str] = {}
+        self._batched_chats: Set[str] = set()
+        self._pending: Dict[str, List[Tuple[str, Optional[WebSocket]]]] = {}
+        # chat_id -> [window start, events in window]
+        self._rates: Dict[str, List[float]] = {}
+        # watched user_id -> sockets that want its presence changes, and the reverse
+        self.presence_watchers: Dict[str, Set[WebSocket]] = defaultdict(set)
+        self.watching: Dict[WebSocket, Set[str]] = defaultdict(set)
 
     # NOTE: do NOT call websocket.accept() here. The route will accept first.
-    async def connect(self, chat_id: str, user_id: str, websocket: WebSocket):
-        self.active[chat_id].append((websocket, user_id))
+    async def connect(self, chat_id: str, user_id: str, websocket: WebSocket, multiplexed: bool = False, batch: bool = False):
+        if batch:
+            self.batching.add(websocket)
+        if chat_id not in self.subscriptions[websocket]:
+            self.active[chat_id].append((websocket, user_id))
+            self.subscriptions[websocket].add(chat_id)
+        self.by_user[user_id].add(websocket)
+        self.owners[websocket] = user_id
+        if multiplexed:
+            self.multiplexed.add(websocket)
+
+    def register(self, user_id: str, websocket: WebSocket, batch: bool = False):
+        """Track a multiplexed socket before it has subscribed to any chat."""
+        if batch:
+            self.batching.add(websocket)
+        self.by_user[user_id].add(websocket)
+        self.owners[websocket] = user_id
+        self.multiplexed.add(websocket)
 
     def disconnect(self, chat_id: str, websocket: WebSocket):
         conns = self.active.get(chat_id, [])
@@ -18,19 +62,146 @@ class ConnectionManager:
         if not self.active.get(chat_id):
             # optional cleanup
             self.active.pop(chat_id, None)
+            self._rates.pop(chat_id, None)
+            self._batched_chats.discard(chat_id)
+
+        chats = self.subscriptions.get(websocket)
+        if chats is not None:
+            chats.discard(chat_id)
+            if not chats:
+                self.subscriptions.pop(websocket, None)
+        if websocket not in self.multiplexed and websocket not in self.subscriptions:
+            self._forget(websocket)
+
+    def disconnect_all(self, websocket: WebSocket):
+        for chat_id in list(self.subscriptions.get(websocket, ())):
+            self.disconnect(chat_id, websocket)
+        self.subscriptions.pop(websocket, None)
+        self._forget(websocket)
+
+    def _forget(self, websocket: WebSocket):
+        self.unwatch_presence(websocket, list(self.watching.get(websocket, ())))
+        self.watching.pop(websocket, None)
+        self.multiplexed.discard(websocket)
+        self.batching.discard(websocket)
+        user_id = self.owners.pop(websocket, None)
+        sockets = self.by_user.get(user_id)
+        if sockets is not None:
+            sockets.discard(websocket)
+            if not sockets:
+                self.by_user.pop(user_id, None)
+
+    def watch_presence(self, websocket: WebSocket, user_ids: List[str]):
+        for user_id in user_ids:
+            self.presence_watchers[user_id].add(websocket)
+            self.watching[websocket].add(user_id)
+
+    def unwatch_presence(self, websocket: WebSocket, user_ids: List[str]):
+        watched = self.watching.get(websocket, set())
+        for user_id in user_ids:
+            watched.discard(user_id)
+            watchers = self.presence_watchers.get(user_id)
+            if watchers is not None:
+                watchers.discard(websocket)
+                if not watchers:
+                    self.presence_watchers.pop(user_id, None)
+
+    async def notify_presence(self, user_id: str, message: str):
+        for ws in list(self.presence_watchers.get(user_id, ())):
+            try:
+                await ws.send_text(message)
+            except Exception:
+                self.unwatch_presence(ws, [user_id])
+
+    def user_sockets(self, user_id: str) -> Set[WebSocket]:
+        return set(self.by_user.get(user_id, ()))
+
+    def is_subscribed(self, chat_id: str, websocket: WebSocket) -> bool:
+        return chat_id in self.subscriptions.get(websocket, ())
+
+    @staticmethod
+    def envelope(chat_id: str, message: str) -> str:
+        return '{"chat_id": %s, "event": %s}' % (json.dumps(chat_id), message)
+
+    async def send(self, chat_id: str, websocket: WebSocket, message: str):
+        if websocket in self.multiplexed:
+            message = self.envelope(chat_id, message)
+        await websocket.send_text(message)
+
+    def set_batch_mode(self, chat_id: str, mode: str):
+        if mode not in ("auto", "on", "off"):
+            raise ValueError(f"Unknown batch mode: {mode}")
+        self.batch_modes[chat_id] = mode
+
+    def _should_batch(self, chat_id: str) -> bool:
+        mode = self.batch_modes.get(chat_id, "auto")
+        if mode != "auto":
+            return mode == "on"
+
+        now = time.monotonic()
+        window = self._rates.setdefault(chat_id, [now, 0])
+        window[1] += 1
+        elapsed = now - window[0]
+        if elapsed >= RATE_WINDOW_SECONDS:
+            rate = window[1] / elapsed
+            if rate >= BATCH_ON_RATE:
+                self._batched_chats.add(chat_id)
+            elif rate <= BATCH_OFF_RATE:
+                self._batched_chats.discard(chat_id)
+            self._rates[chat_id] = [now, 0]
+        return chat_id in self._batched_chats
+
+    def _wrap(self, chat_id: str, websocket: WebSocket, message: str, cache: Dict[str, str]) -> str:
+        if websocket not in self.multiplexed:
+            return message
+        if message not in cache:
+            cache[message] = self.envelope(chat_id, message)
+        return cache[message]
 
     async def broadcast(self, chat_id: str, message: str, exclude: Optional[WebSocket] = None):
         conns = list(self.active.get(chat_id, []))  # copy to avoid mutation during loop
+        # once events are queued for a tick, later ones must queue behind them
+        batched = self._should_batch(chat_id) or chat_id in self._pending
         dead: List[WebSocket] = []
+        wrapped: Dict[str, str] = {}
         for ws, _uid in conns:
             if exclude is not None and ws is exclude:
                 continue
+            if batched and ws in self.batching:
+                continue  # delivered by the next tick's flush
             try:
-                await ws.send_text(message)
+                await ws.send_text(self._wrap(chat_id, ws, message, wrapped))
             except Exception:
                 dead.append(ws)
         # cleanup dead sockets
         for ws in dead:
             self.disconnect(chat_id, ws)
 
+        if batched:
+            pending = self._pending.setdefault(chat_id, [])
+            pending.append((message, exclude))
+            if len(pending) == 1:
+                asyncio.get_running_loop().call_later(
+                    BATCH_TICK_SECONDS, lambda: asyncio.ensure_future(self._flush(chat_id))
+                )
+
+    async def _flush(self, chat_id: str):
+        pending = self._pending.pop(chat_id, [])
+        if not pending:
+            return
+        dead: List[WebSocket] = []
+        wrapped: Dict[str, str] = {}
+        for ws, _uid in list(self.active.get(chat_id, [])):
+            if ws not in self.batching:
+                continue
+            frames = [message for (message, exclude) in pending if exclude is not ws]
+            if not frames:
+                continue
+            try:
+                await ws.send_text(self._wrap(chat_id, ws, "[" + ",".join(frames) + "]", wrapped))
+            except Exception:
+                dead.append(ws)
+        for ws in dead:
+            self.disconnect(chat_id, ws)
+
 manager = ConnectionManager()
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import random
+import signal
+import threading
+from typing import Optional
+
+from fastapi import WebSocket
+
+from app.websockets.connection_manager import manager
+
+# On shutdown the worker's sockets are closed one by one over this window
+DRAIN_SECONDS = 10.0
+# Each client is told to wait a random time in this range before reconnecting
+RECONNECT_MIN_MS = 500
+RECONNECT_MAX_MS = 15_000
+# A client that is gone longer than this is reported offline; quick reconnects
+# (including the ones a drain asks for) never show up as offline/online churn
+PRESENCE_GRACE_SECONDS = RECONNECT_MAX_MS / 1000 + 15
+# A client that does not take its reconnect frame in time is closed anyway
+SEND_TIMEOUT_SECONDS = 2.0
+
+
+def reconnect_frame(reason: str = "server_restart") -> dict:
+    return {
+        "type": "reconnect",
+        "reason": reason,
+        "retry_after_ms": random.randint(RECONNECT_MIN_MS, RECONNECT_MAX_MS),
+    }
+
+
+class WebSocketDrainer:
+    """
+    Drain mode for deploys: new sockets are turned away, and every open socket gets a
+    reconnect frame with a jittered backoff hint and is then closed, spread over
+    ``drain_seconds`` so clients neither reconnect nor go offline all at once.
+    """
+
+    def __init__(self, drain_seconds: float = DRAIN_SECONDS):
+        self.drain_seconds = drain_seconds
+        self.draining = False
+        self.drained = 0
+        self.rejected = 0
+
+    async def _close(self, websocket: WebSocket, reason: str):
+        try:
+            await asyncio.wait_for(websocket.send_text(json.dumps(reconnect_frame(reason))), SEND_TIMEOUT_SECONDS)
+        except Exception:
+            pass
+        try:
+            await asyncio.wait_for(websocket.close(code=1012), SEND_TIMEOUT_SECONDS)  # service restart
+        except Exception:
+            pass
+
+    async def refuse(self, websocket: WebSocket) -> bool:
+        """Call right after accept(); True (and the socket closed) when this worker is draining."""
+        if not self.draining:
+            return False
+        self.rejected += 1
+        await self._close(websocket, "server_draining")
+        return True
+
+    async def drain(self, drain_seconds: Optional[float] = None) -> int:
+        self.draining = True
+        sockets = list(manager.owners)
+        random.shuffle(sockets)
+        interval = (self.drain_seconds if drain_seconds is None else drain_seconds) / max(1, len(sockets))
+        for websocket in sockets:
+            await self._close(websocket, "server_restart")
+            self.drained += 1
+            await asyncio.sleep(interval)
+        return len(sockets)
+
+    def install_signal_handlers(self):
+        """
+        Run the drain before the server's own SIGTERM/SIGINT handling, which would drop
+        every socket at once. A second signal skips the drain.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            previous = signal.getsignal(sig)
+            if not callable(previous):
+                continue
+
+            def handler(signum, frame, previous=previous):
+                if self.draining or not manager.owners:
+                    previous(signum, frame)
+                    return
+                loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self._drain_then(previous, signum, frame)))
+
+            signal.signal(sig, handler)
+
+    async def _drain_then(self, previous, signum, frame):
+        try:
+            await self.drain()
+        finally:
+            previous(signum, frame)
+
+    def stats(self) -> dict:
+        return {"draining": self.draining, "drained": self.drained, "rejected": self.rejected}
+
+
+drainer = WebSocketDrainer()
@@ -0,0 +1,179 @@
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session, joinedload
+
+from app.core.config import settings
+from app.db.sessions import is_replica
+from app.models.chat import Message
+
+# Recent events kept per chat, and how many chats are kept before the least recently used is dropped
+RING_SIZE = 200
+MAX_CHATS = 1000
+
+
+def message_event(message: Message, sender=None) -> dict:
+    return {
+        "message_id": str(message.id),
+        "chat_id": str(message.chat_id),
+        "sender_id": str(message.sender_id) if message.sender_id else None,
+        "sender_name": (sender.full_name or sender.username) if sender else None,
+        "sender_image": sender.profile_image if sender else None,
+        "content": message.content,
+        "media_url": message.media_url,
+        "media_type": message.media_type,
+        "is_edited": bool(message.is_edited),
+        "created_at": message.created_at.isoformat(),
+    }
+
+
+class _Ring:
+    def __init__(self, size: int, complete: bool):
+        self.events: Deque[Tuple[str, datetime, dict]] = deque(maxlen=size)
+        # True while the ring holds every message the chat has ever had
+        self.complete = complete
+
+
+class ChatEventBuffer:
+    def __init__(self, size: int = RING_SIZE, max_chats: int = MAX_CHATS, enabled: bool = True):
+        self.size = size
+        self.max_chats = max_chats
+        # Disabled, it keeps nothing and every read falls through to the database
+        self.enabled = enabled
+        self._chats: "OrderedDict[str, _Ring]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _ring(self, chat_id: str, create: bool = False) -> Optional[_Ring]:
+        ring = self._chats.get(chat_id)
+        if ring is None and create:
+            ring = self._chats[chat_id] = _Ring(self.size, complete=False)
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        if ring is not None:
+            self._chats.move_to_end(chat_id)
+        return ring
+
+    def append(self, chat_id: str, event: dict):
+        if not self.enabled:
+            return
+        with self._lock:
+            ring = self._ring(chat_id, create=True)
+            if len(ring.events) == ring.events.maxlen:
+                ring.complete = False
+            created_at = datetime.fromisoformat(event["created_at"])
+            ring.events.append((event["message_id"], created_at, event))
+
+    def seed(self, chat_id: str, events: List[dict], complete: bool):
+        if not self.enabled:
+            return
+        with self._lock:
+            ring = self._ring(chat_id, create=True)
+            entries = [(e["message_id"], datetime.fromisoformat(e["created_at"]), e) for e in events]
+            # Keep anything appended while the seed query was running
+            newest = entries[-1][1] if entries else datetime.min
+            seeded = {entry[0] for entry in entries}
+            entries.extend(entry for entry in ring.events if entry[1] > newest and entry[0] not in seeded)
+            ring.events.clear()
+            ring.complete = complete and len(entries) <= self.size
+            ring.events.extend(entries[-self.size:])
+
+    def replace(self, chat_id: str, event: dict):
+        with self._lock:
+            ring = self._ring(chat_id)
+            if ring is None:
+                return
+            for i, (message_id, created_at, _old) in enumerate(ring.events):
+                if message_id == event["message_id"]:
+                    ring.events[i] = (message_id, created_at, event)
+                    return
+
+    def discard(self, chat_id: str, message_id: str):
+        with self._lock:
+            ring = self._ring(chat_id)
+            if ring is None:
+                return
+            kept = [entry for entry in ring.events if entry[0] != message_id]
+            ring.events.clear()
+            ring.events.extend(kept)
+
+    def invalidate(self, chat_id: str):
+        with self._lock:
+            self._chats.pop(chat_id, None)
+
+    def since(self, chat_id: str, message_id: str, after: Optional[datetime] = None) -> Optional[List[dict]]:
+        """Events newer than ``message_id``, or None when that message is no longer buffered."""
+        with self._lock:
+            ring = self._ring(chat_id)
+            if ring is None:
+                return None
+            entries = list(ring.events)
+        for i, entry in enumerate(entries):
+            if entry[0] == message_id:
+                return [event for (_id, created_at, event) in entries[i + 1:] if after is None or created_at > after]
+        return None
+
+    def latest(self, chat_id: str, limit: int, after: Optional[datetime] = None) -> Optional[List[dict]]:
+        """The newest ``limit`` events (oldest first), or None when the buffer cannot vouch for the page."""
+        with self._lock:
+            ring = self._ring(chat_id)
+            if ring is None:
+                return None
+            entries = list(ring.events)
+            complete = ring.complete
+        visible = [event for (_id, created_at, event) in entries if after is None or created_at > after]
+        # Anything hidden by ``after`` means every older message is hidden too
+        if len(visible) >= limit or complete or len(visible) < len(entries):
+            return visible[-limit:]
+        return None
+
+
+# Each worker only buffers the messages it handled itself, so with several workers a
+# page served from the buffer would leave out the others' messages
+event_buffer = ChatEventBuffer(enabled=settings.SINGLE_WORKER)
+
+
+def _load_events(query) -> List[dict]:
+    return [message_event(m, m.sender) for m in query.options(joinedload(Message.sender))]
+
+
+def recent_events(db: Session, chat_id: str, limit: int, after: Optional[datetime] = None) -> List[dict]:
+    events = event_buffer.latest(chat_id, limit, after)
+    if events is not None:
+        return events
+
+    # Only seeded from the primary: a lagging replica could leave a gap before new events
+    if event_buffer.enabled and limit <= event_buffer.size and not is_replica(db):
+        rows = _load_events(
+            db.query(Message)
+            .filter(Message.chat_id == chat_id)
+            .order_by(Message.created_at.desc())
+            .limit(event_buffer.size)
+        )
+        rows.reverse()
+        event_buffer.seed(chat_id, rows, complete=len(rows) < event_buffer.size)
+        events = event_buffer.latest(chat_id, limit, after)
+        if events is not None:
+            return events
+
+    query = db.query(Message).filter(Message.chat_id == chat_id)
+    if after:
+        query = query.filter(Message.created_at > after)
+    rows = _load_events(query.order_by(Message.created_at.desc()).limit(limit))
+    rows.reverse()
+    return rows
+
+
+def events_since(db: Session, chat_id: str, message_id: str, after: Optional[datetime] = None) -> Optional[List[dict]]:
+    events = event_buffer.since(chat_id, message_id, after)
+    if events is not None:
+        return events
+
+    anchor = db.query(Message).filter(Message.chat_id == chat_id, Message.id == message_id).first()
+    if not anchor:
+        return None
+    query = db.query(Message).filter(Message.chat_id == chat_id, Message.created_at > anchor.created_at)
+    if after:
+        query = query.filter(Message.created_at > after)
+    return _load_events(query.order_by(Message.created_at.asc()))
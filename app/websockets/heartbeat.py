@@ -0,0 +1,164 @@
+import asyncio
+import json
+import math
+import time
+from typing import Dict, List, Optional, Set
+
+from fastapi import WebSocket
+
+from app.core.config import settings
+from app.websockets.connection_manager import manager
+
+# Resolution of the wheel; deadlines fire up to one tick late
+TICK_SECONDS = 1.0
+# A reaped socket whose handler is still stuck in receive (half-open TCP) is cancelled after this
+CLOSE_GRACE_SECONDS = 5.0
+SEND_TIMEOUT_SECONDS = 2.0
+
+
+class _Entry:
+    __slots__ = ("task", "last_seen", "pinged", "reaped_at")
+
+    def __init__(self, task: Optional[asyncio.Task], now: float):
+        self.task = task
+        self.last_seen = now
+        self.pinged = False
+        self.reaped_at: Optional[float] = None
+
+
+class HeartbeatSweeper:
+    """
+    Server-side liveness for every socket of this worker, checked by one task.
+
+    Sockets sit in a hashed timer wheel at their next deadline. Inbound frames only
+    stamp last_seen; when a slot comes up, a socket that was heard from since is simply
+    moved to its new deadline. Silent for ``interval`` seconds, it gets a ping frame;
+    silent for ``timeout``, it is dropped from every chat and closed with 4408.
+    """
+
+    def __init__(self, interval: float, timeout: float, tick: float = TICK_SECONDS):
+        self.interval = interval
+        self.timeout = max(timeout, interval + tick)
+        self.tick = tick
+        self._slots: List[Set[WebSocket]] = [set() for _ in range(math.ceil(self.timeout / tick) + 2)]
+        self._entries: Dict[WebSocket, _Entry] = {}
+        self._tick = self._tick_of(time.monotonic())
+        self._task: Optional[asyncio.Task] = None
+        self.counts = {"pings": 0, "reaped": 0, "cancelled": 0}
+
+    def _tick_of(self, at: float) -> int:
+        return math.ceil(at / self.tick)
+
+    def _schedule(self, websocket: WebSocket, at: float):
+        # Never in the slot being processed, never past the wheel's horizon
+        tick = min(max(self._tick_of(at), self._tick + 1), self._tick + len(self._slots) - 1)
+        self._slots[tick % len(self._slots)].add(websocket)
+
+    def track(self, websocket: WebSocket):
+        """Call once the socket is registered; the current task is cancelled if the socket goes half-open."""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        now = time.monotonic()
+        self._entries[websocket] = _Entry(task, now)
+        self._schedule(websocket, now + self.interval)
+
+    def touch(self, websocket: WebSocket):
+        entry = self._entries.get(websocket)
+        if entry is not None:
+            entry.last_seen = time.monotonic()
+            entry.pinged = False
+
+    def untrack(self, websocket: WebSocket):
+        # The wheel slot is cleaned up lazily when it comes around
+        self._entries.pop(websocket, None)
+
+    async def _ping(self, websocket: WebSocket):
+        try:
+            await asyncio.wait_for(
+                websocket.send_text(json.dumps({"type": "ping", "ts": time.time()})), SEND_TIMEOUT_SECONDS
+            )
+            self.counts["pings"] += 1
+        except Exception:
+            pass
+
+    async def _reap(self, websocket: WebSocket):
+        # Out of every chat first, so broadcasts stop reaching it even if the close hangs
+        manager.disconnect_all(websocket)
+        self.counts["reaped"] += 1
+        try:
+            await asyncio.wait_for(websocket.close(code=4408), SEND_TIMEOUT_SECONDS)  # heartbeat timeout
+        except Exception:
+            pass
+
+    async def _check(self, websocket: WebSocket, now: float):
+        entry = self._entries.get(websocket)
+        if entry is None:
+            return
+        if entry.reaped_at is not None:
+            # Closed but its handler never noticed: cancel it so its cleanup runs
+            if entry.task is not None and not entry.task.done():
+                entry.task.cancel()
+                self.counts["cancelled"] += 1
+            self._entries.pop(websocket, None)
+            return
+        idle = now - entry.last_seen
+        if idle >= self.timeout:
+            entry.reaped_at = now
+            self._schedule(websocket, now + CLOSE_GRACE_SECONDS)
+            await self._reap(websocket)
+        elif idle >= self.interval:
+            if not entry.pinged:
+                entry.pinged = True
+                await self._ping(websocket)
+            self._schedule(websocket, entry.last_seen + self.timeout)
+        else:
+            self._schedule(websocket, entry.last_seen + self.interval)
+
+    async def sweep(self, now: Optional[float] = None) -> int:
+        """Process every slot up to ``now``; returns how many sockets were looked at."""
+        now = time.monotonic() if now is None else now
+        checked = 0
+        while self._tick < self._tick_of(now):
+            self._tick += 1
+            slot = self._slots[self._tick % len(self._slots)]
+            due = list(slot)
+            slot.clear()
+            # Concurrently, so sockets stuck on a send timeout do not hold up the rest
+            await asyncio.gather(*(self._check(websocket, now) for websocket in due))
+            checked += len(due)
+        return checked
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.sweep()
+            except Exception:
+                pass
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._tick = self._tick_of(time.monotonic())
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            **self.counts,
+            "tracked": len(self._entries),
+            "interval_s": self.interval,
+            "timeout_s": self.timeout,
+        }
+
+
+heartbeats = HeartbeatSweeper(settings.WS_HEARTBEAT_INTERVAL_SECONDS, settings.WS_IDLE_TIMEOUT_SECONDS)
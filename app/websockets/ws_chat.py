@@ -1,3 +1,4 @@
+import asyncio
 import json
 from datetime import datetime
 from uuid import uuid4
@@ -6,17 +7,31 @@ from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
 from sqlalchemy.orm import Session
 import uuid
 
-from app.db.sessions import get_db
+from app.db.sessions import SessionLocal, get_db
 from app.core.security import decode_access_token
 from app.models.user import User
-from app.models.chat import ChatParticipant, Message, Chat, ChatType
+from app.models.chat import Message, Chat, ChatType
 from app.websockets.connection_manager import manager
-from app.services.ai_service import get_ai_reply
+from app.websockets.event_buffer import event_buffer, message_event, events_since
+from app.services.ai_service import AI_USER_ID, get_ai_reply, reply_key
+from app.services.ai_reply_cache import reply_cache
+from app.services.conversation_summary import build_context, request_fold
+from app.services.ai_usage import ai_usage
+from app.services.ai_scheduler import ai_scheduler, AIReplySuperseded
+from app.core.rate_limit import rate_limiter, throttled_frame
+from app.core.versioning import bump_chat, bump_directory
+from app.services.membership_cache import Membership, get_membership
+from app.services.outbox import WORKER_ID, outbox_handler, record, record_broadcast
+from app.websockets.drain import drainer, PRESENCE_GRACE_SECONDS
+from app.websockets.heartbeat import heartbeats
 
 router = APIRouter()
 
-# Fixed AI user UUID (make sure you handle this in history responses)
-AI_USER_ID = uuid.UUID("00000000-0000-0000-0000-000000000001")
+# Presence subscriptions per socket
+MAX_WATCHED_USERS = 500
+
+# A stale answer is worse than none, so AI replies give up sooner than other outbox events
+AI_REPLY_ATTEMPTS = 3
 
 
 def get_user_from_token(token: str, db: Session) -> Optional[User]:
@@ -25,14 +40,309 @@ def get_user_from_token(token: str, db: Session) -> Optional[User]:
         user_id = payload.get("sub")
         if not user_id:
             return None
-        return db.query(User).filter(User.id == user_id).first()
+        user = db.query(User).filter(User.id == user_id).first()
+        if user:
+            # Writes through this socket keep the user's REST reads on the primary for a while
+            db.info["user_id"] = str(user.id)
+        return user
     except Exception:
         return None
 
 
+class ChatSession:
+    """What a socket needs to know about one chat it is attached to."""
+
+    def __init__(self, chat: Chat, participant: Membership, ai_user: Optional[User]):
+        self.chat = chat
+        self.participant = participant
+        self.ai_user = ai_user
+
+
+def open_chat(db: Session, chat_id: str, current_user: User):
+    """Authorize ``current_user`` for ``chat_id``; returns (session, None) or (None, (code, detail))."""
+    try:
+        is_participant = get_membership(db, str(uuid.UUID(chat_id)), current_user.id)
+    except ValueError:
+        is_participant = None
+    if not is_participant:
+        return None, (4403, "Not a participant")  # forbidden
+
+    chat = db.query(Chat).filter_by(id=chat_id).first()
+    if not chat:
+        return None, (4404, "Chat not found")  # not found
+
+    ai_user = db.query(User).filter(User.id == AI_USER_ID).first() if chat.type == ChatType.ai else None
+    return ChatSession(chat, is_participant, ai_user), None
+
+
+async def replay_missed(db: Session, websocket: WebSocket, chat_id: str, session: ChatSession, resume_from: str):
+    # Replay whatever the client missed while it was disconnected
+    try:
+        missed = events_since(db, chat_id, str(uuid.UUID(resume_from)), session.participant.last_deleted_at)
+    except ValueError:
+        missed = None
+    if missed is None:
+        await manager.send(chat_id, websocket, json.dumps({"type": "resync_required"}))
+    else:
+        for event in missed:
+            await manager.send(chat_id, websocket, json.dumps({"type": "new_message", "data": event}))
+
+
+async def watch_presence(db: Session, websocket: WebSocket, user_ids: list):
+    try:
+        ids = list(dict.fromkeys(str(uuid.UUID(str(u))) for u in user_ids))
+    except ValueError:
+        ids = None
+    if ids is None or len(manager.watching.get(websocket, set()) | set(ids)) > MAX_WATCHED_USERS:
+        await websocket.send_text(json.dumps({
+            "type": "error",
+            "detail": f"watch_presence takes at most {MAX_WATCHED_USERS} valid user ids"
+        }))
+        return
+
+    manager.watch_presence(websocket, ids)
+    # Current state in one query; only changes are pushed after this
+    rows = db.query(User.id, User.is_online, User.last_seen).filter(User.id.in_(ids)).all() if ids else []
+    await websocket.send_text(json.dumps({
+        "type": "presence_snapshot",
+        "data": {
+            str(user_id): {
+                "is_online": bool(is_online),
+                "last_seen": last_seen.isoformat() if last_seen else None
+            }
+            for (user_id, is_online, last_seen) in rows
+        }
+    }))
+
+
+def presence_event(user: User, is_online: bool) -> str:
+    return json.dumps({
+        "type": "presence_update",
+        "data": {
+            "user_id": str(user.id),
+            "is_online": is_online,
+            "username": user.username,
+            "last_seen": user.last_seen.isoformat() if not is_online and user.last_seen else None
+        }
+    })
+
+
+async def handle_chat_event(
+    db: Session,
+    websocket: WebSocket,
+    chat_id: str,
+    session: ChatSession,
+    current_user: User,
+    data: dict,
+):
+    chat = session.chat
+
+    # Handle typing indicator
+    if "is_typing" in data:
+        allowed, _retry_after = rate_limiter.hit("typing", current_user.id, chat_id)
+        if not allowed:
+            # Typing indicators are cheap to lose, drop them silently
+            return
+        await manager.broadcast(chat_id, json.dumps({
+            "type": "typing_status",
+            "data": {
+                "user_id": str(current_user.id),
+                "username": current_user.username,
+                "is_typing": bool(data["is_typing"])
+            }
+        }), exclude=websocket)
+        return
+
+    # Handle regular messages
+    content = (data.get("content") or "").strip()
+    if not content:
+        return
+
+    allowed, retry_after = rate_limiter.hit("message", current_user.id, chat_id)
+    if not allowed:
+        await manager.send(chat_id, websocket, json.dumps(throttled_frame("message", retry_after)))
+        return
+
+    # Save user message; its broadcast (and the AI reply) commit with it
+    user_msg = Message(
+        id=uuid4(),
+        chat_id=chat_id,
+        sender_id=current_user.id,
+        content=content
+    )
+    db.add(user_msg)
+    db.flush()
+    event = message_event(user_msg, current_user)
+    record_broadcast(db, chat_id, {"type": "new_message", "data": event})
+    budget_frame = None
+    if chat.type == ChatType.ai:
+        allowed, retry_after = ai_usage.check_budget(current_user.id)
+        if allowed:
+            # Any worker may compute the reply; its frames go back to this one's sockets
+            record(db, "ai_reply", {
+                "chat_id": chat_id,
+                "message_id": str(user_msg.id),
+                "content": content,
+                "user_id": str(current_user.id),
+                "origin": WORKER_ID
+            })
+        else:
+            # The message is kept; only the AI answer is held back
+            budget_frame = throttled_frame("ai_budget", retry_after)
+    db.commit()
+    if budget_frame:
+        await manager.send(chat_id, websocket, json.dumps(budget_frame))
+
+    event_buffer.append(chat_id, event)
+    bump_chat(chat_id)
+
+
+def ai_typing_frame(is_typing: bool) -> dict:
+    return {
+        "type": "typing_status",
+        "data": {
+            "user_id": str(AI_USER_ID),
+            "username": "AI Assistant",
+            "is_typing": is_typing
+        }
+    }
+
+
+def _send_to_origin(payload: dict, *frames: dict):
+    """Broadcast ``frames`` from the worker the chat message was sent to."""
+    db = SessionLocal()
+    try:
+        for frame in frames:
+            record_broadcast(db, payload["chat_id"], frame, owner=payload.get("origin"))
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _ai_reply_failed(payload: dict):
+    await asyncio.to_thread(_send_to_origin, payload, {
+        "type": "error",
+        "detail": "AI reply failed"
+    })
+
+
+@outbox_handler("ai_reply", on_give_up=_ai_reply_failed, background=True, max_attempts=AI_REPLY_ATTEMPTS)
+async def deliver_ai_reply(payload: dict):
+    chat_id = payload["chat_id"]
+    # Derived from the user message, so a redelivered event cannot answer twice
+    reply_id = uuid.uuid5(AI_USER_ID, payload["message_id"])
+
+    db = SessionLocal()
+    try:
+        if db.query(Message.id).filter(Message.id == reply_id).first():
+            return
+
+        # Broadcast typing start
+        await asyncio.to_thread(_send_to_origin, payload, ai_typing_frame(True))
+        try:
+            # Rolling summary plus the recent turns that fit the token budget
+            history, needs_fold = build_context(db, chat_id, payload["content"], exclude_id=payload["message_id"])
+
+            # Get AI reply; a newer message in this chat takes over and answers both
+            cache_enabled = db.query(Chat.ai_cache_enabled).filter(Chat.id == chat_id).scalar()
+            with ai_usage.track(payload.get("user_id"), chat_id):
+                reply = await reply_cache.get_or_create(
+                    reply_key(payload["content"], history) if cache_enabled else None,
+                    lambda: ai_scheduler.run(chat_id, lambda: get_ai_reply(payload["content"], history=history))
+                )
+        except AIReplySuperseded:
+            return
+        except Exception:
+            await asyncio.to_thread(_send_to_origin, payload, ai_typing_frame(False))
+            raise
+
+        # Save AI message with its broadcast and the typing end, in that order
+        ai_msg = Message(
+            id=reply_id,
+            chat_id=chat_id,
+            sender_id=AI_USER_ID,
+            content=reply
+        )
+        db.add(ai_msg)
+        db.flush()
+        ai_user = db.query(User).filter(User.id == AI_USER_ID).first()
+        event = message_event(ai_msg, ai_user)
+        record_broadcast(db, chat_id, {"type": "new_message", "data": event}, owner=payload.get("origin"))
+        record_broadcast(db, chat_id, ai_typing_frame(False), owner=payload.get("origin"))
+        if needs_fold:
+            request_fold(db, chat_id)
+        db.commit()
+
+        event_buffer.append(chat_id, event)
+        bump_chat(chat_id)
+    finally:
+        db.close()
+
+
+def mark_online(db: Session, user: User) -> bool:
+    """Call before registering the socket; True when the user was offline, not just reconnecting."""
+    came_online = not user.is_online
+    if came_online or not manager.user_sockets(str(user.id)):
+        user.is_online = True
+        # Newer than the "since" of any pending offline event, which turns that event into a no-op
+        user.last_seen = datetime.utcnow()
+        db.commit()
+        bump_directory()
+    return came_online
+
+
+def mark_offline(db: Session, user: User, chat_ids):
+    """
+    Report ``user`` offline once their last socket has been gone PRESENCE_GRACE_SECONDS,
+    unless they reconnect (to any worker) first.
+    """
+    # Another socket (per-chat or multiplexed) may still be holding the user online
+    if manager.user_sockets(str(user.id)):
+        return
+    # Checked against, and broadcast to, this worker's sockets
+    record(db, "presence_offline", {
+        "user_id": str(user.id),
+        "since": datetime.utcnow().isoformat(),
+        "chat_ids": [str(chat_id) for chat_id in chat_ids]
+    }, delay=PRESENCE_GRACE_SECONDS, local=True)
+    db.commit()
+
+
+@outbox_handler("presence_offline")
+async def deliver_presence_offline(payload: dict):
+    if manager.user_sockets(payload["user_id"]):
+        return
+    since = datetime.fromisoformat(payload["since"])
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.id == payload["user_id"]).first()
+        # Reconnected during the grace period (mark_online moved last_seen past since)
+        if not user or not user.is_online or (user.last_seen and user.last_seen > since):
+            return
+        user.is_online = False
+        user.last_seen = since
+        db.commit()
+        bump_directory()
+        offline = presence_event(user, False)
+    finally:
+        db.close()
+    await manager.notify_presence(payload["user_id"], offline)
+    for chat_id in payload["chat_ids"]:
+        await manager.broadcast(chat_id, offline)
+
+
 @router.websocket("/ws/chat/{chat_id}")
-async def websocket_endpoint(websocket: WebSocket, chat_id: str, token: str = Query(...)):
+async def websocket_endpoint(
+    websocket: WebSocket,
+    chat_id: str,
+    token: str = Query(...),
+    resume_from: Optional[str] = Query(None),
+    batch: bool = Query(False),
+):
+    # With batch=true a busy chat may deliver a JSON array of events in one frame
     await websocket.accept()
+    if await drainer.refuse(websocket):
+        return
 
     db = next(get_db())
     current_user = get_user_from_token(token, db)
@@ -44,166 +354,166 @@ async def websocket_endpoint(websocket: WebSocket, chat_id: str, token: str = Qu
         await websocket.close(code=4401)  # unauthorized
         return
 
-    is_participant = db.query(ChatParticipant).filter_by(
-        chat_id=chat_id, user_id=current_user.id
-    ).first()
-    if not is_participant:
+    session, error = open_chat(db, chat_id, current_user)
+    if error:
+        code, detail = error
         await websocket.send_text(json.dumps({
             "type": "error",
-            "detail": "Not a participant"
+            "detail": detail
         }))
-        await websocket.close(code=4403)  # forbidden
+        await websocket.close(code=code)
         return
 
-    chat = db.query(Chat).filter_by(id=chat_id).first()
-    if not chat:
+    # Mark user online
+    came_online = mark_online(db, current_user)
+
+    await manager.connect(chat_id, str(current_user.id), websocket, batch=batch)
+    heartbeats.track(websocket)
+    if came_online:
+        await manager.notify_presence(str(current_user.id), presence_event(current_user, True))
+
+    if resume_from:
+        await replay_missed(db, websocket, chat_id, session, resume_from)
+
+    await manager.broadcast(chat_id, presence_event(current_user, True), exclude=websocket)
+
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            heartbeats.touch(websocket)
+            data = json.loads(raw)
+
+            # Handle ping/pong; a pong answers the server's heartbeat ping
+            if "ping" in data:
+                await websocket.send_text(json.dumps({
+                    "type": "pong",
+                    "ts": data["ping"]
+                }))
+                continue
+            if "pong" in data:
+                continue
+
+            await handle_chat_event(db, websocket, chat_id, session, current_user, data)
+
+    except WebSocketDisconnect:
+        pass
+    except Exception:
+        pass
+    finally:
+        try:
+            heartbeats.untrack(websocket)
+            manager.disconnect(chat_id, websocket)
+            mark_offline(db, current_user, [chat_id])
+        except Exception:
+            pass
+
+
+@router.websocket("/ws/user")
+async def user_websocket_endpoint(websocket: WebSocket, token: str = Query(...), batch: bool = Query(False)):
+    """
+    One socket per user for any number of chats.
+
+    Control frames: {"action": "subscribe", "chat_id": ..., "resume_from": ...},
+    {"action": "unsubscribe", "chat_id": ...} and {"action": "watch_presence" | "unwatch_presence",
+    "user_ids": [...]}; watching answers with a presence_snapshot and then pushes a
+    presence_update whenever one of those users comes online or goes offline. Chat frames ({"chat_id": ..., "content": ...}
+    or {"chat_id": ..., "is_typing": ...}) go to a subscribed chat, and every server event
+    arrives wrapped as {"chat_id": ..., "event": {...}}. With batch=true the "event" of a
+    busy chat may be an array of events.
+
+    A socket that sends nothing for a while gets {"type": "ping", "ts": ...}; any frame
+    (e.g. {"pong": ts}) keeps it alive, silence past the idle timeout closes it with 4408.
+    """
+    await websocket.accept()
+    if await drainer.refuse(websocket):
+        return
+
+    db = next(get_db())
+    current_user = get_user_from_token(token, db)
+    if not current_user:
         await websocket.send_text(json.dumps({
             "type": "error",
-            "detail": "Chat not found"
+            "detail": "Invalid or expired token"
         }))
-        await websocket.close(code=4404)  # not found
+        await websocket.close(code=4401)  # unauthorized
         return
 
-    # Mark user online
-    current_user.is_online = True
-    db.commit()
+    came_online = mark_online(db, current_user)
+    manager.register(str(current_user.id), websocket, batch=batch)
+    heartbeats.track(websocket)
+    if came_online:
+        await manager.notify_presence(str(current_user.id), presence_event(current_user, True))
 
-    await manager.connect(chat_id, str(current_user.id), websocket)
-
-    await manager.broadcast(chat_id, json.dumps({
-        "type": "presence_update",
-        "data": {
-            "user_id": str(current_user.id),
-            "is_online": True,
-            "username": current_user.username,
-            "last_seen": None
-        }
-    }), exclude=websocket)
+    sessions: dict = {}
 
     try:
         while True:
             raw = await websocket.receive_text()
+            heartbeats.touch(websocket)
             data = json.loads(raw)
 
-            # Handle ping/pong
             if "ping" in data:
                 await websocket.send_text(json.dumps({
                     "type": "pong",
                     "ts": data["ping"]
                 }))
                 continue
-
-            # Handle typing indicator
-            if "is_typing" in data:
-                await manager.broadcast(chat_id, json.dumps({
-                    "type": "typing_status",
-                    "data": {
-                        "user_id": str(current_user.id),
-                        "username": current_user.username,
-                        "is_typing": bool(data["is_typing"])
-                    }
-                }), exclude=websocket)
+            if "pong" in data:
                 continue
 
-            # Handle regular messages
-            content = (data.get("content") or "").strip()
-            if not content:
-                continue
+            action = data.get("action")
 
-            # Save user message
-            user_msg = Message(
-                id=uuid4(),
-                chat_id=chat_id,
-                sender_id=current_user.id,
-                content=content
-            )
-            db.add(user_msg)
-            db.commit()
-            db.refresh(user_msg)
-
-            # Broadcast user message
-            await manager.broadcast(chat_id, json.dumps({
-                "type": "new_message",
-                "data": {
-                    "message_id": str(user_msg.id),
-                    "chat_id": str(user_msg.chat_id),
-                    "sender_id": str(user_msg.sender_id),
-                    "content": user_msg.content,
-                    "created_at": user_msg.created_at.isoformat()
-                }
-            }))
-
-            # Handle AI chat
-            if chat.type == ChatType.ai:
-                try:
-                    # Broadcast typing start
-                    await manager.broadcast(chat_id, json.dumps({
-                        "type": "typing_status",
-                        "data": {
-                            "user_id": str(AI_USER_ID),
-                            "username": "AI Assistant",
-                            "is_typing": True
-                        }
-                    }))
+            if action in ("subscribe", "watch_presence"):
+                allowed, retry_after = rate_limiter.hit(action, current_user.id)
+                if not allowed:
+                    await websocket.send_text(json.dumps(throttled_frame(action, retry_after)))
+                    continue
 
-                    # Fetch recent history for context
-                    history_messages = (
-                        db.query(Message)
-                        .filter(Message.chat_id == chat_id)
-                        .order_by(Message.created_at.desc())
-                        .limit(10)
-                        .all()
-                    )
-
-                    history = []
-                    for m in reversed(history_messages): 
-                        if m.sender_id == AI_USER_ID:
-                            role = "assistant"
-                        else:
-                            role = "user"
-                        history.append({"role": role, "content": m.content})
-
-                    # Get AI reply
-                    reply = await get_ai_reply(content, history=history)
-
-                    # Save AI message
-                    ai_msg = Message(
-                        id=uuid4(),
-                        chat_id=chat_id,
-                        sender_id=AI_USER_ID,
-                        content=reply
-                    )
-                    db.add(ai_msg)
-                    db.commit()
-                    db.refresh(ai_msg)
-
-                    # Broadcast AI message
-                    await manager.broadcast(chat_id, json.dumps({
-                        "type": "new_message",
-                        "data": {
-                            "message_id": str(ai_msg.id),
-                            "chat_id": str(ai_msg.chat_id),
-                            "sender_id": str(AI_USER_ID),
-                            "content": ai_msg.content,
-                            "created_at": ai_msg.created_at.isoformat()
-                        }
-                    }))
+            if action == "watch_presence":
+                await watch_presence(db, websocket, data.get("user_ids") or [])
+                continue
 
-                    # Broadcast typing end
-                    await manager.broadcast(chat_id, json.dumps({
-                        "type": "typing_status",
-                        "data": {
-                            "user_id": str(AI_USER_ID),
-                            "username": "AI Assistant",
-                            "is_typing": False
-                        }
-                    }))
+            if action == "unwatch_presence":
+                manager.unwatch_presence(websocket, [str(u) for u in data.get("user_ids") or []])
+                continue
 
-                except Exception as e:
+            chat_id = str(data.get("chat_id") or "")
+
+            if action == "subscribe":
+                if chat_id in sessions:
+                    continue
+                session, error = open_chat(db, chat_id, current_user)
+                if error:
                     await websocket.send_text(json.dumps({
                         "type": "error",
-                        "detail": f"AI reply failed: {str(e)}"
+                        "chat_id": chat_id,
+                        "detail": error[1]
                     }))
+                    continue
+                sessions[chat_id] = session
+                await manager.connect(chat_id, str(current_user.id), websocket, multiplexed=True)
+                await websocket.send_text(json.dumps({"type": "subscribed", "chat_id": chat_id}))
+                if data.get("resume_from"):
+                    await replay_missed(db, websocket, chat_id, session, data["resume_from"])
+                await manager.broadcast(chat_id, presence_event(current_user, True), exclude=websocket)
+                continue
+
+            if action == "unsubscribe":
+                if sessions.pop(chat_id, None) is not None:
+                    manager.disconnect(chat_id, websocket)
+                await websocket.send_text(json.dumps({"type": "unsubscribed", "chat_id": chat_id}))
+                continue
+
+            session = sessions.get(chat_id)
+            if session is None:
+                await websocket.send_text(json.dumps({
+                    "type": "error",
+                    "chat_id": chat_id,
+                    "detail": "Not subscribed to this chat"
+                }))
+                continue
+
+            await handle_chat_event(db, websocket, chat_id, session, current_user, data)
 
     except WebSocketDisconnect:
         pass
@@ -211,18 +521,8 @@ async def websocket_endpoint(websocket: WebSocket, chat_id: str, token: str = Qu
         pass
     finally:
         try:
-            manager.disconnect(chat_id, websocket)
-            current_user.is_online = False
-            current_user.last_seen = datetime.utcnow()
-            db.commit()
-            await manager.broadcast(chat_id, json.dumps({
-                "type": "presence_update",
-                "data": {
-                    "user_id": str(current_user.id),
-                    "is_online": False,
-                    "username": current_user.username,
-                    "last_seen": current_user.last_seen.isoformat()
-                }
-            }))
+            heartbeats.untrack(websocket)
+            manager.disconnect_all(websocket)
+            mark_offline(db, current_user, list(sessions))
         except Exception:
             pass
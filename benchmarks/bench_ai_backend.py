@@ -0,0 +1,73 @@
+"""
+AI reply path under load, offline: AIScheduler in front of the local stub backend.
+
+Each simulated chat sends messages with some think time in between; the stub answers
+with the configured first-token latency and token rate. Prints end-to-end reply
+latency, throughput and the scheduler's queue-wait figures per concurrency cap.
+
+    python -m benchmarks.bench_ai_backend --chats 200 --messages 3 --caps 8,32,128
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from app.services.ai_scheduler import AIScheduler, AIReplySuperseded, AISchedulerBusy
+from app.services.llm_backend import StubBackend
+
+
+async def chat(scheduler: AIScheduler, backend: StubBackend, chat_id: int, messages: int, think: float, out: dict):
+    for n in range(messages):
+        prompt = [{"role": "user", "content": f"chat {chat_id} question {n}"}]
+        started = time.perf_counter()
+        try:
+            await scheduler.run(chat_id, lambda: backend.complete(prompt))
+            out["latencies"].append(time.perf_counter() - started)
+        except AISchedulerBusy:
+            out["rejected"] += 1
+        except AIReplySuperseded:
+            out["superseded"] += 1
+        await asyncio.sleep(think)
+
+
+async def run(cap: int, args) -> dict:
+    scheduler = AIScheduler(max_concurrent=cap, max_queued=args.max_queued, call_timeout=60)
+    backend = StubBackend(latency_ms=args.latency_ms, tokens_per_second=args.tokens_per_second,
+                          reply_tokens=args.reply_tokens)
+    out = {"latencies": [], "rejected": 0, "superseded": 0}
+    wall_start = time.perf_counter()
+    await asyncio.gather(*[
+        chat(scheduler, backend, i, args.messages, args.think, out) for i in range(args.chats)
+    ])
+    wall = time.perf_counter() - wall_start
+    latencies = sorted(out["latencies"])
+    stats = scheduler.stats()
+    return {
+        "cap": cap,
+        "replies": len(latencies),
+        "rejected": out["rejected"],
+        "replies_per_s": round(len(latencies) / wall, 1),
+        "latency_ms_p50": round(statistics.median(latencies) * 1000) if latencies else None,
+        "latency_ms_p99": round(latencies[int(len(latencies) * 0.99) - 1] * 1000) if latencies else None,
+        "queue_wait_ms_p95": stats["queue_wait_ms_p95"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=3)
+    parser.add_argument("--think", type=float, default=0.2, help="seconds between a reply and the next message")
+    parser.add_argument("--caps", default="8,32,128", help="comma-separated concurrency caps to compare")
+    parser.add_argument("--max-queued", type=int, default=1000)
+    parser.add_argument("--latency-ms", type=float, default=400)
+    parser.add_argument("--tokens-per-second", type=float, default=60)
+    parser.add_argument("--reply-tokens", type=int, default=60)
+    args = parser.parse_args()
+
+    for cap in (int(c) for c in args.caps.split(",")):
+        print(asyncio.run(run(cap, args)))
+
+
+if __name__ == "__main__":
+    main()
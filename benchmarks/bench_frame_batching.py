@@ -0,0 +1,83 @@
+"""
+Broadcast throughput and latency with and without tick batching.
+
+Runs ConnectionManager against in-memory sockets whose send_text burns a fixed
+amount of CPU, standing in for the encode/frame/syscall work of a real socket.
+
+    python -m benchmarks.bench_frame_batching --recipients 100 --events 2000
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from app.websockets import connection_manager
+from app.websockets.connection_manager import ConnectionManager
+
+# Rough per-frame cost of a real websocket send
+FRAME_COST_SECONDS = 20e-6
+
+
+class FakeSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def send_text(self, text: str):
+        deadline = time.perf_counter() + FRAME_COST_SECONDS
+        while time.perf_counter() < deadline:
+            pass
+        self.frames.append((time.perf_counter(), text))
+
+
+async def run(mode: str, recipients: int, events: int, interval: float) -> dict:
+    manager = ConnectionManager()
+    manager.set_batch_mode("chat", mode)
+    sockets = [FakeSocket() for _ in range(recipients)]
+    for i, ws in enumerate(sockets):
+        await manager.connect("chat", f"user-{i}", ws, batch=True)
+
+    sent_at = {}
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    for seq in range(events):
+        sent_at[seq] = time.perf_counter()
+        await manager.broadcast("chat", json.dumps({"type": "new_message", "seq": seq}))
+        await asyncio.sleep(interval)
+    await asyncio.sleep(connection_manager.BATCH_TICK_SECONDS * 2)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+
+    latencies = []
+    frames = 0
+    for ws in sockets:
+        frames += len(ws.frames)
+        for received_at, text in ws.frames:
+            payload = json.loads(text)
+            for event in payload if isinstance(payload, list) else [payload]:
+                latencies.append(received_at - sent_at[event["seq"]])
+    latencies.sort()
+    return {
+        "mode": mode,
+        "frames": frames,
+        "deliveries": len(latencies),
+        "cpu_s": round(cpu, 3),
+        "deliveries_per_cpu_s": round(len(latencies) / cpu),
+        "wall_s": round(wall, 3),
+        "latency_ms_p50": round(statistics.median(latencies) * 1000, 2),
+        "latency_ms_p99": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--recipients", type=int, default=100)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--interval", type=float, default=0.001, help="seconds between events")
+    args = parser.parse_args()
+
+    for mode in ("off", "on", "auto"):
+        print(asyncio.run(run(mode, args.recipients, args.events, args.interval)))
+
+
+if __name__ == "__main__":
+    main()
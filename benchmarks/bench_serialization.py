@@ -0,0 +1,75 @@
+"""
+Cost of encoding a chat-history page: Pydantic models vs plain dicts + orjson.
+
+"pydantic" is what FastAPI does for a response_model route returning models
+(validate, jsonable_encoder, json.dumps); "orjson" is app.core.responses.fast_json.
+
+    python -m benchmarks.bench_serialization --rows 500 --repeat 50
+"""
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from app.core.responses import fast_json
+from app.schemas.messages import FullMessageResponse
+
+
+def make_rows(count: int) -> List[dict]:
+    chat_id, start = uuid.uuid4(), datetime(2025, 1, 1)
+    senders = [uuid.uuid4() for _ in range(5)]
+    return [
+        {
+            "id": uuid.uuid4(),
+            "chat_id": chat_id,
+            "sender_id": senders[i % 5],
+            "content": f"message number {i} " * 4,
+            "created_at": start + timedelta(seconds=i),
+            "is_edited": i % 7 == 0,
+            "sender_name": f"user {i % 5}",
+            "sender_image": None,
+            "media_type": None,
+            "media_url": None,
+        }
+        for i in range(count)
+    ]
+
+
+def via_pydantic(rows: List[dict]) -> bytes:
+    models = [FullMessageResponse(**row) for row in rows]
+    validated = TypeAdapter(List[FullMessageResponse]).validate_python(models)
+    return json.dumps(jsonable_encoder(validated), separators=(",", ":")).encode()
+
+
+def via_orjson(rows: List[dict]) -> bytes:
+    return fast_json(rows).body
+
+
+def timed(fn, rows: List[dict], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(rows)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    assert json.loads(via_pydantic(rows)) == json.loads(via_orjson(rows))
+    for name, fn in (("pydantic", via_pydantic), ("orjson", via_orjson)):
+        seconds = timed(fn, rows, args.repeat)
+        print({"encoder": name, "rows": args.rows, "ms_per_page": round(seconds * 1000, 3),
+               "rows_per_s": round(args.rows / seconds)})
+
+
+if __name__ == "__main__":
+    main()
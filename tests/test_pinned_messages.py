@@ -0,0 +1,44 @@
+from datetime import datetime
+from typing import List
+from uuid import uuid4
+
+from pydantic import TypeAdapter
+
+from app.schemas.pinned_message import PinnedMessageResponse
+
+pins_adapter = TypeAdapter(List[PinnedMessageResponse])
+
+
+def _pin(sender_id):
+    # Shaped as pin_cache.load_pins() returns it
+    chat_id, message_id = uuid4(), uuid4()
+    return {
+        "id": uuid4(),
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "pinned_at": datetime.utcnow(),
+        "message": {
+            "id": message_id,
+            "chat_id": chat_id,
+            "sender_id": sender_id,
+            "sender_name": None,
+            "sender_image": None,
+            "content": "reply",
+            "created_at": datetime.utcnow(),
+            "is_edited": False,
+            "media_type": None,
+            "media_url": None,
+        },
+    }
+
+
+def test_pinned_ai_reply_without_sender():
+    pins = pins_adapter.validate_python([_pin(None)])
+    assert pins[0].message.sender_id is None
+    assert pins[0].message.content == "reply"
+
+
+def test_pinned_user_message_keeps_sender():
+    sender_id = uuid4()
+    pins = pins_adapter.validate_python([_pin(sender_id)])
+    assert pins[0].message.sender_id == sender_id